@@ -1,33 +1,43 @@
 
 from fastapi import APIRouter, Depends, HTTPException, status, Request, Body
+from sqlalchemy import Select, select
 from sqlalchemy.orm import Session
-from typing import List, Optional, Any, Union
+from typing import List, Optional, Any, Tuple, Union
 from app.services.rag_service import kb_engine
 from datetime import datetime, timedelta
 from pydantic import BaseModel, Field, model_validator
 from app.core.database import get_db
-from app.models.models import Doctor, Patient, Appointment, Branch, DiagnosticTest, TestAppointment
+from app.models.models import Patient, Appointment, Branch, DiagnosticTest, TestAppointment
 from app.services import notification
+from app.services.doctor_directory import doctor_directory
+from app.services import slots
+from app.services import appointment_queries
 import logging
 import re
-from thefuzz import process
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 router = APIRouter()
+kb_router = APIRouter()  # Endpoints without database access, included by the sync and the async router alike
+
+MAX_RANGE_DAYS = 14  # /availability/range looks at most two weeks ahead
+MAX_SPECIALTY_DOCTORS = 10  # Doctors listed by /availability/specialty (the earliest-free ones)
 
 # ==========================================
 # 1. HELPERS
 # ==========================================
 
+FILLER_WORDS_RE = re.compile(r'\b(dr\.?|doctor|mr\.?|mrs\.?|please|book|appointment|with|for|i want|check)\b', flags=re.IGNORECASE)
+WHITESPACE_RE = re.compile(r'\s+')
+
 def clean_doctor_name(name_input: str) -> str:
     if not name_input: return ""
     name_input = name_input.lower().strip()
     # Remove titles and filler words
-    name_input = re.sub(r'\b(dr\.?|doctor|mr\.?|mrs\.?|please|book|appointment|with|for|i want|check)\b', '', name_input, flags=re.IGNORECASE)
-    name_input = re.sub(r'\s+', ' ', name_input).strip()
+    name_input = FILLER_WORDS_RE.sub('', name_input)
+    name_input = WHITESPACE_RE.sub(' ', name_input).strip()
     return name_input.title()
 
 def parse_datetime(date_str: str, time_str: str) -> datetime:
@@ -40,6 +50,12 @@ def parse_datetime(date_str: str, time_str: str) -> datetime:
         except ValueError:
             raise HTTPException(status_code=400, detail=f"Invalid time format: {time_str}")
 
+def kb_warming_up_response() -> dict:
+    return {
+        "results": "The hospital information service is still starting up.",
+        "instruction": "Tell the user you can't look up general hospital information just this moment and offer to help with appointments, or ask them to try again in a minute."
+    }
+
 def generate_slots(date_str: str) -> List[str]:
     slots = []
     current = datetime.strptime(f"{date_str} 09:00", "%Y-%m-%d %H:%M")
@@ -49,6 +65,101 @@ def generate_slots(date_str: str) -> List[str]:
         current += timedelta(minutes=30)
     return slots
 
+def range_availability_response(doctor_obj, booked, start_day, days: int, now: datetime, limit: int, all_slots: bool) -> dict:
+    """/availability/range answer from the doctor's (Doctor_Id, Appointment_Date) bookings in the range."""
+    # Each day's bookings become a slot bitmap
+    booked_by_day = slots.booked_bitmaps(moment for _, moment in booked)
+
+    next_available = []
+    per_day = []
+    free_slots = 0  # Free slots in the days scanned (the scan stops early once `limit` are found)
+    for offset in range(days):
+        day = start_day + timedelta(days=offset)
+        free = slots.open_mask(day, now) & ~booked_by_day.get(day, 0)
+        free_slots += bin(free).count("1")
+        if all_slots:
+            per_day.append({"date": day.isoformat(), "weekday": day.strftime("%A"), "available_slots": slots.slot_labels(free)})
+        for index in slots.iter_slots(free):
+            if len(next_available) >= limit:
+                break
+            next_available.append({"date": day.isoformat(), "weekday": day.strftime("%A"), "time": slots.SLOT_LABELS[index]})
+        if not all_slots and free_slots and len(next_available) >= limit:
+            break
+
+    response = {
+        "doctor": doctor_obj.name,
+        "branch": doctor_obj.branch_name,
+        "from": start_day.isoformat(),
+        "to": (start_day + timedelta(days=days - 1)).isoformat(),
+        "next_available": next_available,
+    }
+    if all_slots:
+        response["days"] = per_day
+    if not free_slots:
+        response["message"] = f"No free slots with {doctor_obj.name} in the next {days} days."
+    response["system_instruction"] = "STOP. Offer these slots to the user and wait for them to pick one. DO NOT call book_appointment yet."
+    return response
+
+def specialty_availability_response(speciality: str, branch_name: Optional[str], doctors, booked, start_day, days: int, now: datetime, limit: int, per_doctor: int) -> dict:
+    """/availability/specialty answer from the (Doctor_Id, Appointment_Date) bookings of all the matching doctors."""
+    # Bookings grouped per doctor and day as slot bitmaps
+    booked_by_doctor = {}
+    for doctor_id, moment in booked:
+        index = slots.slot_index(moment)
+        if index is not None:
+            per_day = booked_by_doctor.setdefault(doctor_id, {})
+            per_day[moment.date()] = per_day.get(moment.date(), 0) | (1 << index)
+
+    # Earliest free slots per doctor (the open-slot masks are the same for everyone)
+    open_days = [(day, slots.open_mask(day, now)) for day in (start_day + timedelta(days=i) for i in range(days))]
+    wanted = max(limit, per_doctor)
+    ranked = []
+    for doctor in doctors:
+        bitmaps = booked_by_doctor.get(doctor.doctor_id, {})
+        free = []
+        for day, open_slots in open_days:
+            for index in slots.iter_slots(open_slots & ~bitmaps.get(day, 0)):
+                free.append((day, index))
+                if len(free) >= wanted:
+                    break
+            if len(free) >= wanted:
+                break
+        if free:
+            ranked.append((free[0], doctor.doctor_id, doctor, free))
+    ranked.sort(key=lambda r: (r[0], r[1]))
+
+    def slot_json(day, index, doctor=None):
+        item = {"date": day.isoformat(), "weekday": day.strftime("%A"), "time": slots.SLOT_LABELS[index]}
+        if doctor:
+            item.update(doctor=doctor.name, branch=doctor.branch_name)
+        return item
+
+    # Merge: earliest slots across all doctors
+    merged = sorted((day, index, doctor.doctor_id, doctor) for _, _, doctor, free in ranked for day, index in free)[:limit]
+
+    response = {
+        "speciality": speciality,
+        "branch": branch_name,
+        "from": start_day.isoformat(),
+        "to": (start_day + timedelta(days=days - 1)).isoformat(),
+        "next_available": [slot_json(day, index, doctor) for day, index, _, doctor in merged],
+        "doctors": [
+            {
+                "doctor": doctor.name,
+                "doctor_id": doctor.doctor_id,
+                "branch": doctor.branch_name,
+                "specialization": doctor.specialization,
+                "next_available": [slot_json(day, index) for day, index in free[:per_doctor]],
+            }
+            for _, _, doctor, free in ranked[:MAX_SPECIALTY_DOCTORS]
+        ],
+        "doctors_available": len(ranked),
+    }
+    if not ranked:
+        response["message"] = f"None of the {len(doctors)} {speciality} doctors has a free slot in the next {days} days."
+    response["system_instruction"] = "STOP. Offer these doctors and slots to the user and wait for them to pick one. DO NOT call book_appointment yet."
+    return response
+
 # ==========================================
 # 2. PYDANTIC MODELS (Strict Input Schema)
 # ==========================================
@@ -117,6 +228,72 @@ class AvailabilityRequest(BaseModel):
                 
         return data
 
+class AvailabilityRangeRequest(BaseModel):
+    doctor_name: str
+    start_date: Optional[str] = None  # YYYY-MM-DD, default today
+    days: int = 7
+    limit: int = 3                    # First N free slots to return
+    all_slots: bool = False           # Also list every free slot per day
+    branch_id: Optional[int] = None
+
+    @model_validator(mode='before')
+    @classmethod
+    def fix_keys(cls, data: Any) -> Any:
+        if isinstance(data, dict):
+            # 1. CLEAN KEYS: Remove \r, \n, and spaces from all keys
+            data = {k.strip().replace('\r', '').replace('\n', ''): v for k, v in data.items()}
+
+            # 2. Map Aliases (Handle AI mistakes)
+            if 'doctor_name' not in data:
+                data['doctor_name'] = data.get('doctor') or data.get('doctorName')
+            if 'start_date' not in data:
+                data['start_date'] = data.get('date') or data.get('from_date') or data.get('startDate')
+            if 'days' not in data and 'num_days' in data:
+                data['days'] = data['num_days']
+            if 'limit' not in data and 'count' in data:
+                data['limit'] = data['count']
+            if 'branch_id' not in data:
+                data['branch_id'] = data.get('branchId') or data.get('branch')
+
+            # 3. Handle Empty Strings
+            for key in ('branch_id', 'start_date', 'days', 'limit'):
+                if data.get(key) == "":
+                    data.pop(key)
+        return data
+
+class SpecialtyAvailabilityRequest(BaseModel):
+    speciality: str
+    branch: Optional[Union[int, str]] = None  # Branch_Id or a branch name ("Al Safa")
+    start_date: Optional[str] = None          # YYYY-MM-DD, default today
+    days: int = 1
+    limit: int = 5                            # Earliest free slots returned across all doctors
+    per_doctor: int = 3                       # Free slots listed per doctor
+
+    @model_validator(mode='before')
+    @classmethod
+    def fix_keys(cls, data: Any) -> Any:
+        if isinstance(data, dict):
+            # 1. CLEAN KEYS: Remove \r, \n, and spaces from all keys
+            data = {k.strip().replace('\r', '').replace('\n', ''): v for k, v in data.items()}
+
+            # 2. Map Aliases (Handle AI mistakes)
+            if 'speciality' not in data:
+                data['speciality'] = data.get('specialty') or data.get('specialization') or data.get('department') or data.get('category')
+            if 'branch' not in data:
+                data['branch'] = data.get('branch_id') or data.get('branchId') or data.get('branch_name') or data.get('location')
+            if 'start_date' not in data:
+                data['start_date'] = data.get('date') or data.get('from_date') or data.get('startDate')
+            if 'days' not in data and data.get('num_days'):
+                data['days'] = data['num_days']
+            if 'limit' not in data and data.get('count'):
+                data['limit'] = data['count']
+
+            # 3. Handle Empty Strings
+            for key in ('branch', 'start_date', 'days', 'limit', 'per_doctor'):
+                if data.get(key) == "":
+                    data.pop(key)
+        return data
+
 class PatientBase(BaseModel):
     name: str
     phone: str
@@ -273,339 +450,501 @@ def get_safe_int(val: Any) -> Optional[int]:
     except ValueError: return None
 
 # ==========================================
-# 3. ENDPOINTS (ALL POST)
+# 3. REQUEST -> RESPONSE LOGIC
 # ==========================================
+# What every database endpoint decides, as plain functions over rows that were
+# already fetched. The handlers below and the async ones in routes_async.py only
+# run the queries, commits and notifications in between, so both answer alike.
 
-@router.post("/branches")
-def get_branches(db: Session = Depends(get_db)):
-    branches = db.query(Branch).all()
-    return [{"id": b.Branch_Id, "name": b.Branch_Name, "location": b.Location} for b in branches]
+def patient_by_id(patient_id) -> Select:
+    return select(Patient).where(Patient.Patient_Id == patient_id).limit(1)
 
-@router.post("/doctors")
-def get_doctors(req: GetDoctorsRequest, db: Session = Depends(get_db)):
-    """
-    Fetch doctors, optionally filtered by Branch and Speciality.
-    """
-    query = db.query(Doctor)
-    
-    # Filter by Branch (if provided)
-    if req.branch_id:
-        query = query.filter(Doctor.Branch_Id == req.branch_id)
-        
-    # Filter by Speciality (if provided)
-    if req.speciality:
-        # Case-insensitive search (e.g., "cardio" matches "Cardiologist")
-        query = query.filter(Doctor.Specialization.ilike(f"%{req.speciality}%"))
-        
-    doctors = query.all()
-    
-    if not doctors:
-        return []
+def patient_by_phone(phone: str) -> Select:
+    return select(Patient).where(Patient.Phone_Number == phone).limit(1)
+
+def test_by_name(test_name: str, department: Optional[str] = None) -> Select:
+    """First diagnostic test whose name contains test_name (case-insensitive), optionally in one department."""
+    query = select(DiagnosticTest).where(DiagnosticTest.Test_Name.ilike(f"%{test_name}%"))
+    if department is not None:
+        query = query.where(DiagnosticTest.Department.ilike(department))
+    return query.limit(1)
+
+def day_range(start_day, days: int) -> Tuple[datetime, datetime]:
+    """[midnight of start_day, midnight `days` later): the booked_slots() window of a range request."""
+    range_start = datetime.combine(start_day, datetime.min.time())
+    return range_start, range_start + timedelta(days=days)
+
+def branches_response(branches) -> List[dict]:
+    return [{"id": b.Branch_Id, "name": b.Branch_Name, "location": b.Location} for b in branches]
 
+def doctors_response(doctors) -> List[dict]:
     return [
         {
-            "id": d.Doctor_Id, 
-            "name": d.Doctor_Name, 
-            "specialization": d.Specialization, 
-            "branch_id": d.Branch_Id
+            "id": d.doctor_id, 
+            "name": d.name, 
+            "specialization": d.specialization, 
+            "branch_id": d.branch_id
         } 
         for d in doctors
     ]
 
-# --- THIS WAS MISSING ---
-@router.post("/patient/verify")
-def verify_patient(req: VerifyRequest, db: Session = Depends(get_db)):
-    """Verify if a patient exists by ID."""
-    logger.info(f"Verifying Patient ID: {req.patient_id}")
-    patient = db.query(Patient).filter(Patient.Patient_Id == req.patient_id).first()
+def verified_patient_response(patient) -> dict:
     if not patient: raise HTTPException(status_code=404, detail="Patient ID invalid.")
     return {"status": "verified", "patient_id": patient.Patient_Id, "name": patient.Patient_Name}
 
-@router.post("/availability")
-def check_availability(req: AvailabilityRequest, db: Session = Depends(get_db)):
+def find_doctor(directory, clean_doctor: str, branch_id: Optional[int] = None, booking: bool = False):
+    """
+    (doctor, None) from the cached directory (name match with fuzzy fallback), or
+    (None, the "not found" response with suggestions). Booking words it for the assistant.
+    """
+    doctor = directory.resolve(clean_doctor, branch_id)
+    if doctor:
+        return doctor, None
+    suggestions = directory.suggest(clean_doctor, branch_id)
+    if booking:
+        if suggestions:
+            return None, {"status": "error", "message": f"I couldn't find a doctor named '{clean_doctor}'. Ask the user if they meant {' or '.join(suggestions)}.", "suggestions": suggestions}
+        return None, {"status": "error", "message": f"I couldn't find a doctor named '{clean_doctor}'."}
+    if suggestions:
+        return None, {"status": "error", "message": f"Doctor '{clean_doctor}' not found. Did you mean {' or '.join(suggestions)}?", "suggestions": suggestions}
+    return None, {"status": "error", "message": f"Doctor '{clean_doctor}' not found."}
+
+def availability_request_error(req: AvailabilityRequest) -> Optional[dict]:
     # Handled missing params gracefully to prevent Vapi 422 loops
     if not req.doctor_name:
         return {"status": "error", "message": "Please provide a doctor name."}
-    
-    clean_doctor = clean_doctor_name(req.doctor_name)
-    
-    # Use today's date if not provided (or handle error)
     if not req.date:
-         return {"status": "error", "message": "Please provide a date (YYYY-MM-DD)."}
-
-    logger.info(f"Checking Availability: Doc='{clean_doctor}', Date={req.date}")
-
-    query = db.query(Doctor).filter(Doctor.Doctor_Name.ilike(f"%{clean_doctor}%"))
-    if req.branch_id: query = query.filter(Doctor.Branch_Id == req.branch_id)
-    doctor_obj = query.first()
-
-    if not doctor_obj:
-        # Fallback: Fuzzy Search
-        all_docs_query = db.query(Doctor)
-        if req.branch_id: all_docs_query = all_docs_query.filter(Doctor.Branch_Id == req.branch_id)
-        all_docs = all_docs_query.all()
-        doc_names = [d.Doctor_Name for d in all_docs]
-        
-        if doc_names:
-            match = process.extractOne(clean_doctor, doc_names)
-            if match and match[1] > 70: 
-                doctor_obj = next(d for d in all_docs if d.Doctor_Name == match[0])
-
-    if not doctor_obj: 
-        return {"status": "error", "message": f"Doctor '{clean_doctor}' not found."}
+        return {"status": "error", "message": "Please provide a date (YYYY-MM-DD)."}
+    return None
 
+def availability_day(req: AvailabilityRequest, doctor_obj):
+    """(the requested day, None), or (None, the response to send instead: bad date or Sunday)."""
     try: target_date = datetime.strptime(req.date, "%Y-%m-%d")
-    except ValueError: return {"status": "error", "message": "Invalid date format. Use YYYY-MM-DD."}
-    
-    if target_date.weekday() == 6: return {"doctor": doctor_obj.Doctor_Name, "available_slots": [], "message": "Closed on Sundays."}
-
-    booked = db.query(Appointment).filter(Appointment.Doctor_Id == doctor_obj.Doctor_Id, Appointment.Appointment_Date >= target_date, Appointment.Appointment_Date < target_date + timedelta(days=1), Appointment.Appointment_Status.in_(["SCHEDULED", "RESCHEDULED"])).all()
-    booked_times = {appt.Appointment_Date.strftime("%H:%M") for appt in booked}
-    all_slots = generate_slots(req.date)
-    available = [slot for slot in all_slots if slot not in booked_times]
-    
-    return {"doctor": doctor_obj.Doctor_Name, "branch": doctor_obj.branch.Branch_Name, "available_slots": available,"system_instruction": "STOP. Read these slots to the user and wait for them to pick one. DO NOT call book_appointment yet."}
-
-@router.post("/patient/register", status_code=status.HTTP_201_CREATED)
-def register_patient(patient_data: PatientBase, request: Request, db: Session = Depends(get_db)):
-    existing = db.query(Patient).filter(Patient.Phone_Number == patient_data.phone).first()
-    if existing: return {"status": "exists", "patient_id": existing.Patient_Id}
-    new_patient = Patient(Patient_Name=patient_data.name, Phone_Number=patient_data.phone, Email_Id=patient_data.email, Gender_Id=patient_data.gender_id, CreatedBy=1, CreatedIpAddress=request.client.host, CreatedAt=datetime.now())
-    db.add(new_patient); db.commit(); db.refresh(new_patient)
-    if patient_data.email: notification.send_welcome_email(patient_data.name, patient_data.email, new_patient.Patient_Id)
-    return {"status": "created", "patient_id": new_patient.Patient_Id}
-
-# --- PASTE THIS IN THE ENDPOINTS SECTION ---
+    except ValueError: return None, {"status": "error", "message": "Invalid date format. Use YYYY-MM-DD."}
+    if target_date.weekday() == 6: return None, {"doctor": doctor_obj.name, "available_slots": [], "message": "Closed on Sundays."}
+    return target_date, None
+
+def availability_response(req: AvailabilityRequest, doctor_obj, booked) -> dict:
+    """/availability answer from the doctor's (Doctor_Id, Appointment_Date) bookings that day."""
+    booked_times = {moment.strftime("%H:%M") for _, moment in booked}
+    available = [slot for slot in generate_slots(req.date) if slot not in booked_times]
+    return {"doctor": doctor_obj.name, "branch": doctor_obj.branch_name, "available_slots": available,"system_instruction": "STOP. Read these slots to the user and wait for them to pick one. DO NOT call book_appointment yet."}
+
+def parse_range(start_date: Optional[str], days: int, now: datetime):
+    """(first day, number of days, None) of a range request (never in the past, at most MAX_RANGE_DAYS), or (None, None, error)."""
+    try:
+        start_day = datetime.strptime(start_date, "%Y-%m-%d").date() if start_date else now.date()
+    except ValueError:
+        return None, None, {"status": "error", "message": "Invalid date format. Use YYYY-MM-DD."}
+    return max(start_day, now.date()), min(max(days, 1), MAX_RANGE_DAYS), None
+
+def specialty_doctors(directory, req: SpecialtyAvailabilityRequest):
+    """(branch_id, the matching doctors, None), or (None, (), error) when the branch or the specialists aren't found."""
+    branch_id = directory.branch_id_for(req.branch)
+    if req.branch not in (None, "") and branch_id is None:
+        return None, (), {"status": "error", "message": f"I couldn't find a branch called '{req.branch}'."}
+    doctors = directory.filter(branch_id=branch_id, speciality=req.speciality)
+    if not doctors:
+        return None, (), {"status": "error", "message": f"No {req.speciality} doctors found" + (" at that branch." if branch_id else ".")}
+    return branch_id, doctors, None
 
-@router.post("/book")
-def book_appointment(booking: BookRequest, request: Request, db: Session = Depends(get_db)):
-    """
-    Definition: Used to book an appointment.
-    Input Parameters:
-      - booking (BookRequest): JSON body containing patient_id, doctor_name, date, time.
-    Response Format: JSON with status ("confirmed" or "error") and message.
-    """
-    # 1. DEBUG LOG: See EXACTLY what Vapi sent
-    logger.info(f"BOOKING REQUEST DATA: {booking.dict()}")
+def new_patient_row(patient_data: PatientBase, request: Request) -> Patient:
+    return Patient(Patient_Name=patient_data.name, Phone_Number=patient_data.phone, Email_Id=patient_data.email, Gender_Id=patient_data.gender_id, CreatedBy=1, CreatedIpAddress=request.client.host, CreatedAt=datetime.now())
 
-    # 2. FAIL FAST: Validate date
+def parse_booking(booking: BookRequest):
+    """(appointment datetime, None), or (None, the error telling the assistant what to ask for)."""
+    # FAIL FAST: Validate date
     if not booking.date or not str(booking.date).strip():
         logger.warning("Booking failed: Missing 'date' parameter.")
-        return {
+        return None, {
             "status": "error",
             "message": "I need the appointment date. Please ask the user which date they want."
         }
 
-    # 3. FAIL FAST: Validate time
+    # FAIL FAST: Validate time
     if not booking.time or not str(booking.time).strip():
         logger.warning("Booking failed: Missing 'time' parameter.")
-        return {
+        return None, {
             "status": "error",
             "message": "I need the appointment time. Please ask the user: 'What time would you like to book?' and then call this tool again with the time filled in."
         }
 
     # Normalize time safely (for voice / AI messy input)
-    time_clean = str(booking.time).strip()
-
-    # 4. Logic & Parse Date/Time
-    pid = booking.patient_id
     try:
-        appt_dt = parse_datetime(booking.date, time_clean)
-        # --- NEW: Format time perfectly (e.g. "09:00") ---
-        formatted_time = appt_dt.strftime("%H:%M")
+        appt_dt = parse_datetime(booking.date, str(booking.time).strip())
     except Exception as e:
         logger.error(f"Date Parse Error: {e}")
-        return {"status": "error", "message": "I didn't understand that date or time. Please say it again clearly."}
-        
+        return None, {"status": "error", "message": "I didn't understand that date or time. Please say it again clearly."}
+
     if appt_dt.weekday() == 6: 
-        return {"status": "error", "message": "The clinic is closed on Sundays."}
+        return None, {"status": "error", "message": "The clinic is closed on Sundays."}
+    return appt_dt, None
 
-    # 5. Find Doctor (with Fuzzy Fallback)
-    clean_doc = clean_doctor_name(booking.doctor_name)
-    doctor = db.query(Doctor).filter(Doctor.Doctor_Name.ilike(f"%{clean_doc}%")).first()
-    
-    if not doctor:
-        all_docs = db.query(Doctor).all()
-        names = [d.Doctor_Name for d in all_docs]
-        match = process.extractOne(clean_doc, names) if names else None
-        if match and match[1] > 70: 
-            doctor = next(d for d in all_docs if d.Doctor_Name == match[0])
-
-    if not doctor: 
-        return {"status": "error", "message": f"I couldn't find a doctor named '{clean_doc}'."}
-
-    # 6. Find Patient
-    patient = db.query(Patient).filter(Patient.Patient_Id == pid).first()
+def booking_error(patient, conflict) -> Optional[dict]:
+    """Why the booking can't go ahead, given the patient row and any active booking holding the slot (None = book it)."""
     if not patient: 
         return {"status": "error", "message": "I can't find your Patient ID. Please register first."}
-
-    # 7. Check for Conflicts
-    conflict = db.query(Appointment).filter(
-        Appointment.Doctor_Id == doctor.Doctor_Id, 
-        Appointment.Appointment_Date == appt_dt, 
-        Appointment.Appointment_Status.in_(["SCHEDULED", "RESCHEDULED"])
-    ).first()
-    
     if conflict: 
         return {"status": "error", "message": "That time slot is already taken. Please pick another time."}
+    return None
 
-    # 8. Create Appointment
-    new_appt = Appointment(
+def new_appointment_row(patient, doctor, appt_dt: datetime, request: Request) -> Appointment:
+    return Appointment(
         Patient_Id=patient.Patient_Id, 
-        Doctor_Id=doctor.Doctor_Id, 
+        Doctor_Id=doctor.doctor_id, 
         Appointment_Date=appt_dt, 
         Appointment_Status="SCHEDULED", 
         CreatedBy=1, 
         CreatedIpAddress=request.client.host, 
         CreatedAt=datetime.now()
     )
-    db.add(new_appt)
-    db.commit()
-    
-    # 9. Send Notification (Using formatted_time)
-    if patient.Email_Id: 
-        notification.send_booking_confirmation(
-            patient.Email_Id, 
-            doctor.Doctor_Name, 
-            f"{booking.date} {formatted_time}", 
-            patient.Patient_Id,
-            new_appt.Appointment_Id
-        )
-        
-    # 10. Return Success (Using formatted_time)
+
+def booked_response(booking: BookRequest, doctor, new_appt, appt_dt: datetime) -> dict:
     return {
         "status": "confirmed", 
         "appointment_id": new_appt.Appointment_Id, 
-        "message": f"Appointment confirmed with Dr. {doctor.Doctor_Name} on {booking.date} at {formatted_time}."
+        "message": f"Appointment confirmed with Dr. {doctor.name} on {booking.date} at {appt_dt.strftime('%H:%M')}."
     }
 
-# Paste this in your Endpoints section
-@router.post("/appointment/reschedule")
-def reschedule_appointment(req: RescheduleRequest, request: Request, db: Session = Depends(get_db)):
-    """
-    Definition: Reschedule an existing appointment.
-    """
-    # 1. DEBUG LOG: See EXACTLY what Vapi sent
-    logger.info(f"RESCHEDULE REQUEST DATA: {req.dict()}")
-
-    # 2. FAIL FAST: Check for missing inputs
+def parse_reschedule(req: RescheduleRequest):
+    """(new appointment datetime, None), or (None, the error telling the assistant what to ask for)."""
     if not req.patient_id:
-        return {
+        return None, {
             "status": "error", 
             "message": "I lost the Patient ID. Please ask the user for their ID again."
         }
 
     if not req.new_date or not str(req.new_date).strip():
-        return {
+        return None, {
             "status": "error", 
             "message": "I need the new date. Please ask the user: 'What date would you like to move your appointment to?'"
         }
     
     if not req.new_time or not str(req.new_time).strip():
-        return {
+        return None, {
             "status": "error", 
             "message": "I need the new time. Please ask the user: 'What time works for you?'"
         }
 
-    # Normalize inputs
-    time_clean = str(req.new_time).strip()
-    
-    # 3. Parse New Date/Time
     try:
-        new_dt = parse_datetime(req.new_date, time_clean)
-        formatted_time = new_dt.strftime("%H:%M")
+        new_dt = parse_datetime(req.new_date, str(req.new_time).strip())
     except Exception as e:
         logger.error(f"Date Parse Error: {e}")
-        return {"status": "error", "message": "I didn't understand that date or time. Please say it again clearly."}
+        return None, {"status": "error", "message": "I didn't understand that date or time. Please say it again clearly."}
 
     if new_dt.weekday() == 6: 
-        return {"status": "error", "message": "The clinic is closed on Sundays."}
-
-    # 4. Find the Existing Appointment
-    appt = db.query(Appointment).filter(
-        Appointment.Patient_Id == req.patient_id, 
-        Appointment.Appointment_Status.in_(["SCHEDULED", "RESCHEDULED"]), 
-        Appointment.Appointment_Date >= datetime.now()
-    ).order_by(Appointment.Appointment_Date.asc()).first()
+        return None, {"status": "error", "message": "The clinic is closed on Sundays."}
+    return new_dt, None
 
+def reschedule_error(appt, conflict) -> Optional[dict]:
+    """Why the move can't go ahead, given the patient's next appointment and any active booking holding the new slot."""
     if not appt: 
         return {"status": "error", "message": "I couldn't find any upcoming appointments for your ID."}
-    
-    old_time_str = appt.Appointment_Date.strftime("%Y-%m-%d %H:%M")
-
-    # 5. Check for Conflicts
-    conflict = db.query(Appointment).filter(
-        Appointment.Doctor_Id == appt.Doctor_Id,
-        Appointment.Appointment_Date == new_dt,
-        Appointment.Appointment_Status.in_(["SCHEDULED", "RESCHEDULED"])
-    ).first()
-
     if conflict:
         return {"status": "error", "message": "That new time slot is already taken. Please pick another time."}
-    # 6. Get Doctor Name (Needed for Email)
-    doctor = db.query(Doctor).filter(Doctor.Doctor_Id == appt.Doctor_Id).first()
-    doctor_name = doctor.Doctor_Name if doctor else "Unknown Doctor"
-    
-    # 6. Update Appointment
+    return None
+
+def apply_reschedule(appt, new_dt: datetime) -> str:
+    """Moves the appointment (caller commits); returns its old time for the notification."""
+    old_time_str = appt.Appointment_Date.strftime("%Y-%m-%d %H:%M")
     appt.Appointment_Date = new_dt
     appt.Appointment_Status = "RESCHEDULED"
     appt.ModifiedAt = datetime.now()
+    return old_time_str
+
+def rescheduled_response(req: RescheduleRequest, new_dt: datetime) -> dict:
+    new_time = f"{req.new_date} {new_dt.strftime('%H:%M')}"
+    return {
+        "status": "rescheduled", 
+        "message": f"Appointment successfully moved to {req.new_date} at {new_dt.strftime('%H:%M')}.",
+        "new_time": new_time
+    }
+
+def cancel_request_error(req: CancelRequest) -> Optional[dict]:
+    # If Vapi sends 0 or None, reject it immediately.
+    if not req.patient_id or req.patient_id == 0:
+        logger.error("Vapi sent an empty Patient ID for cancellation.")
+        return {
+            "status": "error", 
+            "message": "I lost the patient ID. Please ask the user for their ID again or use the one from the verification step."
+        }
+    return None
+
+def cancel_error(appt) -> Optional[dict]:
+    if not appt: 
+        return {"status": "error", "message": "I couldn't find any active appointments for that ID."}
+    return None
+
+def apply_cancel(appt) -> str:
+    """Cancels the appointment (caller commits); returns its time for the notification and the answer."""
+    appt.Appointment_Status = "CANCELLED"
+    appt.ModifiedBy = 1
+    appt.ModifiedAt = datetime.now()
+    return appt.Appointment_Date.strftime("%Y-%m-%d %H:%M")
+
+def cancelled_response(appt_time: str) -> dict:
+    return {"status": "cancelled", "message": f"Appointment on {appt_time} has been cancelled."}
+
+def test_availability_response(req: TestRequest, test_obj) -> dict:
+    """/check_test answer for the test row found (None when there is no such test)."""
+    if not test_obj:
+        return {"status": "error", "message": f"I couldn't find a test named '{req.test_name}'."}
+
+    if test_obj.Is_Available:
+        return {
+            "status": "available",
+            "test": test_obj.Test_Name,
+            "cost": f"₹{int(test_obj.Price) if test_obj.Price else 0}",
+            "schedule": test_obj.Schedule,
+            "message": f"Yes, the {test_obj.Test_Name} is available. It costs ₹{int(test_obj.Price)} and the schedule is: {test_obj.Schedule}."
+        }
+    return {
+        "status": "unavailable",
+        "test": test_obj.Test_Name,
+        "referral": test_obj.Referral_Name,
+        "contact": test_obj.Referral_Contact,
+        "message": f"We do not conduct {test_obj.Test_Name} here. We recommend contacting {test_obj.Referral_Name} at {test_obj.Referral_Contact}."
+    }
+
+def book_test_error(req: BookTestRequest, test_obj) -> Optional[dict]:
+    """Why the test can't be booked, given its row (None = go on and look up the patient)."""
+    if not test_obj:
+        return {"status": "error", "message": f"Test '{req.test_name}' not found."}
+    if not test_obj.Is_Available:
+        return {"status": "error", "message": f"Sorry, {test_obj.Test_Name} is not available here."}
+    return None
+
+def book_test_patient_error(patient) -> Optional[dict]:
+    if not patient:
+        return {"status": "error", "message": "Invalid Patient ID."}
+    return None
+
+def test_booked_response(req: BookTestRequest, test_obj, new_booking, appt_datetime: datetime) -> dict:
+    return {
+        "status": "success",
+        "message": f"Confirmed! {test_obj.Test_Name} booked for {req.date} at {appt_datetime.strftime('%H:%M')}. Your booking ID is T-{new_booking.Test_Appt_Id}."
+    }
+
+# ==========================================
+# 4. ENDPOINTS (ALL POST)
+# ==========================================
+
+@router.post("/branches")
+def get_branches(db: Session = Depends(get_db)):
+    return branches_response(db.scalars(select(Branch)).all())
+
+@router.post("/doctors")
+def get_doctors(req: GetDoctorsRequest, db: Session = Depends(get_db)):
+    """
+    Fetch doctors, optionally filtered by Branch and Speciality.
+    Served from the cached doctor directory (branch partition + case-insensitive
+    speciality match, e.g. "cardio" matches "Cardiologist").
+    """
+    return doctors_response(doctor_directory.filter(db, branch_id=req.branch_id, speciality=req.speciality))
+
+# --- THIS WAS MISSING ---
+@router.post("/patient/verify")
+def verify_patient(req: VerifyRequest, db: Session = Depends(get_db)):
+    """Verify if a patient exists by ID."""
+    logger.info(f"Verifying Patient ID: {req.patient_id}")
+    return verified_patient_response(db.scalar(patient_by_id(req.patient_id)))
+
+@router.post("/availability")
+def check_availability(req: AvailabilityRequest, db: Session = Depends(get_db)):
+    error = availability_request_error(req)
+    if error: return error
+    
+    clean_doctor = clean_doctor_name(req.doctor_name)
+    logger.info(f"Checking Availability: Doc='{clean_doctor}', Date={req.date}")
+
+    # Name match with fuzzy fallback, in memory (cached directory, partitioned by branch)
+    doctor_obj, error = find_doctor(doctor_directory.get(db), clean_doctor, req.branch_id)
+    if error: return error
+
+    target_date, error = availability_day(req, doctor_obj)
+    if error: return error
+
+    booked = db.execute(appointment_queries.booked_slots([doctor_obj.doctor_id], target_date, target_date + timedelta(days=1))).all()
+    return availability_response(req, doctor_obj, booked)
+
+@router.post("/availability/range")
+def check_availability_range(req: AvailabilityRangeRequest, db: Session = Depends(get_db)):
+    """
+    Definition: Next free slots of one doctor over several days ("whenever Dr. X is free this week").
+    Input Parameters:
+      - req (AvailabilityRangeRequest): doctor_name, start_date (default today), days (max 14),
+        limit (first N free slots), all_slots (also list every free slot per day), branch_id.
+    Response Format: JSON with next_available [{date, time}] and, if all_slots, days [{date, weekday, available_slots}].
+    Sundays and times that have already passed are never offered.
+    """
+    if not req.doctor_name:
+        return {"status": "error", "message": "Please provide a doctor name."}
+
+    clean_doctor = clean_doctor_name(req.doctor_name)
+    now = datetime.now()
+    start_day, days, error = parse_range(req.start_date, req.days, now)
+    if error: return error
+
+    logger.info(f"Checking Availability Range: Doc='{clean_doctor}', From={start_day}, Days={days}")
+
+    doctor_obj, error = find_doctor(doctor_directory.get(db), clean_doctor, req.branch_id)
+    if error: return error
+
+    # One query for the whole range
+    booked = db.execute(appointment_queries.booked_slots([doctor_obj.doctor_id], *day_range(start_day, days))).all()
+    return range_availability_response(doctor_obj, booked, start_day, days, now, max(req.limit, 0), req.all_slots)
+
+@router.post("/availability/specialty")
+def check_specialty_availability(req: SpecialtyAvailabilityRequest, db: Session = Depends(get_db)):
+    """
+    Definition: Free slots of every doctor of a specialty ("any cardiologist at the Al Safa branch tomorrow?").
+    Input Parameters:
+      - req (SpecialtyAvailabilityRequest): speciality, branch (id or name, optional), start_date (default today),
+        days (max 14), limit (earliest slots across all doctors), per_doctor.
+    Response Format: JSON with next_available [{date, time, doctor, branch}] across doctors, earliest first,
+    and doctors [{doctor, branch, specialization, next_available}] ranked by their earliest free slot
+    (the first MAX_SPECIALTY_DOCTORS; doctors_available counts them all).
+    """
+    if not req.speciality or not str(req.speciality).strip():
+        return {"status": "error", "message": "Please provide a speciality (e.g. cardiology)."}
+
+    now = datetime.now()
+    start_day, days, error = parse_range(req.start_date, req.days, now)
+    if error: return error
+
+    # 1. Doctors from the cached directory (no DB round trip, no lazy branch loads)
+    directory = doctor_directory.get(db)
+    branch_id, doctors, error = specialty_doctors(directory, req)
+    if error: return error
+
+    logger.info(f"Checking Specialty Availability: Speciality='{req.speciality}', Branch={branch_id}, From={start_day}, Days={days}")
+
+    # 2. Every booking of every one of them in the range, in one query
+    booked = db.execute(appointment_queries.booked_slots([d.doctor_id for d in doctors], *day_range(start_day, days))).all()
+
+    # 3. Earliest free slots per doctor, and merged across doctors
+    branch_name = directory.branch_names.get(branch_id) if branch_id else None
+    return specialty_availability_response(req.speciality, branch_name, doctors, booked, start_day, days, now, max(req.limit, 0), max(req.per_doctor, 0))
+
+@router.post("/patient/register", status_code=status.HTTP_201_CREATED)
+def register_patient(patient_data: PatientBase, request: Request, db: Session = Depends(get_db)):
+    existing = db.scalar(patient_by_phone(patient_data.phone))
+    if existing: return {"status": "exists", "patient_id": existing.Patient_Id}
+    new_patient = new_patient_row(patient_data, request)
+    db.add(new_patient); db.commit(); db.refresh(new_patient)
+    if patient_data.email: notification.send_welcome_email(patient_data.name, patient_data.email, new_patient.Patient_Id)
+    return {"status": "created", "patient_id": new_patient.Patient_Id}
+
+# --- PASTE THIS IN THE ENDPOINTS SECTION ---
+
+@router.post("/book")
+def book_appointment(booking: BookRequest, request: Request, db: Session = Depends(get_db)):
+    """
+    Definition: Used to book an appointment.
+    Input Parameters:
+      - booking (BookRequest): JSON body containing patient_id, doctor_name, date, time.
+    Response Format: JSON with status ("confirmed" or "error") and message.
+    """
+    # 1. DEBUG LOG: See EXACTLY what Vapi sent
+    logger.info(f"BOOKING REQUEST DATA: {booking.dict()}")
+
+    # 2. FAIL FAST: Validate and parse date/time
+    appt_dt, error = parse_booking(booking)
+    if error: return error
+
+    # 3. Find Doctor (with Fuzzy Fallback, from the cached directory)
+    doctor, error = find_doctor(doctor_directory.get(db), clean_doctor_name(booking.doctor_name), booking=True)
+    if error: return error
+
+    # 4. Find Patient and check for Conflicts
+    patient = db.scalar(patient_by_id(booking.patient_id))
+    conflict = db.scalar(appointment_queries.slot_taken(doctor.doctor_id, appt_dt)) if patient else None
+    error = booking_error(patient, conflict)
+    if error: return error
+
+    # 5. Create Appointment
+    new_appt = new_appointment_row(patient, doctor, appt_dt, request)
+    db.add(new_appt)
+    db.commit()
+    
+    # 6. Send Notification
+    if patient.Email_Id: 
+        notification.send_booking_confirmation(
+            patient.Email_Id, 
+            doctor.name, 
+            f"{booking.date} {appt_dt.strftime('%H:%M')}", 
+            patient.Patient_Id,
+            new_appt.Appointment_Id
+        )
+        
+    # 7. Return Success
+    return booked_response(booking, doctor, new_appt, appt_dt)
+
+# Paste this in your Endpoints section
+@router.post("/appointment/reschedule")
+def reschedule_appointment(req: RescheduleRequest, request: Request, db: Session = Depends(get_db)):
+    """
+    Definition: Reschedule an existing appointment.
+    """
+    # 1. DEBUG LOG: See EXACTLY what Vapi sent
+    logger.info(f"RESCHEDULE REQUEST DATA: {req.dict()}")
+
+    # 2. FAIL FAST: Check for missing inputs, parse New Date/Time
+    new_dt, error = parse_reschedule(req)
+    if error: return error
+
+    # 3. Find the Existing Appointment and check for Conflicts
+    appt = db.scalar(appointment_queries.next_upcoming(req.patient_id, datetime.now()))
+    conflict = db.scalar(appointment_queries.slot_taken(appt.Doctor_Id, new_dt)) if appt else None
+    error = reschedule_error(appt, conflict)
+    if error: return error
+
+    # 4. Get Doctor Name (Needed for Email)
+    doctor = doctor_directory.by_id(db, appt.Doctor_Id)
+    doctor_name = doctor.name if doctor else "Unknown Doctor"
+    
+    # 5. Update Appointment
+    old_time_str = apply_reschedule(appt, new_dt)
     db.commit()
     
-    # 7. Notify Patient
-    patient = db.query(Patient).filter(Patient.Patient_Id == appt.Patient_Id).first()
+    # 6. Notify Patient
+    patient = db.scalar(patient_by_id(appt.Patient_Id))
     if patient and patient.Email_Id: 
         notification.send_reschedule_notification(
             patient.Email_Id, 
             doctor_name,
             old_time_str, 
-            f"{req.new_date} {formatted_time}", 
+            f"{req.new_date} {new_dt.strftime('%H:%M')}", 
             patient.Patient_Id,
             appt.Appointment_Id
-            
         )
 
-    return {
-        "status": "rescheduled", 
-        "message": f"Appointment successfully moved to {req.new_date} at {formatted_time}.",
-        "new_time": f"{req.new_date} {formatted_time}"
-    }
+    return rescheduled_response(req, new_dt)
+
 @router.post("/appointment/cancel")
 def cancel_appointment(req: CancelRequest, request: Request, db: Session = Depends(get_db)):
     # --- SAFETY CHECK ---
-    # If Vapi sends 0 or None, reject it immediately.
-    if not req.patient_id or req.patient_id == 0:
-        logger.error("Vapi sent an empty Patient ID for cancellation.")
-        return {
-            "status": "error", 
-            "message": "I lost the patient ID. Please ask the user for their ID again or use the one from the verification step."
-        }
+    error = cancel_request_error(req)
+    if error: return error
     # --------------------
     # 1. Logging
     logger.info(f"Received Cancel Request for Patient ID: {req.patient_id}")
 
     # 2. Logic: Find the appointment
-    # We use 'desc()' to find the LATEST appointment. 
-    appt = db.query(Appointment).filter(
-        Appointment.Patient_Id == req.patient_id,
-        Appointment.Appointment_Status.in_(["SCHEDULED", "RESCHEDULED"])
-    ).order_by(Appointment.Appointment_Date.desc()).first()
+    # latest_active is ordered newest first, so this is the LATEST appointment.
+    appt = db.scalar(appointment_queries.latest_active(req.patient_id))
     
     # 3. Handle "Not Found"
-    if not appt: 
-        return {"status": "error", "message": "I couldn't find any active appointments for that ID."}
+    error = cancel_error(appt)
+    if error: return error
     
     # 4. Execute Cancel
-    appt_time = appt.Appointment_Date.strftime("%Y-%m-%d %H:%M")
     appt_id = appt.Appointment_Id  # <--- CAPTURE ID HERE
-    
-    appt.Appointment_Status = "CANCELLED"
-    appt.ModifiedBy = 1
-    appt.ModifiedAt = datetime.now()
+    appt_time = apply_cancel(appt)
     db.commit()
     
     # 5. Notify (Now Passing Appointment ID)
-    patient = db.query(Patient).filter(Patient.Patient_Id == appt.Patient_Id).first()
+    patient = db.scalar(patient_by_id(appt.Patient_Id))
     if patient and patient.Email_Id: 
         notification.send_cancellation_notification(
             patient.Email_Id, 
@@ -614,7 +953,7 @@ def cancel_appointment(req: CancelRequest, request: Request, db: Session = Depen
             appt_id  # <--- ADDED THIS ARGUMENT
         )
     
-    return {"status": "cancelled", "message": f"Appointment on {appt_time} has been cancelled."}
+    return cancelled_response(appt_time)
 
 # --- Add this endpoint at the bottom of the file ---
 # --- RAG / KNOWLEDGE BASE TOOL ---
@@ -640,7 +979,7 @@ class HospitalInfoRequest(BaseModel):
         return data
 
 # 2. The Endpoint
-@router.post("/hospital_info")
+@kb_router.post("/hospital_info")
 def get_hospital_info(req: HospitalInfoRequest):
     """
     Tool: Searches the hospital's knowledge base for general information.
@@ -650,6 +989,10 @@ def get_hospital_info(req: HospitalInfoRequest):
     
     logger.info(f"Searching Knowledge Base for: {req.query}")
 
+    # Still loading after a deploy? Answer right away instead of searching an empty KB
+    if not kb_engine.is_ready:
+        return kb_warming_up_response()
+
     # Search
     context = kb_engine.search(req.query)
 
@@ -658,6 +1001,55 @@ def get_hospital_info(req: HospitalInfoRequest):
         "results": context,
         "instruction": "Use the information above to answer the user's question. If the answer is not in the text, say you don't have that specific information."
     }
+
+# 3. Batch version (several facts in one tool call)
+class HospitalInfoBatchRequest(BaseModel):
+    queries: List[str]
+
+    @model_validator(mode='before')
+    @classmethod
+    def clean_queries(cls, data: Any) -> Any:
+        if isinstance(data, dict):
+            # Clean Keys
+            clean_data = {}
+            for k, v in data.items():
+                clean_key = k.strip().replace('\r', '').replace('\n', '')
+                clean_data[clean_key] = v
+            data = clean_data
+
+            # Map Aliases
+            if 'queries' not in data:
+                data['queries'] = data.get('questions') or data.get('query') or data.get('q')
+
+            # AI sent one string instead of a list
+            if isinstance(data.get('queries'), str):
+                data['queries'] = [data['queries']]
+            if isinstance(data.get('queries'), list):
+                data['queries'] = [q for q in data['queries'] if isinstance(q, str) and q.strip()]
+        return data
+
+@kb_router.post("/hospital_info/batch")
+def get_hospital_info_batch(req: HospitalInfoBatchRequest):
+    """
+    Tool: Answers several knowledge base questions in one call
+    (e.g. branch location + parking + visiting hours).
+    """
+    from app.services.rag_service import kb_engine
+
+    logger.info(f"Batch searching Knowledge Base for: {req.queries}")
+
+    if not kb_engine.is_ready:
+        return kb_warming_up_response()
+
+    contexts = kb_engine.search_many(req.queries)
+
+    return {
+        "results": [{"query": q, "results": c} for q, c in zip(req.queries, contexts)],
+        "instruction": "Use the information above to answer each of the user's questions. If an answer is not in the text, say you don't have that specific information."
+    }
+
+router.include_router(kb_router)
+
 # ==========================================
 # DIAGNOSTIC TEST ENDPOINTS
 # ==========================================
@@ -675,38 +1067,15 @@ def check_test_availability(req: TestRequest, db: Session = Depends(get_db)):
 
     # 1. Search Database using SQL LIKE for fuzzy match
     # We use ilike for case-insensitive search
-    test_obj = db.query(DiagnosticTest).filter(
-        DiagnosticTest.Department.ilike(dept),
-        DiagnosticTest.Test_Name.ilike(f"%{test_query}%")
-    ).first()
+    test_obj = db.scalar(test_by_name(test_query, dept))
     
     # 2. Handle Not Found
     if not test_obj:
         # Try finding without department filter as fallback
-        test_obj = db.query(DiagnosticTest).filter(
-            DiagnosticTest.Test_Name.ilike(f"%{test_query}%")
-        ).first()
-
-    if not test_obj:
-        return {"status": "error", "message": f"I couldn't find a test named '{req.test_name}'."}
+        test_obj = db.scalar(test_by_name(test_query))
 
     # 3. Formulate Response based on DB Data
-    if test_obj.Is_Available:
-        return {
-            "status": "available",
-            "test": test_obj.Test_Name,
-            "cost": f"₹{int(test_obj.Price) if test_obj.Price else 0}",
-            "schedule": test_obj.Schedule,
-            "message": f"Yes, the {test_obj.Test_Name} is available. It costs ₹{int(test_obj.Price)} and the schedule is: {test_obj.Schedule}."
-        }
-    else:
-        return {
-            "status": "unavailable",
-            "test": test_obj.Test_Name,
-            "referral": test_obj.Referral_Name,
-            "contact": test_obj.Referral_Contact,
-            "message": f"We do not conduct {test_obj.Test_Name} here. We recommend contacting {test_obj.Referral_Name} at {test_obj.Referral_Contact}."
-        }
+    return test_availability_response(req, test_obj)
 
 @router.post("/book_test")
 def book_test_appointment(req: BookTestRequest, request: Request, db: Session = Depends(get_db)):
@@ -721,26 +1090,19 @@ def book_test_appointment(req: BookTestRequest, request: Request, db: Session =
          return {"status": "error", "message": "I need both date and time to book the test."}
 
     # 2. Find the Test ID
-    test_obj = db.query(DiagnosticTest).filter(
-        DiagnosticTest.Test_Name.ilike(f"%{req.test_name}%")
-    ).first()
-
-    if not test_obj:
-        return {"status": "error", "message": f"Test '{req.test_name}' not found."}
-
-    if not test_obj.Is_Available:
-        return {"status": "error", "message": f"Sorry, {test_obj.Test_Name} is not available here."}
+    test_obj = db.scalar(test_by_name(req.test_name))
+    error = book_test_error(req, test_obj)
+    if error: return error
 
     # 3. Check if Patient Exists
-    patient = db.query(Patient).filter(Patient.Patient_Id == req.patient_id).first()
-    if not patient:
-        return {"status": "error", "message": "Invalid Patient ID."}
+    patient = db.scalar(patient_by_id(req.patient_id))
+    error = book_test_patient_error(patient)
+    if error: return error
 
     # 4. Create the Appointment
     try:
         # Use our helper to safely parse messy AI time formats
         appt_datetime = parse_datetime(req.date, req.time)
-        formatted_time = appt_datetime.strftime("%H:%M")
         
         new_booking = TestAppointment(
             Patient_Id=req.patient_id,
@@ -748,7 +1110,6 @@ def book_test_appointment(req: BookTestRequest, request: Request, db: Session =
             Appointment_Date=appt_datetime,
             Status="CONFIRMED"
         )
-        # ... (inside book_test_appointment) ...
         db.add(new_booking)
         db.commit()
 
@@ -758,14 +1119,11 @@ def book_test_appointment(req: BookTestRequest, request: Request, db: Session =
                 to_email=patient.Email_Id,
                 patient_name=patient.Patient_Name,
                 test_name=test_obj.Test_Name,
-                date_time=f"{req.date} {formatted_time}",
+                date_time=f"{req.date} {appt_datetime.strftime('%H:%M')}",
                 booking_id=new_booking.Test_Appt_Id
             )
 
-        return {
-            "status": "success",
-            "message": f"Confirmed! {test_obj.Test_Name} booked for {req.date} at {formatted_time}. Your booking ID is T-{new_booking.Test_Appt_Id}."
-        }
+        return test_booked_response(req, test_obj, new_booking, appt_datetime)
     except Exception as e:
         logger.error(f"Test Booking Error: {e}")
         return {"status": "error", "message": "Failed to book test due to a server error."}
\ No newline at end of file
@@ -0,0 +1,293 @@
+"""
+Async versions of the database endpoints of app/api/routes.py (DB_ASYNC=1).
+
+Same paths, request models and responses as the sync handlers, but each one is
+an `async def` on an AsyncSession: it runs on the event loop instead of a
+thread-pool thread, and only holds a pooled connection while a query is
+actually running. Emails (blocking SMTP) are sent from the thread pool. The
+endpoints that don't touch the database (hospital_info) live on routes.kb_router,
+included by both routers, so `router` here serves the whole API.
+
+Everything a handler decides lives in the plain functions of routes.py's
+"REQUEST -> RESPONSE LOGIC" section; a handler here only awaits the queries,
+commits and notifications in between, in the same order as its sync twin.
+
+app/main.py mounts this router instead of routes.router when DB_ASYNC is set.
+"""
+from fastapi import APIRouter, Depends, status, Request
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from datetime import datetime, timedelta
+from app.core.database import get_async_db
+from app.models.models import Branch, TestAppointment
+from app.services import notification
+from app.services.doctor_directory import doctor_directory
+from app.services import appointment_queries
+from app.api import routes
+from app.api.routes import (
+    VerifyRequest, GetDoctorsRequest, AvailabilityRequest, AvailabilityRangeRequest, SpecialtyAvailabilityRequest,
+    PatientBase, BookRequest, RescheduleRequest, CancelRequest, TestRequest, BookTestRequest,
+    clean_doctor_name, parse_datetime, range_availability_response, specialty_availability_response,
+    patient_by_id, patient_by_phone, test_by_name, day_range, branches_response, doctors_response,
+    verified_patient_response, find_doctor, availability_request_error, availability_day, availability_response,
+    parse_range, specialty_doctors, new_patient_row, parse_booking, booking_error, new_appointment_row,
+    booked_response, parse_reschedule, reschedule_error, apply_reschedule, rescheduled_response,
+    cancel_request_error, cancel_error, apply_cancel, cancelled_response, test_availability_response,
+    book_test_error, book_test_patient_error, test_booked_response,
+)
+import logging
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter()
+
+# ==========================================
+# ENDPOINTS (ALL POST)
+# ==========================================
+
+@router.post("/branches")
+async def get_branches(db: AsyncSession = Depends(get_async_db)):
+    return branches_response((await db.scalars(select(Branch))).all())
+
+@router.post("/doctors")
+async def get_doctors(req: GetDoctorsRequest, db: AsyncSession = Depends(get_async_db)):
+    """Fetch doctors, optionally filtered by Branch and Speciality (from the cached doctor directory)."""
+    directory = await doctor_directory.aget(db)
+    return doctors_response(directory.filter(branch_id=req.branch_id, speciality=req.speciality))
+
+@router.post("/patient/verify")
+async def verify_patient(req: VerifyRequest, db: AsyncSession = Depends(get_async_db)):
+    """Verify if a patient exists by ID."""
+    logger.info(f"Verifying Patient ID: {req.patient_id}")
+    return verified_patient_response(await db.scalar(patient_by_id(req.patient_id)))
+
+@router.post("/availability")
+async def check_availability(req: AvailabilityRequest, db: AsyncSession = Depends(get_async_db)):
+    error = availability_request_error(req)
+    if error: return error
+
+    clean_doctor = clean_doctor_name(req.doctor_name)
+    logger.info(f"Checking Availability: Doc='{clean_doctor}', Date={req.date}")
+
+    doctor_obj, error = find_doctor(await doctor_directory.aget(db), clean_doctor, req.branch_id)
+    if error: return error
+
+    target_date, error = availability_day(req, doctor_obj)
+    if error: return error
+
+    booked = (await db.execute(appointment_queries.booked_slots([doctor_obj.doctor_id], target_date, target_date + timedelta(days=1)))).all()
+    return availability_response(req, doctor_obj, booked)
+
+@router.post("/availability/range")
+async def check_availability_range(req: AvailabilityRangeRequest, db: AsyncSession = Depends(get_async_db)):
+    """Next free slots of one doctor over several days; see routes.check_availability_range."""
+    if not req.doctor_name:
+        return {"status": "error", "message": "Please provide a doctor name."}
+
+    clean_doctor = clean_doctor_name(req.doctor_name)
+    now = datetime.now()
+    start_day, days, error = parse_range(req.start_date, req.days, now)
+    if error: return error
+
+    logger.info(f"Checking Availability Range: Doc='{clean_doctor}', From={start_day}, Days={days}")
+
+    doctor_obj, error = find_doctor(await doctor_directory.aget(db), clean_doctor, req.branch_id)
+    if error: return error
+
+    booked = (await db.execute(appointment_queries.booked_slots([doctor_obj.doctor_id], *day_range(start_day, days)))).all()
+    return range_availability_response(doctor_obj, booked, start_day, days, now, max(req.limit, 0), req.all_slots)
+
+@router.post("/availability/specialty")
+async def check_specialty_availability(req: SpecialtyAvailabilityRequest, db: AsyncSession = Depends(get_async_db)):
+    """Free slots of every doctor of a specialty; see routes.check_specialty_availability."""
+    if not req.speciality or not str(req.speciality).strip():
+        return {"status": "error", "message": "Please provide a speciality (e.g. cardiology)."}
+
+    now = datetime.now()
+    start_day, days, error = parse_range(req.start_date, req.days, now)
+    if error: return error
+
+    directory = await doctor_directory.aget(db)
+    branch_id, doctors, error = specialty_doctors(directory, req)
+    if error: return error
+
+    logger.info(f"Checking Specialty Availability: Speciality='{req.speciality}', Branch={branch_id}, From={start_day}, Days={days}")
+
+    booked = (await db.execute(appointment_queries.booked_slots([d.doctor_id for d in doctors], *day_range(start_day, days)))).all()
+    branch_name = directory.branch_names.get(branch_id) if branch_id else None
+    return specialty_availability_response(req.speciality, branch_name, doctors, booked, start_day, days, now, max(req.limit, 0), max(req.per_doctor, 0))
+
+@router.post("/patient/register", status_code=status.HTTP_201_CREATED)
+async def register_patient(patient_data: PatientBase, request: Request, db: AsyncSession = Depends(get_async_db)):
+    existing = await db.scalar(patient_by_phone(patient_data.phone))
+    if existing: return {"status": "exists", "patient_id": existing.Patient_Id}
+    new_patient = new_patient_row(patient_data, request)
+    db.add(new_patient); await db.commit(); await db.refresh(new_patient)
+    if patient_data.email: await run_in_threadpool(notification.send_welcome_email, patient_data.name, patient_data.email, new_patient.Patient_Id)
+    return {"status": "created", "patient_id": new_patient.Patient_Id}
+
+@router.post("/book")
+async def book_appointment(booking: BookRequest, request: Request, db: AsyncSession = Depends(get_async_db)):
+    """Book an appointment; see routes.book_appointment."""
+    # 1. DEBUG LOG: See EXACTLY what Vapi sent
+    logger.info(f"BOOKING REQUEST DATA: {booking.model_dump()}")
+
+    # 2. FAIL FAST: Validate and parse date/time
+    appt_dt, error = parse_booking(booking)
+    if error: return error
+
+    # 3. Find Doctor (cached directory)
+    doctor, error = find_doctor(await doctor_directory.aget(db), clean_doctor_name(booking.doctor_name), booking=True)
+    if error: return error
+
+    # 4. Find Patient and check for Conflicts
+    patient = await db.scalar(patient_by_id(booking.patient_id))
+    conflict = await db.scalar(appointment_queries.slot_taken(doctor.doctor_id, appt_dt)) if patient else None
+    error = booking_error(patient, conflict)
+    if error: return error
+
+    # 5. Create Appointment
+    new_appt = new_appointment_row(patient, doctor, appt_dt, request)
+    db.add(new_appt)
+    await db.commit()
+
+    # 6. Send Notification
+    if patient.Email_Id:
+        await run_in_threadpool(
+            notification.send_booking_confirmation,
+            patient.Email_Id,
+            doctor.name,
+            f"{booking.date} {appt_dt.strftime('%H:%M')}",
+            patient.Patient_Id,
+            new_appt.Appointment_Id
+        )
+
+    return booked_response(booking, doctor, new_appt, appt_dt)
+
+@router.post("/appointment/reschedule")
+async def reschedule_appointment(req: RescheduleRequest, request: Request, db: AsyncSession = Depends(get_async_db)):
+    """Reschedule the patient's next appointment; see routes.reschedule_appointment."""
+    logger.info(f"RESCHEDULE REQUEST DATA: {req.model_dump()}")
+
+    # 1. FAIL FAST: Check for missing inputs, parse New Date/Time
+    new_dt, error = parse_reschedule(req)
+    if error: return error
+
+    # 2. Find the Existing Appointment and check for Conflicts
+    appt = await db.scalar(appointment_queries.next_upcoming(req.patient_id, datetime.now()))
+    conflict = await db.scalar(appointment_queries.slot_taken(appt.Doctor_Id, new_dt)) if appt else None
+    error = reschedule_error(appt, conflict)
+    if error: return error
+
+    doctor = (await doctor_directory.aget(db)).by_id.get(appt.Doctor_Id)
+    doctor_name = doctor.name if doctor else "Unknown Doctor"
+
+    # 3. Update Appointment
+    old_time_str = apply_reschedule(appt, new_dt)
+    await db.commit()
+
+    # 4. Notify Patient
+    patient = await db.scalar(patient_by_id(appt.Patient_Id))
+    if patient and patient.Email_Id:
+        await run_in_threadpool(
+            notification.send_reschedule_notification,
+            patient.Email_Id,
+            doctor_name,
+            old_time_str,
+            f"{req.new_date} {new_dt.strftime('%H:%M')}",
+            patient.Patient_Id,
+            appt.Appointment_Id
+        )
+
+    return rescheduled_response(req, new_dt)
+
+@router.post("/appointment/cancel")
+async def cancel_appointment(req: CancelRequest, request: Request, db: AsyncSession = Depends(get_async_db)):
+    error = cancel_request_error(req)
+    if error: return error
+    logger.info(f"Received Cancel Request for Patient ID: {req.patient_id}")
+
+    # 1. Find the LATEST active appointment
+    appt = await db.scalar(appointment_queries.latest_active(req.patient_id))
+    error = cancel_error(appt)
+    if error: return error
+
+    # 2. Execute Cancel
+    appt_id = appt.Appointment_Id
+    appt_time = apply_cancel(appt)
+    await db.commit()
+
+    # 3. Notify
+    patient = await db.scalar(patient_by_id(appt.Patient_Id))
+    if patient and patient.Email_Id:
+        await run_in_threadpool(notification.send_cancellation_notification, patient.Email_Id, appt_time, patient.Patient_Id, appt_id)
+
+    return cancelled_response(appt_time)
+
+# ==========================================
+# DIAGNOSTIC TEST ENDPOINTS
+# ==========================================
+
+@router.post("/check_test")
+async def check_test_availability(req: TestRequest, db: AsyncSession = Depends(get_async_db)):
+    """Tool: Checks DB for test availability (department match first, then any department)."""
+    logger.info(f"Checking Test: {req.test_name} in {req.department}")
+
+    dept = req.department.lower()
+    test_query = req.test_name.lower().strip()
+
+    test_obj = await db.scalar(test_by_name(test_query, dept))
+    if not test_obj:
+        test_obj = await db.scalar(test_by_name(test_query))
+    return test_availability_response(req, test_obj)
+
+@router.post("/book_test")
+async def book_test_appointment(req: BookTestRequest, request: Request, db: AsyncSession = Depends(get_async_db)):
+    """Tool: Books a diagnostic test for a patient."""
+    logger.info(f"BOOKING TEST REQUEST: {req.model_dump()}")
+
+    if not req.date or not req.time:
+         return {"status": "error", "message": "I need both date and time to book the test."}
+
+    test_obj = await db.scalar(test_by_name(req.test_name))
+    error = book_test_error(req, test_obj)
+    if error: return error
+
+    patient = await db.scalar(patient_by_id(req.patient_id))
+    error = book_test_patient_error(patient)
+    if error: return error
+
+    try:
+        appt_datetime = parse_datetime(req.date, req.time)
+
+        new_booking = TestAppointment(
+            Patient_Id=req.patient_id,
+            Test_Id=test_obj.Test_Id,
+            Appointment_Date=appt_datetime,
+            Status="CONFIRMED"
+        )
+        db.add(new_booking)
+        await db.commit()
+
+        if patient.Email_Id:
+            await run_in_threadpool(
+                notification.send_test_booking_confirmation,
+                to_email=patient.Email_Id,
+                patient_name=patient.Patient_Name,
+                test_name=test_obj.Test_Name,
+                date_time=f"{req.date} {appt_datetime.strftime('%H:%M')}",
+                booking_id=new_booking.Test_Appt_Id
+            )
+
+        return test_booked_response(req, test_obj, new_booking, appt_datetime)
+    except Exception as e:
+        logger.error(f"Test Booking Error: {e}")
+        return {"status": "error", "message": "Failed to book test due to a server error."}
+
+# ==========================================
+# ENDPOINTS WITHOUT DATABASE ACCESS
+# ==========================================
+
+# hospital_info and friends don't touch the database; serve the sync handlers as they are
+router.include_router(routes.kb_router)
@@ -38,6 +38,7 @@
 #         db.close()
 
 from sqlalchemy import create_engine
+from sqlalchemy.engine import URL, make_url
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
 import os
@@ -61,8 +62,18 @@ ssl_args = {
 }
 
 # Construct the URL
-# Note: We pass SSL config in connect_args below, not in the string itself
-SQLALCHEMY_DATABASE_URL = f"mysql+pymysql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+# Note: We pass SSL config in connect_args below, not in the string itself.
+# URL.create escapes the password and accepts missing settings, so the models (and the
+# tests and benchmarks that build their own SQLite engine) import without DB_* set;
+# the engine only connects on first use.
+SQLALCHEMY_DATABASE_URL = URL.create(
+    "mysql+pymysql",
+    username=DB_USER,
+    password=DB_PASSWORD,
+    host=DB_HOST,
+    port=int(DB_PORT) if DB_PORT else None,
+    database=DB_NAME,
+)
 
 # --- ENGINE CREATION ---
 # engine = create_engine(
@@ -98,4 +109,42 @@ def get_db():
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+# --- ASYNC ENGINE (DB_ASYNC=1) ---
+# Serves the endpoints from app/api/routes_async.py on the event loop: a connection is only
+# held while a query runs, not for a whole request on a thread-pool thread, so many concurrent
+# calls share a handful of connections. Needs `sqlalchemy[asyncio]` plus an async driver
+# (aiomysql for MySQL/TiDB); DB_ASYNC_URL overrides the URL, e.g. "sqlite+aiosqlite:///./dev.db".
+DB_ASYNC = os.getenv("DB_ASYNC", "false").lower() in ("1", "true", "yes")
+ASYNC_DATABASE_URL = os.getenv("DB_ASYNC_URL") or SQLALCHEMY_DATABASE_URL.set(drivername="mysql+aiomysql")
+
+def create_async_db_engine(url=ASYNC_DATABASE_URL):
+    from sqlalchemy.ext.asyncio import create_async_engine
+
+    if make_url(url).get_backend_name() == "sqlite":
+        return create_async_engine(url)
+    import ssl
+    return create_async_engine(
+        url,
+        connect_args={"ssl": ssl.create_default_context(cafile=certifi.where())},  # aiomysql takes an SSLContext
+        pool_pre_ping=True,
+        pool_recycle=180,
+        pool_size=5,
+        max_overflow=10,
+        pool_timeout=30,
+        echo=False
+    )
+
+async_engine = None
+AsyncSessionLocal = None
+if DB_ASYNC:
+    from sqlalchemy.ext.asyncio import async_sessionmaker
+
+    async_engine = create_async_db_engine()
+    # expire_on_commit=False: attributes stay readable after commit (an expired one would need an implicit await)
+    AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
\ No newline at end of file
@@ -0,0 +1,94 @@
+"""
+Index migrations for existing databases.
+
+Base.metadata.create_all() (run by app/main.py) only creates tables that don't
+exist yet, so an index added to a model later never reaches a database that
+already has the table. This compares the indexes declared in app/models/models.py
+with the live schema and creates the missing ones. It is idempotent: run it after
+deploying a model change that adds an index.
+
+    python -m app.core.migrations --dry-run   # print the DDL only
+    python -m app.core.migrations
+
+On MySQL/TiDB, CREATE INDEX is an online operation (reads and writes continue
+while the index builds), but on a large Appointment table it still takes a while;
+run it outside peak hours. The app itself never builds indexes at start-up, it
+only warns about missing ones (warn_missing_indexes).
+"""
+import sys
+import logging
+import argparse
+from typing import List, Optional, Union
+
+from sqlalchemy import Index, inspect
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.schema import CreateIndex
+
+from app.core.database import Base
+from app.models import models  # noqa: F401  (registers the tables on Base.metadata)
+
+logger = logging.getLogger(__name__)
+
+
+def missing_indexes(bind: Union[Engine, Connection]) -> List[Index]:
+    """Declared indexes the live database lacks (matched by name, or by an existing index on the same columns)."""
+    inspector = inspect(bind)
+    existing_tables = set(inspector.get_table_names())
+    missing = []
+    for table in Base.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue  # create_all() builds new tables with all their indexes
+        live = inspector.get_indexes(table.name)
+        live_names = {ix["name"] for ix in live}
+        live_columns = {tuple(ix["column_names"]) for ix in live}
+        live_columns.add(tuple(c.name for c in table.primary_key.columns))  # index=True on a primary key adds nothing
+        for index in sorted(table.indexes, key=lambda ix: ix.name):
+            if index.name in live_names or tuple(c.name for c in index.columns) in live_columns:
+                continue
+            missing.append(index)
+    return missing
+
+
+def apply_missing_indexes(engine: Engine, dry_run: bool = False) -> List[str]:
+    """Creates every missing index; returns the DDL statements (executed unless dry_run)."""
+    statements = []
+    for index in missing_indexes(engine):
+        ddl = str(CreateIndex(index).compile(dialect=engine.dialect))
+        statements.append(ddl)
+        if dry_run:
+            continue
+        logger.info(f"Creating index {index.name} on {index.table.name}")
+        with engine.begin() as conn:
+            conn.execute(CreateIndex(index))
+    return statements
+
+
+def warn_missing_indexes(bind: Union[Engine, Connection]):
+    """Start-up check: log the declared indexes the database doesn't have yet (never fails the start-up)."""
+    try:
+        missing = missing_indexes(bind)
+    except Exception as e:
+        logger.warning(f"Index check skipped: {e}")
+        return
+    for index in missing:
+        logger.warning(f"Missing index {index.name} on {index.table.name}; run `python -m app.core.migrations`")
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Create the indexes declared in the models that the database lacks.")
+    parser.add_argument("--dry-run", action="store_true", help="print the DDL without running it")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    from app.core.database import engine
+
+    statements = apply_missing_indexes(engine, dry_run=args.dry_run)
+    for ddl in statements:
+        print(ddl.strip() + ";")
+    if not statements:
+        logger.info("All declared indexes exist.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,6 +1,8 @@
-from app.core.database import engine
+from app.core.database import engine, async_engine, DB_ASYNC
+from app.core.migrations import warn_missing_indexes
 from app.models import models
 from app.api import routes
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, Request, status
 from fastapi.exceptions import RequestValidationError
 from fastapi.responses import JSONResponse
@@ -11,10 +13,24 @@ logger = logging.getLogger(__name__)
 
 # 1. Create the Database Tables (Safety check)
 # This ensures tables exist if they weren't created manually
-models.Base.metadata.create_all(bind=engine)
+# (in async mode through the async engine at start-up, so the sync engine never opens a connection)
+if not DB_ASYNC:
+    models.Base.metadata.create_all(bind=engine)
+    # Indexes added to existing tables need `python -m app.core.migrations`; just point them out here
+    warn_missing_indexes(engine)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if DB_ASYNC:
+        async with async_engine.begin() as conn:
+            await conn.run_sync(models.Base.metadata.create_all)
+            await conn.run_sync(warn_missing_indexes)
+    yield
+    if DB_ASYNC:
+        await async_engine.dispose()
 
 # 2. Initialize the App
-app = FastAPI(title="Voice AI Agent Backend")
+app = FastAPI(title="Voice AI Agent Backend", lifespan=lifespan)
 
 @app.exception_handler(RequestValidationError)
 async def validation_exception_handler(request: Request, exc: RequestValidationError):
@@ -28,9 +44,22 @@ async def validation_exception_handler(request: Request, exc: RequestValidationE
     )
 
 # 3. Connect the Routes (The API Logic)
-app.include_router(routes.router, prefix="/api")
+# DB_ASYNC=1 serves the database endpoints as async handlers on an async engine (app/api/routes_async.py)
+if DB_ASYNC:
+    from app.api import routes_async
+    app.include_router(routes_async.router, prefix="/api")
+else:
+    app.include_router(routes.router, prefix="/api")
 
 # 4. Root Endpoint (To check if server is alive)
 @app.get("/")
 def read_root():
-    return {"message": "Voice AI Agent Backend is Running!"}
\ No newline at end of file
+    return {"message": "Voice AI Agent Backend is Running!"}
+
+# 5. Readiness (the KB loads in the background, booking endpoints work before it's ready)
+@app.get("/health")
+def health():
+    from app.services.rag_service import kb_engine
+
+    kb = kb_engine.status()
+    return {"status": "ok", "retrieval_ready": kb["ready"], "knowledge_base": kb}
\ No newline at end of file
@@ -3,7 +3,7 @@
 # from app.core.database import Base
 # from datetime import datetime
 
-from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Boolean, Float
+from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Boolean, Float, Index
 from sqlalchemy.orm import relationship
 from app.core.database import Base
 from datetime import datetime
@@ -59,6 +59,14 @@ class Appointment(Base):
     patient = relationship("Patient")
     doctor = relationship("Doctor", back_populates="appointments")
 
+    # Composite indexes for the hot paths (see app/services/appointment_queries.py):
+    # availability and conflict checks seek on doctor + date and read the status from the index,
+    # reschedule/cancel seek on patient and walk the patient's appointments in date order.
+    __table_args__ = (
+        Index("ix_appointment_doctor_date_status", "Doctor_Id", "Appointment_Date", "Appointment_Status"),
+        Index("ix_appointment_patient_date_status", "Patient_Id", "Appointment_Date", "Appointment_Status"),
+    )
+
 # --- ADD THESE TO THE BOTTOM OF models.py ---
 
 class DiagnosticTest(Base):
@@ -0,0 +1,60 @@
+"""
+The Appointment queries behind the booking routes, one builder per access path.
+
+Each builder returns an unexecuted select(), so the sync routes run it with
+`db.execute(...)`, the async routes (app/api/routes_async.py) with
+`await db.execute(...)`, and benchmarks/check_query_plans.py can EXPLAIN exactly
+the same SQL. Every one is served by a composite index declared on Appointment
+in app/models/models.py:
+
+  - booked_slots, slot_taken   -> ix_appointment_doctor_date_status
+    (doctor + date range/equality, status read from the index: index-only)
+  - next_upcoming, latest_active -> ix_appointment_patient_date_status
+    (patient seek, rows already in date order, so no sort)
+
+Keep the selected columns inside the index when adding a hot-path query here;
+loading whole Appointment rows means a table lookup per match.
+"""
+from datetime import datetime
+from typing import Iterable
+
+from sqlalchemy import Select, select
+
+from app.models.models import Appointment
+from app.services.slots import ACTIVE_STATUSES
+
+
+def booked_slots(doctor_ids: Iterable[int], start: datetime, end: datetime) -> Select:
+    """(Doctor_Id, Appointment_Date) of the active bookings of these doctors in [start, end)."""
+    return select(Appointment.Doctor_Id, Appointment.Appointment_Date).where(
+        Appointment.Doctor_Id.in_(list(doctor_ids)),
+        Appointment.Appointment_Date >= start,
+        Appointment.Appointment_Date < end,
+        Appointment.Appointment_Status.in_(ACTIVE_STATUSES)
+    )
+
+
+def slot_taken(doctor_id: int, when: datetime) -> Select:
+    """Id of an active booking holding this doctor's slot, if any."""
+    return select(Appointment.Appointment_Id).where(
+        Appointment.Doctor_Id == doctor_id,
+        Appointment.Appointment_Date == when,
+        Appointment.Appointment_Status.in_(ACTIVE_STATUSES)
+    ).limit(1)
+
+
+def next_upcoming(patient_id: int, now: datetime) -> Select:
+    """The patient's next active appointment from `now` on."""
+    return select(Appointment).where(
+        Appointment.Patient_Id == patient_id,
+        Appointment.Appointment_Date >= now,
+        Appointment.Appointment_Status.in_(ACTIVE_STATUSES)
+    ).order_by(Appointment.Appointment_Date.asc()).limit(1)
+
+
+def latest_active(patient_id: int) -> Select:
+    """The patient's latest active appointment."""
+    return select(Appointment).where(
+        Appointment.Patient_Id == patient_id,
+        Appointment.Appointment_Status.in_(ACTIVE_STATUSES)
+    ).order_by(Appointment.Appointment_Date.desc()).limit(1)
@@ -0,0 +1,133 @@
+"""
+Near-duplicate page detection for the crawler.
+
+Medcare pages share big template blocks and many URLs are near-copies of each
+other (doctor listings with different filters, print views...). Each extracted
+page gets a MinHash signature over its word shingles. The signatures go into a
+banded LSH index, so finding the pages a new one may duplicate costs a few
+dict lookups instead of a comparison with every page already kept.
+
+A page whose estimated Jaccard similarity with a kept page reaches
+DEDUP_THRESHOLD is collapsed into it: no KB file is written and the crawl state
+records which page it duplicates. The first page kept is the canonical one.
+
+Signatures are stored in the crawl state (hex), so pages that are unchanged on
+a re-crawl still take part without being parsed again.
+"""
+import os
+import zlib
+from typing import Dict, Optional, Set, Tuple
+
+import numpy as np
+
+from app.services.kb_index import tokenize
+
+DEDUP_THRESHOLD = float(os.getenv("CRAWL_DEDUP_THRESHOLD", "0.85"))  # Estimated Jaccard at which pages collapse, >1 disables
+MINHASH_PERMUTATIONS = 64
+LSH_BANDS = 16               # 16 bands x 4 rows: pages above ~0.6 similarity almost always share a band
+SHINGLE_WORDS = 5
+
+_PRIME = np.uint64((1 << 61) - 1)
+_rng = np.random.RandomState(20240501)  # fixed: signatures must match across runs and processes
+_A = _rng.randint(1, 1 << 31, MINHASH_PERMUTATIONS).astype(np.uint64)
+_B = _rng.randint(0, 1 << 31, MINHASH_PERMUTATIONS).astype(np.uint64)
+_ROWS = MINHASH_PERMUTATIONS // LSH_BANDS
+
+
+def shingles(text: str) -> np.ndarray:
+    """crc32 of every SHINGLE_WORDS-word window (stable across processes, unlike hash())."""
+    words = tokenize(text)
+    if len(words) < SHINGLE_WORDS:
+        windows = {" ".join(words)}
+    else:
+        windows = {" ".join(words[i:i + SHINGLE_WORDS]) for i in range(len(words) - SHINGLE_WORDS + 1)}
+    return np.fromiter((zlib.crc32(w.encode("utf-8")) for w in windows), dtype=np.uint64, count=len(windows))
+
+
+def minhash(text: str) -> np.ndarray:
+    """MINHASH_PERMUTATIONS minimum hash values (uint32) of the text's shingles."""
+    hashes = shingles(text)
+    # (a*x + b) mod p per permutation; a, x < 2^32 so a*x never overflows uint64
+    permuted = (hashes[None, :] * _A[:, None] + _B[:, None]) % _PRIME
+    return (permuted.min(axis=1) & np.uint64(0xFFFFFFFF)).astype(np.uint32)
+
+
+def similarity(a: np.ndarray, b: np.ndarray) -> float:
+    """Estimated Jaccard similarity of two signatures."""
+    return float(np.count_nonzero(a == b)) / len(a)
+
+
+def signature_to_hex(signature: np.ndarray) -> str:
+    return signature.astype("<u4").tobytes().hex()
+
+
+def signature_from_hex(value: str) -> Optional[np.ndarray]:
+    try:
+        signature = np.frombuffer(bytes.fromhex(value), dtype="<u4").astype(np.uint32)
+    except (TypeError, ValueError):
+        return None
+    return signature if len(signature) == MINHASH_PERMUTATIONS else None
+
+
+class DuplicateIndex:
+    """
+    url -> signature of every kept page, bucketed by LSH band.
+    Not thread-safe: the crawl loop owns it, like the frontier.
+    """
+
+    def __init__(self, threshold: float = DEDUP_THRESHOLD):
+        self.threshold = threshold
+        self.signatures: Dict[str, np.ndarray] = {}
+        self.bands = [dict() for _ in range(LSH_BANDS)]  # band -> {rows bytes: set of urls}
+
+    @staticmethod
+    def _keys(signature: np.ndarray):
+        for band in range(LSH_BANDS):
+            yield band, signature[band * _ROWS:(band + 1) * _ROWS].tobytes()
+
+    @classmethod
+    def from_state(cls, entries: Dict[str, dict], threshold: float = DEDUP_THRESHOLD) -> "DuplicateIndex":
+        """Index of the pages a previous crawl kept (entries with a KB file and a signature)."""
+        index = cls(threshold)
+        for url, entry in entries.items():
+            if entry.get("file") and entry.get("signature"):
+                signature = signature_from_hex(entry["signature"])
+                if signature is not None:
+                    index.add(url, signature)
+        return index
+
+    def __len__(self) -> int:
+        return len(self.signatures)
+
+    def add(self, url: str, signature: np.ndarray):
+        self.remove(url)
+        self.signatures[url] = signature
+        for band, key in self._keys(signature):
+            self.bands[band].setdefault(key, set()).add(url)
+
+    def remove(self, url: str):
+        signature = self.signatures.pop(url, None)
+        if signature is None:
+            return
+        for band, key in self._keys(signature):
+            bucket = self.bands[band].get(key)
+            if bucket is not None:
+                bucket.discard(url)
+                if not bucket:
+                    del self.bands[band][key]
+
+    def find(self, signature: np.ndarray, exclude: str = None) -> Optional[Tuple[str, float]]:
+        """The most similar kept page at or above the threshold, as (url, similarity), or None."""
+        if self.threshold > 1:
+            return None
+        candidates: Set[str] = set()
+        for band, key in self._keys(signature):
+            candidates.update(self.bands[band].get(key, ()))
+        candidates.discard(exclude)
+
+        best = None
+        for url in candidates:
+            score = similarity(signature, self.signatures[url])
+            if score >= self.threshold and (best is None or score > best[1]):
+                best = (url, score)
+        return best
@@ -0,0 +1,104 @@
+"""
+HTML -> KB document extraction for the crawler.
+
+Runs in worker processes (scraper.py feeds it raw bytes through a bounded
+process pool), so everything here is a plain top-level function with
+picklable arguments and results.
+
+Uses lxml directly when it is installed (several times faster than
+BeautifulSoup's html.parser), otherwise BeautifulSoup. Links are collected from
+the whole page. Text is taken only from the main content region (<main>,
+<article> or role="main") when the page has one, otherwise from the body minus
+navigation/footer/script chrome.
+"""
+import re
+from typing import List, Optional, Tuple
+from urllib.parse import urljoin
+
+try:
+    import lxml.html
+    from lxml import etree
+    HAVE_LXML = True
+except ImportError:  # optional, BeautifulSoup works everywhere
+    HAVE_LXML = False
+
+NOISE_TAGS = ("script", "style", "nav", "footer", "header", "noscript", "aside")
+MIN_LINE_CHARS = 20      # Only keep substantial lines
+MIN_CONTENT_CHARS = 200  # Thinner pages (and thinner main regions) don't become documents
+
+WHITESPACE_RE = re.compile(r"[ \t\r\f\v]+")
+
+
+def _clean_text(text: str) -> str:
+    lines = (WHITESPACE_RE.sub(" ", line).strip() for line in text.splitlines())
+    return "\n".join(line for line in lines if len(line) > MIN_LINE_CHARS)
+
+
+def _keep_link(full_url: str, scope: str) -> bool:
+    return full_url.startswith(("http://", "https://")) and scope in full_url
+
+
+def _extract_lxml(url: str, body: bytes, encoding: Optional[str], scope: str) -> Tuple[Optional[str], str, List[str]]:
+    parser = lxml.html.HTMLParser(encoding=encoding, remove_comments=True)
+    root = lxml.html.fromstring(body, parser=parser, base_url=url)
+
+    links = []
+    for href in root.xpath("//a/@href"):
+        full_url = urljoin(url, href.strip()).split("#")[0]
+        if _keep_link(full_url, scope):
+            links.append(full_url)
+
+    title = root.findtext(".//title")
+    etree.strip_elements(root, *NOISE_TAGS, with_tail=False)
+
+    text = ""
+    for region in root.xpath("//main | //article | //*[@role='main']"):
+        text = _clean_text("\n".join(region.itertext()))
+        if len(text) > MIN_CONTENT_CHARS:
+            break
+    else:
+        body_el = root.find(".//body")
+        text = _clean_text("\n".join((body_el if body_el is not None else root).itertext()))
+    return title, text, links
+
+
+def _extract_bs4(url: str, body: bytes, encoding: Optional[str], scope: str) -> Tuple[Optional[str], str, List[str]]:
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(body, "html.parser", from_encoding=encoding)
+
+    links = []
+    for link in soup.find_all("a", href=True):
+        full_url = urljoin(url, link["href"].strip()).split("#")[0]
+        if _keep_link(full_url, scope):
+            links.append(full_url)
+
+    title = soup.title.string if soup.title else None
+    for element in soup(list(NOISE_TAGS)):
+        element.decompose()
+
+    text = ""
+    for region in soup.select("main, article, [role=main]"):
+        text = _clean_text(region.get_text(separator="\n"))
+        if len(text) > MIN_CONTENT_CHARS:
+            break
+    else:
+        text = _clean_text((soup.body or soup).get_text(separator="\n"))
+    return title, text, links
+
+
+def extract_page(url: str, body: bytes, encoding: Optional[str] = None, scope: str = "") -> Tuple[Optional[dict], List[str]]:
+    """Cleans a page down to its text; returns (doc or None if too thin, links found on it within `scope`)."""
+    extract = _extract_lxml if HAVE_LXML else _extract_bs4
+    title, text, links = extract(url, body, encoding, scope)
+
+    if len(text) <= MIN_CONTENT_CHARS:
+        return None, links
+
+    doc = {
+        "title": (title or "").strip() or url,
+        "url": url,
+        "content": text,
+        "type": "web_page"
+    }
+    return doc, links
@@ -0,0 +1,187 @@
+"""
+Crawl frontier: canonical URLs, a compact seen-set and on-disk checkpoints.
+
+Every discovered link is normalized first (scheme/host case, default ports,
+dot segments, trailing slashes, tracking parameters, parameter order), so
+trivial variants of a page are fetched once.
+
+The seen-set is a Bloom filter in front of an exact set. The Bloom filter
+answers "definitely new" for most fresh links without touching the exact set.
+A "maybe seen" is confirmed against the exact set, so false positives never
+drop a page.
+
+The exact set and the queue live in a small SQLite file. Memory stays flat on
+large sites. The crawler commits it every CHECKPOINT_EVERY operations, so an
+interrupted crawl resumes where it stopped. Pages that were in flight at the
+time go back on the queue.
+"""
+import os
+import math
+import sqlite3
+import hashlib
+import logging
+from typing import Iterable, List, Optional, Tuple
+from urllib.parse import unquote_plus, urlsplit, urlunsplit
+
+logger = logging.getLogger(__name__)
+
+CRAWL_FRONTIER = os.getenv("CRAWL_FRONTIER", "app/data/crawl_frontier.db")
+BLOOM_CAPACITY = 1_000_000   # URLs before the false-positive rate starts to climb (still exact, just slower)
+BLOOM_ERROR_RATE = 0.01
+CHECKPOINT_EVERY = 200       # Frontier operations between commits
+
+# Query parameters that never change the page content
+IGNORED_PARAMS = {"gclid", "fbclid", "msclkid", "mc_cid", "mc_eid", "sessionid", "phpsessid", "ref", "_ga"}
+DEFAULT_PORTS = {"http": 80, "https": 443}
+
+QUEUED, IN_FLIGHT, DONE = 0, 1, 2
+
+
+def normalize_url(url: str) -> str:
+    """Canonical form of a URL; two URLs for the same page should normalize the same."""
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or "").lower().rstrip(".")
+    if parts.port and parts.port != DEFAULT_PORTS.get(scheme):
+        host = f"{host}:{parts.port}"
+
+    # Resolve "." and ".." segments, collapse "//", drop the trailing slash (but keep "/")
+    segments = []
+    for segment in parts.path.split("/"):
+        if segment == "..":
+            if segments:
+                segments.pop()
+        elif segment and segment != ".":
+            segments.append(segment)
+    path = "/" + "/".join(segments)
+
+    # Sort the parameters and drop tracking ones, but keep each pair as sent ("?privacy" must not become "?privacy=")
+    query = []
+    for pair in parts.query.split("&"):
+        key = unquote_plus(pair.split("=", 1)[0]).lower()
+        if pair and not key.startswith("utm_") and key not in IGNORED_PARAMS:
+            query.append(pair)
+    return urlunsplit((scheme, host, path, "&".join(sorted(query)), ""))
+
+
+class BloomFilter:
+    """Fixed-size Bloom filter over strings (k hashes by double hashing one blake2b digest)."""
+
+    def __init__(self, capacity: int = BLOOM_CAPACITY, error_rate: float = BLOOM_ERROR_RATE):
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, item: str) -> Iterable[int]:
+        digest = hashlib.blake2b(item.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hashes))
+
+    def add(self, item: str):
+        for pos in self._positions(item):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, item: str) -> bool:
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(item))
+
+
+class Frontier:
+    """
+    Queue of canonical URLs to crawl plus everything ever queued (so nothing is queued twice).
+    Not thread-safe: the crawl loop owns it, fetcher threads never touch it.
+    """
+
+    def __init__(self, path: str = CRAWL_FRONTIER, capacity: int = BLOOM_CAPACITY):
+        self.path = path
+        self.db = sqlite3.connect(path or ":memory:")
+        self.db.execute("CREATE TABLE IF NOT EXISTS urls (id INTEGER PRIMARY KEY, url TEXT UNIQUE NOT NULL, "
+                        "status INTEGER NOT NULL DEFAULT 0, priority REAL NOT NULL DEFAULT 0)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS urls_queue ON urls (status, priority DESC, id)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        self.bloom = BloomFilter(capacity)
+        self._pending_ops = 0
+        self.on_checkpoint = None  # called before each commit, to persist whatever must stay in step with the queue
+
+        # Resuming: rebuild the Bloom filter, and re-queue pages that were in flight when we stopped
+        seen = 0
+        for (url,) in self.db.execute("SELECT url FROM urls"):
+            self.bloom.add(url)
+            seen += 1
+        self.db.execute("UPDATE urls SET status = ? WHERE status = ?", (QUEUED, IN_FLIGHT))
+        self.db.commit()
+        self.resumed = seen > 0
+        if self.resumed:
+            logger.info(f"Resuming crawl from {path}: {self.queued} queued, {seen} URLs seen")
+
+    def __contains__(self, url: str) -> bool:
+        url = normalize_url(url)
+        if url not in self.bloom:
+            return False  # definitely new
+        return self.db.execute("SELECT 1 FROM urls WHERE url = ?", (url,)).fetchone() is not None
+
+    def push(self, url: str, priority: float = 0.0) -> bool:
+        """Queues a URL unless it (in canonical form) was ever queued before. Returns True if it was new."""
+        url = normalize_url(url)
+        if url in self.bloom and self.db.execute("SELECT 1 FROM urls WHERE url = ?", (url,)).fetchone():
+            return False
+        self.bloom.add(url)
+        self.db.execute("INSERT INTO urls (url, status, priority) VALUES (?, ?, ?)", (url, QUEUED, priority))
+        self._tick()
+        return True
+
+    def push_many(self, urls: Iterable[str], priority: float = 0.0) -> int:
+        return sum(self.push(url, priority) for url in urls)
+
+    def pop(self) -> Optional[str]:
+        """Highest-priority queued URL (FIFO among equals), now marked in flight; None if the queue is empty."""
+        row = self.db.execute("SELECT id, url FROM urls WHERE status = ? ORDER BY priority DESC, id LIMIT 1", (QUEUED,)).fetchone()
+        if row is None:
+            return None
+        self.db.execute("UPDATE urls SET status = ? WHERE id = ?", (IN_FLIGHT, row[0]))
+        self._tick()
+        return row[1]
+
+    def done(self, url: str):
+        self.db.execute("UPDATE urls SET status = ? WHERE url = ?", (DONE, url))
+        self._tick()
+
+    def done_urls(self) -> List[str]:
+        return [url for (url,) in self.db.execute("SELECT url FROM urls WHERE status = ?", (DONE,))]
+
+    @property
+    def queued(self) -> int:
+        return self.db.execute("SELECT COUNT(*) FROM urls WHERE status = ?", (QUEUED,)).fetchone()[0]
+
+    def __len__(self) -> int:
+        return self.queued
+
+    def get_meta(self, key: str, default: str = None) -> Optional[str]:
+        row = self.db.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else default
+
+    def set_meta(self, key: str, value):
+        self.db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, str(value)))
+
+    def _tick(self):
+        self._pending_ops += 1
+        if self._pending_ops >= CHECKPOINT_EVERY:
+            self.checkpoint()
+
+    def checkpoint(self):
+        if self.on_checkpoint:
+            self.on_checkpoint()
+        self.db.commit()
+        self._pending_ops = 0
+
+    def close(self, finished: bool = False):
+        """Commits the frontier; a finished crawl deletes it so the next run starts fresh."""
+        self.checkpoint()
+        self.db.close()
+        if finished and self.path and os.path.exists(self.path):
+            os.remove(self.path)
+
+    def stats(self) -> Tuple[int, int, int]:
+        """(queued, in flight, done)"""
+        counts = dict(self.db.execute("SELECT status, COUNT(*) FROM urls GROUP BY status").fetchall())
+        return counts.get(QUEUED, 0), counts.get(IN_FLIGHT, 0), counts.get(DONE, 0)
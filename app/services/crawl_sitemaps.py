@@ -0,0 +1,124 @@
+"""
+Sitemap-driven URL discovery.
+
+Reads the Sitemap: entries from robots.txt (falling back to /sitemap.xml),
+follows sitemap index files and yields (url, lastmod) pairs as the XML streams
+in, so a large sitemap never has to be held in memory. Gzip-compressed
+sitemaps (*.xml.gz, or any gzip body) are decompressed on the fly.
+
+The crawler queues these ahead of link-discovered pages, most recently
+modified first; link following only fills the gaps the sitemaps leave.
+"""
+import zlib
+import logging
+from datetime import datetime, timezone
+from typing import Callable, Iterator, List, Optional, Tuple
+from urllib.parse import urlparse
+from xml.etree import ElementTree
+
+logger = logging.getLogger(__name__)
+
+MAX_SITEMAP_DEPTH = 3        # sitemap index -> sitemap index -> sitemap is already unusual
+MAX_SITEMAPS = 500           # Sitemap files fetched per crawl
+SITEMAP_BASE_PRIORITY = 1.0  # Sitemap URLs without a lastmod still go ahead of link-discovered ones (priority 0)
+GZIP_MAGIC = b"\x1f\x8b"
+CHUNK_SIZE = 64 * 1024
+
+
+def sitemap_locations(rp, start_url: str) -> List[str]:
+    """Sitemaps listed in robots.txt, or the conventional /sitemap.xml."""
+    listed = (rp.site_maps() if rp is not None else None) or []
+    if listed:
+        return list(listed)
+    parsed = urlparse(start_url)
+    return [f"{parsed.scheme}://{parsed.netloc}/sitemap.xml"]
+
+
+def parse_lastmod(value: Optional[str]) -> Optional[datetime]:
+    """W3C datetime ("2024-05-01", "2024-05-01T10:00:00+04:00", "...Z") -> aware datetime."""
+    if not value:
+        return None
+    value = value.strip().replace("Z", "+00:00")
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        try:
+            parsed = datetime.strptime(value[:10], "%Y-%m-%d")
+        except ValueError:
+            return None
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+def lastmod_priority(lastmod: Optional[datetime]) -> float:
+    """Frontier priority for a sitemap URL: newer pages first, all of them ahead of plain links."""
+    if lastmod is None:
+        return SITEMAP_BASE_PRIORITY
+    return SITEMAP_BASE_PRIORITY + lastmod.timestamp()
+
+
+def _body_chunks(response) -> Iterator[bytes]:
+    """The response body in chunks, gunzipped if the file itself is gzip (requests already undid Content-Encoding)."""
+    inflate = None
+    for chunk in response.iter_content(CHUNK_SIZE):
+        if inflate is None:
+            inflate = zlib.decompressobj(16 + zlib.MAX_WBITS) if chunk[:2] == GZIP_MAGIC else False
+        yield inflate.decompress(chunk) if inflate else chunk
+
+
+def _local(tag: str) -> str:
+    return tag.rsplit("}", 1)[-1]
+
+
+def _iter_entries(chunks: Iterator[bytes]) -> Iterator[Tuple[str, str, Optional[str]]]:
+    """Streams (kind, loc, lastmod) out of a <urlset> ("url") or <sitemapindex> ("sitemap")."""
+    parser = ElementTree.XMLPullParser(events=("end",))
+    loc = lastmod = None
+    for chunk in chunks:
+        parser.feed(chunk)
+        for _, elem in parser.read_events():
+            name = _local(elem.tag)
+            if name == "loc":
+                loc = (elem.text or "").strip()
+            elif name == "lastmod":
+                lastmod = (elem.text or "").strip()
+            elif name in ("url", "sitemap"):
+                if loc:
+                    yield name, loc, lastmod
+                loc = lastmod = None
+                elem.clear()  # keep memory flat on huge sitemaps
+    parser.close()
+
+
+def iter_sitemap_urls(locations: List[str], fetch: Callable[[str], object]) -> Iterator[Tuple[str, Optional[datetime]]]:
+    """
+    Yields (page url, lastmod) from every sitemap reachable from `locations`.
+    `fetch(url)` returns a streaming requests response (the caller applies politeness).
+    Broken or missing sitemaps are logged and skipped.
+    """
+    pending = [(loc, 0) for loc in locations]
+    visited = set()
+    while pending and len(visited) < MAX_SITEMAPS:
+        location, depth = pending.pop(0)
+        if location in visited:
+            continue
+        visited.add(location)
+
+        try:
+            with fetch(location) as response:
+                if response.status_code != 200:
+                    logger.info(f"No sitemap at {location} (HTTP {response.status_code})")
+                    continue
+                found = nested = 0
+                for kind, loc, lastmod in _iter_entries(_body_chunks(response)):
+                    if kind == "sitemap":
+                        if depth < MAX_SITEMAP_DEPTH:
+                            pending.append((loc, depth + 1))
+                            nested += 1
+                    else:
+                        found += 1
+                        yield loc, parse_lastmod(lastmod)
+            logger.info(f"Sitemap {location}: {found} URLs" + (f", {nested} sitemaps" if nested else ""))
+        except (ElementTree.ParseError, zlib.error) as e:
+            logger.error(f"Could not read sitemap {location}: {e}")
+        except Exception as e:
+            logger.error(f"Error fetching sitemap {location}: {e}")
@@ -0,0 +1,162 @@
+"""
+Persistent crawl state for incremental re-crawls.
+
+For every URL the crawler has seen we remember the validators the server sent
+(ETag / Last-Modified), a hash of the raw body, a hash of the extracted document,
+the KB file it was written to, its near-duplicate signature (or the page it
+duplicates) and the links found on it. The next run sends
+conditional requests and skips parsing/rewriting pages that didn't change,
+reusing the stored links so discovery still works through unchanged pages.
+
+Each run also produces a changelist (added / updated / removed KB files) that
+can be handed to KnowledgeBase.reload(filenames).
+"""
+import os
+import json
+import hashlib
+import logging
+import threading
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+CRAWL_STATE = os.getenv("CRAWL_STATE", "app/data/crawl_state.json")
+CRAWL_CHANGES = os.getenv("CRAWL_CHANGES", "app/data/kb.changes.json")
+
+
+def content_hash(data) -> str:
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    return hashlib.sha1(data).hexdigest()
+
+
+def doc_hash(doc: dict) -> str:
+    return content_hash(json.dumps(doc, sort_keys=True))
+
+
+class CrawlState:
+    """url -> what we fetched last time. Thread-safe; saved atomically with save()."""
+
+    def __init__(self, path: str = CRAWL_STATE):
+        self.path = path
+        self.entries: Dict[str, dict] = {}
+        self.seen = set()  # urls handled (fetched or confirmed unchanged) in this run
+        self.changes = {"added": [], "updated": [], "removed": []}
+        self.lock = threading.Lock()
+
+        if path and os.path.exists(path):
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    self.entries = json.load(f)
+            except Exception as e:
+                logger.error(f"Could not read crawl state {path}, doing a full crawl: {e}")
+
+    def get(self, url: str) -> Optional[dict]:
+        with self.lock:
+            return self.entries.get(url)
+
+    def reusable(self, url: str) -> bool:
+        """
+        True if an unchanged fetch of the URL needs no work: we still have its KB file (and its
+        signature, for duplicate detection), or it is a near-duplicate of a page we still have.
+        """
+        with self.lock:
+            entry = self.entries.get(url) or {}
+            if entry.get("duplicate_of"):
+                return bool((self.entries.get(entry["duplicate_of"]) or {}).get("file"))
+            return bool(entry.get("file") and entry.get("signature"))
+
+    def conditional_headers(self, url: str) -> Dict[str, str]:
+        """If-None-Match / If-Modified-Since for a URL we fetched before."""
+        if not self.reusable(url):  # a 304 would leave us without what we need
+            return {}
+        entry = self.get(url)
+        headers = {}
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+    def unchanged(self, url: str) -> List[str]:
+        """Marks the URL as seen without changes; returns the links stored for it."""
+        with self.lock:
+            self.seen.add(url)
+            return list(self.entries.get(url, {}).get("links", []))
+
+    def record(self, url: str, response_headers, body_hash: str, filename: Optional[str],
+               document_hash: Optional[str], links: List[str], signature: Optional[str] = None,
+               duplicate_of: Optional[str] = None):
+        """
+        Stores a fresh fetch. `filename` is None if the page didn't produce a KB document,
+        either because it had none or because it is a near-duplicate of `duplicate_of`.
+        """
+        with self.lock:
+            self.seen.add(url)
+            old = self.entries.get(url) or {}
+            if filename and not old.get("file"):
+                self.changes["added"].append(filename)
+            elif filename and document_hash != old.get("doc_hash"):
+                self.changes["updated"].append(filename)
+            elif not filename and old.get("file"):
+                self.changes["removed"].append(old["file"])
+            self.entries[url] = {
+                "etag": response_headers.get("ETag"),
+                "last_modified": response_headers.get("Last-Modified"),
+                "hash": body_hash,
+                "doc_hash": document_hash,
+                "file": filename,
+                "signature": signature,
+                "duplicate_of": duplicate_of,
+                "links": links,
+            }
+
+    def forget(self, url: str) -> Optional[str]:
+        """Drops a URL that is gone (404/410); returns its KB file if it had one."""
+        with self.lock:
+            self.seen.add(url)
+            entry = self.entries.pop(url, None)
+            if entry and entry.get("file"):
+                self.changes["removed"].append(entry["file"])
+                return entry["file"]
+            return None
+
+    def forget_unseen(self) -> List[str]:
+        """After a complete crawl: URLs we didn't reach any more are gone. Returns their KB files."""
+        with self.lock:
+            files = []
+            live = {e.get("file") for u, e in self.entries.items() if u in self.seen}
+            for url in [u for u in self.entries if u not in self.seen]:
+                entry = self.entries.pop(url)
+                if entry.get("file") and entry["file"] not in live:  # another URL may have written the same file
+                    files.append(entry["file"])
+            self.changes["removed"].extend(files)
+            return files
+
+    def save(self):
+        if not self.path:
+            return
+        with self.lock:
+            data = json.dumps(self.entries)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(data)
+        os.replace(tmp_path, self.path)
+
+    def save_changes(self, path: str = CRAWL_CHANGES) -> Dict[str, List[str]]:
+        """Writes the changelist (unique filenames per kind) for downstream KB reloads."""
+        with self.lock:
+            changes = {kind: sorted(set(files)) for kind, files in self.changes.items()}
+        # A file that was removed and then re-added (renamed URL with the same name) is an update
+        for name in set(changes["removed"]) & (set(changes["added"]) | set(changes["updated"])):
+            changes["removed"].remove(name)
+        if path:
+            tmp_path = path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(changes, f, indent=4)
+            os.replace(tmp_path, path)
+        return changes
+
+    @property
+    def changed(self) -> bool:
+        return any(self.changes.values())
@@ -0,0 +1,386 @@
+"""
+In-memory doctor directory for name resolution on the call path.
+
+The Doctor table is small and changes rarely, but check_availability and
+book_appointment used to hit it on every request (and, when the ILIKE lookup
+missed, load the whole table and fuzzy-match every name from scratch). The
+directory loads it once (one joined query, branch names included) into an
+immutable DirectoryState:
+
+  - DoctorEntry rows by Doctor_Id
+  - one partition per Branch_Id (plus one for all branches), each with the
+    precomputed normalized names, a token -> doctors index, a phonetic index
+    (app/services/phonetic.py) and the fuzzy-matching choice list already run
+    through thefuzz's processor
+
+so resolving a spoken name is a few dict lookups, a substring scan or a
+rapidfuzz scan over ready-made strings, with no DB round trip. Names that
+speech-to-text garbles ("Dr. Shurma") are caught by the phonetic index before
+falling back to edit distance.
+
+Freshness: committed ORM inserts/updates/deletes of Doctor or Branch in this
+process invalidate the directory immediately, and it is refreshed in the background
+once it is older than DOCTOR_CACHE_TTL (changes made by other processes). A
+stale directory keeps serving while it refreshes.
+
+The async endpoints use aget() with an AsyncSession: the same load, run through
+the async connection, and background refreshes as event-loop tasks instead of
+threads. Lookups then go straight to the returned DirectoryState.
+"""
+import os
+import re
+import time
+import asyncio
+import logging
+import threading
+from typing import Dict, FrozenSet, List, NamedTuple, Optional, Tuple
+
+from rapidfuzz import fuzz, process
+from sqlalchemy import event
+from sqlalchemy.orm import Session, object_session
+from thefuzz import utils as fuzz_utils
+
+from app.core.database import SessionLocal
+from app.models.models import Branch, Doctor
+from app.services.phonetic import PhoneticIndex
+
+logger = logging.getLogger(__name__)
+
+DOCTOR_CACHE_TTL = float(os.getenv("DOCTOR_CACHE_TTL", "300"))  # seconds before a background refresh, 0 = reload on every lookup
+FUZZY_MIN_SCORE = 70    # Same cut-off the endpoints used with thefuzz.process.extractOne
+PHONETIC_MIN_SCORE = 50 # Spelling similarity a phonetic match still needs, even when every spoken word sounds right
+SUGGESTIONS = 3         # "Did you mean ...?" candidates offered when a name can't be resolved
+SPECIALTY_STEM = 6      # Shared leading letters that make two specialty words the same ("cardio")
+
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+TITLE_TOKENS = {"dr", "doctor", "prof", "mr", "mrs", "ms"}
+SPECIALTY_STOP_WORDS = {"and", "the", "for", "doctor", "specialist", "department"}
+
+
+def normalize_name(name: str) -> str:
+    """Lowercase, whitespace-collapsed name (what ILIKE '%...%' compared)."""
+    return " ".join((name or "").lower().split())
+
+
+def specialty_matches(needle: str, specialization: str) -> bool:
+    """
+    Case-insensitive match of `needle` as whole words of `specialization` ("surgery" ~ "General Surgery",
+    but "ENT" !~ "Dentistry"), or word by word, each needle word sharing a stem with (or starting)
+    a word of the specialization ("cardiologist" ~ "Cardiology", "internal med" ~ "Internal Medicine").
+    """
+    needle, specialization = normalize_name(needle), normalize_name(specialization)
+    if not needle or not specialization:
+        return False
+    if re.search(rf"\b{re.escape(needle)}\b", specialization):
+        return True
+    words = lambda text: [w for w in TOKEN_RE.findall(text) if len(w) >= 3 and w not in SPECIALTY_STOP_WORDS]
+    needle_words, specialty_words = words(needle), words(specialization)
+    return bool(needle_words) and all(
+        any(len(os.path.commonprefix([stem, word])) >= min(SPECIALTY_STEM, len(stem)) for word in specialty_words)
+        for stem in needle_words
+    )
+
+
+def name_tokens(name: str) -> FrozenSet[str]:
+    return frozenset(t for t in TOKEN_RE.findall(name.lower()) if t not in TITLE_TOKENS)
+
+
+class DoctorEntry(NamedTuple):
+    doctor_id: int
+    name: str
+    specialization: Optional[str]
+    branch_id: Optional[int]
+    branch_name: Optional[str]
+    normalized: str
+    tokens: FrozenSet[str]
+
+
+class BranchPartition:
+    """The doctors of one branch (or of all branches), with everything name resolution needs precomputed."""
+
+    def __init__(self, entries: List[DoctorEntry]):
+        self.entries = tuple(entries)  # by Doctor_Id, like the old query's .first()
+        self.by_token: Dict[str, List[DoctorEntry]] = {}
+        for entry in self.entries:
+            for token in entry.tokens:
+                self.by_token.setdefault(token, []).append(entry)
+        # thefuzz runs full_process on every choice on every call; do it once here
+        self.fuzzy_choices = [fuzz_utils.full_process(entry.name, force_ascii=True) for entry in self.entries]
+        self.phonetic = PhoneticIndex(stop_words=TITLE_TOKENS)
+        for position, entry in enumerate(self.entries):
+            self.phonetic.add(position, entry.name)
+        # Few distinct specialties, many doctors: match the specialty once, not every doctor
+        self.by_specialty: Dict[str, List[DoctorEntry]] = {}
+        for entry in self.entries:
+            self.by_specialty.setdefault((entry.specialization or "").lower(), []).append(entry)
+
+    def specialists(self, speciality: str) -> Tuple[DoctorEntry, ...]:
+        """Doctors whose specialization matches, by Doctor_Id."""
+        found = [entry for key, members in self.by_specialty.items() if specialty_matches(speciality, key) for entry in members]
+        return tuple(sorted(found, key=lambda e: e.doctor_id))
+
+    def candidates(self, clean_name: str, limit: int = SUGGESTIONS) -> List[Tuple[DoctorEntry, float]]:
+        """
+        Doctors whose names sound like `clean_name`, as (entry, score 0-100), best first.
+        Ranked by the share of spoken words that sound right, then by spelling similarity.
+        """
+        processed = fuzz_utils.full_process(clean_name or "", force_ascii=True)
+        ranked = []
+        for position, coverage in self.phonetic.candidates(clean_name or ""):
+            similarity = fuzz.WRatio(processed, self.fuzzy_choices[position])
+            ranked.append((coverage, similarity, position))
+        ranked.sort(key=lambda x: (x[0], x[1], -x[2]), reverse=True)
+        return [(self.entries[position], similarity) for coverage, similarity, position in ranked[:limit]]
+
+    def resolve(self, clean_name: str) -> Optional[DoctorEntry]:
+        """Best doctor for a cleaned spoken name: whole-word, substring, phonetic, then fuzzy match."""
+        query = normalize_name(clean_name)
+        if not query:
+            return None
+
+        # 1. Every word of the query is a word of the name ("smith", "john smith")
+        tokens = name_tokens(query)
+        if tokens:
+            candidates = None
+            for token in tokens:
+                hits = self.by_token.get(token)
+                if not hits:
+                    break
+                candidates = set(hits) if candidates is None else candidates & set(hits)
+            else:
+                if candidates:
+                    return min(candidates, key=lambda e: e.doctor_id)
+
+        # 2. Substring anywhere in the name (the old ILIKE '%name%')
+        for entry in self.entries:
+            if query in entry.normalized:
+                return entry
+
+        # 3. Sounds like it ("shurma" -> Sharma, "mohamad kan" -> Muhammad Khan), in any word order
+        processed = fuzz_utils.full_process(query, force_ascii=True)
+        best = None
+        for position, coverage in self.phonetic.candidates(query):
+            similarity = fuzz.WRatio(processed, self.fuzzy_choices[position])
+            if similarity <= PHONETIC_MIN_SCORE:
+                continue  # keys collide ("tina" ~ Dan, "nair" ~ Nour); the spelling has to be close too
+            if best is None or (coverage, similarity) > best[:2]:
+                best = (coverage, similarity, position)
+        if best:
+            return self.entries[best[2]]
+
+        # 4. Fuzzy fallback over the preprocessed names (same scorer and processing as thefuzz's extractOne)
+        if not self.fuzzy_choices:
+            return None
+        match = process.extractOne(processed, self.fuzzy_choices, scorer=fuzz.WRatio, processor=None)
+        if match and int(round(match[1])) > FUZZY_MIN_SCORE:
+            return self.entries[match[2]]
+        return None
+
+
+class DirectoryState:
+    """One immutable load of the Doctor table; swapped atomically on refresh."""
+
+    def __init__(self, entries: List[DoctorEntry]):
+        self.loaded_at = time.monotonic()
+        self.by_id: Dict[int, DoctorEntry] = {entry.doctor_id: entry for entry in entries}
+        branches: Dict[Optional[int], List[DoctorEntry]] = {}
+        for entry in entries:
+            branches.setdefault(entry.branch_id, []).append(entry)
+        self.partitions: Dict[Optional[int], BranchPartition] = {
+            branch_id: BranchPartition(members) for branch_id, members in branches.items()
+        }
+        self.everyone = BranchPartition(entries)
+        self.branch_names: Dict[int, str] = {e.branch_id: e.branch_name for e in entries if e.branch_id and e.branch_name}
+
+    def partition(self, branch_id: Optional[int] = None) -> BranchPartition:
+        if not branch_id:
+            return self.everyone
+        return self.partitions.get(branch_id) or BranchPartition([])
+
+    def resolve(self, clean_name: str, branch_id: Optional[int] = None) -> Optional[DoctorEntry]:
+        return self.partition(branch_id).resolve(clean_name)
+
+    def suggest(self, clean_name: str, branch_id: Optional[int] = None) -> List[str]:
+        """Names to offer the caller when `clean_name` couldn't be resolved."""
+        return [entry.name for entry, _ in self.partition(branch_id).candidates(clean_name)]
+
+    def filter(self, branch_id: Optional[int] = None, speciality: Optional[str] = None) -> Tuple[DoctorEntry, ...]:
+        partition = self.partition(branch_id)
+        return partition.specialists(speciality) if speciality else partition.entries
+
+    def branch_id_for(self, branch) -> Optional[int]:
+        """Branch_Id for an id or a spoken branch name ("Al Safa", "safa branch"); None if nothing matches."""
+        if branch is None or branch == "" or isinstance(branch, bool):  # a stray true/false in the tool call isn't branch 1/0
+            return None
+        if isinstance(branch, int) or str(branch).strip().isdigit():
+            return int(branch)
+        names = self.branch_names
+        spoken = normalize_name(re.sub(r"\b(branch|hospital|clinic|medcare|centre|center)\b", " ", str(branch), flags=re.IGNORECASE))
+        for branch_id, name in names.items():
+            if spoken and spoken in name.lower():
+                return branch_id
+        match = process.extractOne(spoken, names, scorer=fuzz.WRatio, processor=fuzz_utils.full_process) if spoken and names else None
+        return match[2] if match and match[1] > FUZZY_MIN_SCORE else None
+
+
+def load_entries(db) -> List[DoctorEntry]:
+    rows = (
+        db.query(Doctor.Doctor_Id, Doctor.Doctor_Name, Doctor.Specialization, Doctor.Branch_Id, Branch.Branch_Name)
+        .outerjoin(Branch, Doctor.Branch_Id == Branch.Branch_Id)
+        .order_by(Doctor.Doctor_Id)
+        .all()
+    )
+    return [
+        DoctorEntry(doctor_id, name, specialization, branch_id, branch_name, normalize_name(name), name_tokens(name))
+        for doctor_id, name, specialization, branch_id, branch_name in rows
+    ]
+
+
+class DoctorDirectory:
+    """
+    Cached view of the Doctor table. Thread-safe: readers only ever see a complete DirectoryState.
+    The first lookup loads it with the caller's session; later refreshes run on a background thread.
+    """
+
+    def __init__(self, ttl: float = DOCTOR_CACHE_TTL):
+        self.ttl = ttl
+        self._state: Optional[DirectoryState] = None
+        self._stale = False
+        self._lock = threading.Lock()          # one synchronous load at a time
+        self._async_lock: Optional[asyncio.Lock] = None     # one load at a time on the event loop (see _loop_lock)
+        self._async_lock_loop: Optional[asyncio.AbstractEventLoop] = None
+        self._refresh_task: Optional[asyncio.Task] = None  # the running async refresh, kept so it isn't garbage-collected
+        self._refreshing = threading.Event()   # set while a background refresh runs
+
+    def invalidate(self):
+        """Marks the directory stale; the next lookup reloads it."""
+        self._stale = True
+
+    def _needs_load(self) -> bool:
+        return self._state is None or self._stale or self.ttl <= 0
+
+    def _install(self, entries: List[DoctorEntry], started: float) -> DirectoryState:
+        state = DirectoryState(entries)
+        self._state = state
+        logger.info(f"Doctor directory loaded: {len(state.by_id)} doctors, {len(state.partitions)} branches in {(time.perf_counter() - started) * 1000:.1f}ms")
+        return state
+
+    def load(self, db) -> DirectoryState:
+        started = time.perf_counter()
+        self._stale = False  # changes committed while we load mark it stale again
+        return self._install(load_entries(db), started)
+
+    async def aload(self, db) -> DirectoryState:
+        """load() through an AsyncSession."""
+        started = time.perf_counter()
+        self._stale = False
+        return self._install(await db.run_sync(load_entries), started)
+
+    def _refresh_in_background(self):
+        if self._refreshing.is_set():
+            return
+        self._refreshing.set()
+
+        def _run():
+            db = SessionLocal()
+            try:
+                self.load(db)
+            except Exception as e:
+                logger.error(f"Doctor directory refresh failed, keeping the previous one: {e}")
+            finally:
+                db.close()
+                self._refreshing.clear()
+
+        threading.Thread(target=_run, name="doctor-directory", daemon=True).start()
+
+    def get(self, db) -> DirectoryState:
+        """The current directory; loads it with `db` the first time or after invalidate()."""
+        state = self._state
+        if self._needs_load():
+            with self._lock:
+                if self._needs_load():
+                    return self.load(db)
+                return self._state
+        if time.monotonic() - state.loaded_at > self.ttl:
+            self._refresh_in_background()  # serve the current one meanwhile
+        return state
+
+    def _loop_lock(self) -> asyncio.Lock:
+        # Created inside the running loop (a thread lock would block it), and again if the app moved to a new loop
+        loop = asyncio.get_running_loop()
+        if self._async_lock is None or self._async_lock_loop is not loop:
+            self._async_lock, self._async_lock_loop = asyncio.Lock(), loop
+        return self._async_lock
+
+    def _refresh_running(self) -> bool:
+        task = self._refresh_task
+        if task is not None and not task.done():
+            return task.get_loop() is asyncio.get_running_loop()  # a task left on a closed loop never finishes
+        return self._refreshing.is_set()  # a sync refresh thread is at it
+
+    async def aget(self, db) -> DirectoryState:
+        """get() for the async endpoints: loads through the AsyncSession `db`, refreshes as an event-loop task."""
+        state = self._state
+        if self._needs_load():
+            async with self._loop_lock():
+                if self._needs_load():
+                    return await self.aload(db)
+                return self._state
+        if time.monotonic() - state.loaded_at > self.ttl and not self._refresh_running():
+            self._refreshing.set()
+            self._refresh_task = asyncio.get_running_loop().create_task(self._refresh_async(db.bind))
+        return state
+
+    async def _refresh_async(self, bind):
+        from sqlalchemy.ext.asyncio import AsyncSession
+
+        try:
+            async with AsyncSession(bind) as db:
+                await self.aload(db)
+        except Exception as e:
+            logger.error(f"Doctor directory refresh failed, keeping the previous one: {e}")
+        finally:
+            self._refreshing.clear()
+
+    # Convenience lookups used by the sync endpoints
+    def resolve(self, db, clean_name: str, branch_id: Optional[int] = None) -> Optional[DoctorEntry]:
+        return self.get(db).resolve(clean_name, branch_id)
+
+    def suggest(self, db, clean_name: str, branch_id: Optional[int] = None) -> List[str]:
+        return self.get(db).suggest(clean_name, branch_id)
+
+    def by_id(self, db, doctor_id: int) -> Optional[DoctorEntry]:
+        return self.get(db).by_id.get(doctor_id)
+
+    def filter(self, db, branch_id: Optional[int] = None, speciality: Optional[str] = None) -> Tuple[DoctorEntry, ...]:
+        return self.get(db).filter(branch_id, speciality)
+
+    def branch_id_for(self, db, branch) -> Optional[int]:
+        return self.get(db).branch_id_for(branch)
+
+
+doctor_directory = DoctorDirectory()
+
+
+# Any committed ORM write to doctors or branches in this process makes the directory stale right away
+# (flagged on flush, applied on commit, so a concurrent reload can't pick up the old rows and call itself fresh)
+def _flag_session(mapper, connection, target):
+    session = object_session(target)
+    if session is not None:
+        session.info["doctor_directory_dirty"] = True
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_on_commit(session):
+    if session.info.pop("doctor_directory_dirty", False):
+        doctor_directory.invalidate()
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_on_rollback(session):
+    session.info.pop("doctor_directory_dirty", None)
+
+
+for _model in (Doctor, Branch):
+    for _event in ("after_insert", "after_update", "after_delete"):
+        event.listen(_model, _event, _flag_session)
@@ -0,0 +1,298 @@
+"""
+Dense retrieval over the KB passages without any external model.
+
+Each passage becomes a hashed feature vector (words and light stems, sublinear
+tf x idf, L2-normalized) stored as one NumPy matrix indexed by passage_id. Stems
+give partial credit to inflections ("visit" / "visiting" / "visitors") that exact
+keyword matching misses.
+
+The idf is kept per feature (keyed by its full 32-bit hash) and applied before the
+features are folded into DENSE_DIM buckets, with a hash bit choosing the sign. So a
+rare word that shares a bucket with a common one keeps its own high weight, and
+colliding features cancel out instead of piling up.
+
+Above IVF_MIN_PASSAGES the vectors are clustered with spherical k-means
+(an IVF index): a query is only compared against the passages in its
+IVF_NPROBE nearest clusters, which keeps search in the low milliseconds at 100k passages.
+
+Build offline for a snapshot with `python -m app.services.kb_dense`.
+"""
+import os
+import sys
+import zlib
+import logging
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from app.services.kb_index import STOP_WORDS, tokenize
+
+logger = logging.getLogger(__name__)
+
+KB_DENSE_INDEX = os.getenv("KB_DENSE_INDEX", "app/data/kb.dense.npz")
+DENSE_DIM = int(os.getenv("KB_DENSE_DIM", "512"))  # power of two
+IVF_MIN_PASSAGES = 2000    # Below this a brute-force scan is already fast enough
+IVF_NPROBE = 12            # Clusters searched per query
+KMEANS_ITERATIONS = 8
+BATCH_SIZE = 2048          # Passages vectorized per numpy batch while building
+SIGN_BIT = 1 << 31         # Feature hash bit that makes its contribution negative
+STEM_SUFFIXES = ("ations", "ation", "ings", "ing", "ers", "ors", "ies", "es", "ed", "er", "or", "s")
+MIN_STEM = 4               # Letters a stem must keep ("visitors" -> "visit", "uses" stays)
+WORD_CACHE_SIZE = 1 << 18  # Words whose feature hashes are memoized
+
+
+def stem(word: str) -> str:
+    """Light suffix stripping so inflections share a feature ("visiting" / "visitors" / "visit")."""
+    for suffix in STEM_SUFFIXES:
+        if word.endswith(suffix) and len(word) - len(suffix) >= MIN_STEM:
+            return word[:-len(suffix)] + ("y" if suffix == "ies" else "")
+    return word
+
+
+@lru_cache(maxsize=WORD_CACHE_SIZE)
+def _word_features(word: str) -> Tuple[int, int]:
+    # The word itself, and its stem (shared by every inflection of the word)
+    return zlib.crc32(word.encode("utf-8")), zlib.crc32(("~" + stem(word)).encode("utf-8"))
+
+
+def features(text: str) -> List[int]:
+    """Feature hashes (crc32, stable across processes) for a piece of text."""
+    return [h for word in tokenize(text) if word not in STOP_WORDS for h in _word_features(word)]
+
+
+def _term_frequencies(texts: List[str]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """(row, feature hash, count) for every distinct feature of every text."""
+    keys = [(row << 32) | h for row, text in enumerate(texts) for h in features(text)]
+    keys, counts = np.unique(np.asarray(keys, dtype=np.int64), return_counts=True)
+    return keys >> 32, (keys & 0xFFFFFFFF).astype(np.uint32), counts
+
+
+def _normalize(x: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(x, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return x / norms
+
+
+class DenseIndex:
+    """
+    Passage vectors (row = passage_id) plus an optional IVF partition.
+    Like InvertedIndex it is never modified once built; apply() returns a new one.
+    """
+
+    def __init__(self):
+        self.vectors = np.zeros((0, DENSE_DIM), dtype=np.float32)
+        self.feature_ids = np.zeros(0, dtype=np.uint32)   # sorted feature hashes seen at build time...
+        self.feature_idf = np.zeros(0, dtype=np.float32)  # ...and their idf (unseen features weigh nothing)
+        self.centroids: Optional[np.ndarray] = None   # (nlist, DIM), None = brute force
+        self.assign = np.zeros(0, dtype=np.int32)      # passage_id -> cluster (-1 = removed / never indexed)
+        self.lists: List[np.ndarray] = []              # cluster -> passage ids
+
+    # ------------------------------------------
+    # Building
+    # ------------------------------------------
+
+    @classmethod
+    def build(cls, texts: Dict[int, str]) -> "DenseIndex":
+        """texts maps passage_id -> passage text."""
+        index = cls()
+        pids = np.fromiter(sorted(texts), dtype=np.int64, count=len(texts))
+        size = int(pids.max()) + 1 if len(pids) else 0
+
+        batches = [pids[start:start + BATCH_SIZE] for start in range(0, len(pids), BATCH_SIZE)]
+
+        # 1. Document frequency of every feature (each passage counts a feature once)
+        seen = [_term_frequencies([texts[int(pid)] for pid in batch])[1] for batch in batches]
+        ids, df = np.unique(np.concatenate(seen) if seen else np.zeros(0, dtype=np.uint32), return_counts=True)
+        index.feature_ids = ids
+        index.feature_idf = (np.log((len(pids) + 1) / (df + 1)) + 1).astype(np.float32)
+
+        # 2. Weighted, signed feature vectors folded into DENSE_DIM buckets
+        index.vectors = np.zeros((size, DENSE_DIM), dtype=np.float32)
+        for batch in batches:
+            index.vectors[batch] = index._vectorize([texts[int(pid)] for pid in batch])
+
+        index.assign = np.full(size, -1, dtype=np.int32)
+        if len(pids) >= IVF_MIN_PASSAGES:
+            index.centroids = index._kmeans(pids)
+            index.assign[pids] = index._nearest(index.vectors[pids])
+        else:
+            index.assign[pids] = 0
+        index._rebuild_lists()
+        return index
+
+    def _vectorize(self, texts: List[str]) -> np.ndarray:
+        rows, ids, counts = _term_frequencies(texts)
+        weights = np.zeros(len(ids))
+        if len(self.feature_ids):
+            slots = np.minimum(np.searchsorted(self.feature_ids, ids), len(self.feature_ids) - 1)
+            known = self.feature_ids[slots] == ids
+            weights[known] = np.log1p(counts[known]) * self.feature_idf[slots[known]]
+        weights[(ids & SIGN_BIT) != 0] *= -1
+        flat = rows * DENSE_DIM + (ids & (DENSE_DIM - 1))
+        vectors = np.bincount(flat, weights=weights, minlength=len(texts) * DENSE_DIM).reshape(len(texts), DENSE_DIM)
+        return _normalize(vectors).astype(np.float32)
+
+    def _kmeans(self, pids: np.ndarray) -> np.ndarray:
+        nlist = int(np.sqrt(len(pids)))
+        rng = np.random.default_rng(0)
+        sample = self.vectors[rng.choice(pids, size=min(len(pids), nlist * 64), replace=False)]
+        centroids = sample[rng.choice(len(sample), size=nlist, replace=False)].copy()
+        for _ in range(KMEANS_ITERATIONS):
+            nearest = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, nearest, sample)
+            empty = np.bincount(nearest, minlength=nlist) == 0
+            sums[empty] = centroids[empty]  # keep empty clusters where they were
+            centroids = _normalize(sums)
+        return centroids.astype(np.float32)
+
+    def _nearest(self, vectors: np.ndarray) -> np.ndarray:
+        out = np.empty(len(vectors), dtype=np.int32)
+        for start in range(0, len(vectors), BATCH_SIZE):
+            out[start:start + BATCH_SIZE] = np.argmax(vectors[start:start + BATCH_SIZE] @ self.centroids.T, axis=1)
+        return out
+
+    def _rebuild_lists(self):
+        nlist = len(self.centroids) if self.centroids is not None else 1
+        live = np.flatnonzero(self.assign >= 0)
+        order = live[np.argsort(self.assign[live], kind="stable")]
+        bounds = np.cumsum(np.bincount(self.assign[live], minlength=nlist))[:-1]
+        self.lists = np.split(order, bounds)
+
+    def apply(self, removed: Iterable[int], added: Dict[int, str]) -> "DenseIndex":
+        """
+        New index with `removed` passages dropped and `added` ones vectorized (idf and
+        clusters are kept from the original build; only the touched clusters are copied).
+        """
+        new = DenseIndex()
+        new.feature_ids = self.feature_ids
+        new.feature_idf = self.feature_idf
+        new.centroids = self.centroids
+        new.lists = list(self.lists)
+
+        size = max([len(self.assign)] + [pid + 1 for pid in added])
+        new.assign = np.full(size, -1, dtype=np.int32)
+        new.assign[:len(self.assign)] = self.assign
+        new.vectors = self.vectors
+        if size > len(self.vectors):
+            new.vectors = np.concatenate([self.vectors, np.zeros((size - len(self.vectors), DENSE_DIM), dtype=np.float32)])
+
+        touched: Dict[int, List[int]] = {}  # cluster -> passage ids joining it
+        for pid in removed:
+            if pid < len(new.assign) and new.assign[pid] >= 0:
+                touched.setdefault(int(new.assign[pid]), [])
+                new.assign[pid] = -1
+
+        if added:
+            pids = np.fromiter(sorted(added), dtype=np.int64, count=len(added))
+            if new.vectors is self.vectors:
+                new.vectors = self.vectors.copy()
+            new.vectors[pids] = new._vectorize([added[int(pid)] for pid in pids])
+            clusters = new._nearest(new.vectors[pids]) if new.centroids is not None else np.zeros(len(pids), dtype=np.int32)
+            new.assign[pids] = clusters
+            for pid, cluster in zip(pids.tolist(), clusters.tolist()):
+                touched.setdefault(cluster, []).append(pid)
+
+        for cluster, joining in touched.items():
+            members = new.lists[cluster]
+            members = members[new.assign[members] == cluster]
+            new.lists[cluster] = np.concatenate([members, np.asarray(joining, dtype=members.dtype)])
+        return new
+
+    # ------------------------------------------
+    # Search
+    # ------------------------------------------
+
+    def embed(self, query: str) -> np.ndarray:
+        return self._vectorize([query])[0]
+
+    def search(self, query: str, k: int, include: Iterable[int] = ()) -> Dict[int, float]:
+        """
+        passage_id -> cosine similarity for the top k passages. Passages in `include`
+        (e.g. the keyword candidates in hybrid mode) are scored even when the IVF
+        probes miss their cluster.
+        """
+        q = self.embed(query)
+        if not q.any() or not self.lists:
+            return {}
+
+        if self.centroids is None:
+            candidates = self.lists[0]
+        else:
+            nprobe = min(IVF_NPROBE, len(self.centroids))
+            probes = np.argpartition(-(self.centroids @ q), nprobe - 1)[:nprobe]
+            candidates = np.concatenate([self.lists[c] for c in probes])
+            extra = np.fromiter(include, dtype=np.int64)
+            if len(extra):
+                extra = extra[extra < len(self.assign)]
+                extra = extra[self.assign[extra] >= 0]
+                candidates = np.union1d(candidates, extra)
+        if not len(candidates):
+            return {}
+
+        scores = self.vectors[candidates] @ q
+        top = np.argpartition(-scores, min(k, len(scores)) - 1)[:k]
+        return {int(candidates[i]): float(scores[i]) for i in top if scores[i] > 0}
+
+    # ------------------------------------------
+    # Persistence
+    # ------------------------------------------
+
+    def save(self, path: str, fingerprint: Tuple[int, ...] = ()):
+        tmp_path = path + ".tmp.npz"
+        np.savez(
+            tmp_path, vectors=self.vectors, feature_ids=self.feature_ids, feature_idf=self.feature_idf, assign=self.assign,
+            centroids=self.centroids if self.centroids is not None else np.zeros((0, DENSE_DIM), dtype=np.float32),
+            fingerprint=np.asarray(fingerprint, dtype=np.int64),
+        )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str, fingerprint: Tuple[int, ...] = ()) -> Optional["DenseIndex"]:
+        """The saved index, or None if it was built for a different KB (fingerprint mismatch)."""
+        with np.load(path) as data:
+            if tuple(int(x) for x in data["fingerprint"]) != tuple(fingerprint) or data["vectors"].shape[1] != DENSE_DIM:
+                return None
+            if "feature_ids" not in data:
+                return None  # written by an older version of this module
+            index = cls()
+            index.vectors = data["vectors"]
+            index.feature_ids = data["feature_ids"]
+            index.feature_idf = data["feature_idf"]
+            index.assign = data["assign"]
+            index.centroids = data["centroids"] if len(data["centroids"]) else None
+        index._rebuild_lists()
+        return index
+
+
+def fingerprint(state) -> Tuple[int, ...]:
+    """
+    Identifies the KB contents a saved dense index was built from: the CRC recorded
+    in the snapshot header (computed from the snapshot bytes for snapshots written
+    without one, or from every passage text when there is no snapshot buffer).
+    """
+    buf = getattr(state, "buf", None)
+    if getattr(state, "checksum", 0):
+        digest = state.checksum
+    elif buf is not None:
+        digest = zlib.crc32(buf)
+    else:
+        digest = 0
+        for pid in state.passage_ids():
+            digest = zlib.crc32(state.passage_text(pid).encode("utf-8"), digest)
+    return (digest, state.num_passages, DENSE_DIM)
+
+
+def build_for_state(state) -> DenseIndex:
+    return DenseIndex.build({pid: state.passage_text(pid) for pid in state.passage_ids()})
+
+
+if __name__ == "__main__":
+    from app.services.kb_snapshot import KB_SNAPSHOT, open_snapshot
+
+    logging.basicConfig(level=logging.INFO)
+    snapshot = open_snapshot(sys.argv[1] if len(sys.argv) > 1 else KB_SNAPSHOT)
+    path = sys.argv[2] if len(sys.argv) > 2 else KB_DENSE_INDEX
+    build_for_state(snapshot).save(path, fingerprint(snapshot))
+    logger.info(f"Wrote dense index for {snapshot.num_passages} passages to {path}")
@@ -0,0 +1,500 @@
+import re
+import math
+import bisect
+import itertools
+from array import array
+from collections import defaultdict
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+# Stop words to ignore during search (also the filler stripped from cache keys)
+STOP_WORDS = {
+    "we", "are", "is", "am", "the", "a", "an", "for", "to",
+    "do", "you", "have", "any", "very", "keen", "please",
+    "i", "want", "can", "tell", "me", "about",
+    "what", "when", "how", "does", "your", "our", "my", "and",
+    "there", "this", "that", "could", "would", "know", "like", "need",
+    "hello", "okay", "just", "also", "some"
+}
+
+# --- BM25 TUNING ---
+BM25_K1 = 1.5
+BM25_B = 0.75
+PREFIX_MIN_LEN = 4     # "cardio" -> "cardiology", but "car" won't explode
+MAX_EXPANSIONS = 10    # Cap on vocabulary terms a single query word can expand to
+
+# --- TYPO TOLERANCE (speech-to-text misspellings) ---
+FUZZY_MIN_LEN = 4          # Shorter words are too ambiguous to correct
+FUZZY_MIN_DICE = 0.4       # Trigram overlap needed before we pay for an edit-distance check
+MAX_CORRECTIONS = 3        # Nearest indexed terms a misspelled word can map to
+
+# --- PASSAGES ---
+PASSAGE_MAX_CHARS = 500      # Sentences are packed into passages up to this size
+
+# --- CURATED FAQ ---
+FAQ_TYPE = "qa"              # Document type scraper.py gives the hardcoded Q&A pairs
+FAQ_TITLE_PREFIX = "FAQ: "
+
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+SENTENCE_BREAK_RE = re.compile(r"(?<=[.!?])\s+|\n+")
+
+
+def tokenize(text: str) -> List[str]:
+    return TOKEN_RE.findall(text.lower())
+
+
+def query_words(query: str) -> List[str]:
+    # Remove stop words and short words
+    return [w for w in tokenize(query) if w not in STOP_WORDS and len(w) > 2]
+
+
+def normalize_query(query: str) -> str:
+    """Cache key form of a query: lowercased, stop words stripped, unique terms sorted."""
+    return " ".join(sorted(set(query_words(query))))
+
+
+def faq_questions(doc: dict) -> List[str]:
+    """The question a curated FAQ document answers, plus its curated aliases."""
+    title = doc.get("title") or ""
+    question = title[len(FAQ_TITLE_PREFIX):] if title.startswith(FAQ_TITLE_PREFIX) else title
+    return [question] + list(doc.get("aliases") or [])
+
+
+def estimate_tokens(text: str) -> int:
+    # ~4 characters per token for English text, good enough for budgeting
+    return max(1, len(text) // 4)
+
+
+def split_sentences(content: str) -> List[Tuple[int, int]]:
+    """(start, end) offsets of each sentence/line in the content, whitespace trimmed."""
+    spans = []
+    start = 0
+    for m in SENTENCE_BREAK_RE.finditer(content):
+        spans.append((start, m.start()))
+        start = m.end()
+    spans.append((start, len(content)))
+
+    trimmed = []
+    for s, e in spans:
+        while s < e and content[s].isspace():
+            s += 1
+        while e > s and content[e - 1].isspace():
+            e -= 1
+        if s < e:
+            trimmed.append((s, e))
+    return trimmed
+
+
+def split_passages(content: str, max_chars: int = PASSAGE_MAX_CHARS) -> List[Tuple[int, int]]:
+    """
+    Packs consecutive sentences into passages of at most max_chars.
+    A single sentence longer than that is cut on whitespace.
+    Returns (start, end) offsets into the content, nothing is copied.
+    """
+    passages = []
+    cur_start, cur_end = None, None
+
+    for s, e in split_sentences(content):
+        # Oversized sentence: flush and hard-split it
+        while e - s > max_chars:
+            if cur_start is not None:
+                passages.append((cur_start, cur_end))
+                cur_start = None
+            cut = content.rfind(" ", s, s + max_chars)
+            if cut <= s:
+                cut = s + max_chars
+            passages.append((s, cut))
+            s = cut
+            while s < e and content[s].isspace():
+                s += 1
+
+        if s >= e:
+            continue
+        if cur_start is None:
+            cur_start, cur_end = s, e
+        elif e - cur_start <= max_chars:
+            cur_end = e
+        else:
+            passages.append((cur_start, cur_end))
+            cur_start, cur_end = s, e
+
+    if cur_start is not None:
+        passages.append((cur_start, cur_end))
+    return passages
+
+
+def centered_snippet(text: str, words: List[str], max_chars: int) -> str:
+    """Cuts a max_chars window out of text, centered on the first query word hit."""
+    if len(text) <= max_chars:
+        return text
+
+    lowered = text.lower()
+    hits = [i for i in (lowered.find(w) for w in words) if i >= 0]
+    center = min(hits) if hits else 0
+
+    start = max(0, min(center - max_chars // 2, len(text) - max_chars))
+    end = start + max_chars
+    # Snap to word boundaries so we don't hand the LLM half-words
+    if start > 0:
+        space = text.find(" ", start)
+        if 0 <= space < center:
+            start = space + 1
+    if end < len(text):
+        space = text.rfind(" ", start, end)
+        if space > center:
+            end = space
+
+    prefix = "..." if start > 0 else ""
+    suffix = "..." if end < len(text) else ""
+    return prefix + text[start:end].strip() + suffix
+
+
+def term_counts(text: str) -> Tuple[Dict[str, int], int]:
+    counts: Dict[str, int] = defaultdict(int)
+    tokens = tokenize(text)
+    for token in tokens:
+        counts[token] += 1
+    return counts, len(tokens)
+
+
+def trigrams(term: str) -> set:
+    padded = f"${term}$"
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def edit_distance(a: str, b: str, max_dist: int) -> int:
+    """Damerau-Levenshtein (adjacent swaps count as 1), gives up once it exceeds max_dist."""
+    if abs(len(a) - len(b)) > max_dist:
+        return max_dist + 1
+    prev2, prev = None, list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        cur = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            cur[j] = min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                cur[j] = min(cur[j], prev2[j - 2] + 1)
+        if min(cur) > max_dist:
+            return max_dist + 1
+        prev2, prev = prev, cur
+    return prev[-1]
+
+
+class TrigramIndex:
+    """
+    (trigram, term length) -> terms, over the index vocabulary.
+    Maps a misspelled query word to its nearest indexed terms by only looking at
+    terms of similar length that share trigrams with it. Copy-on-write like InvertedIndex.
+    """
+
+    def __init__(self, terms=()):
+        grams: Dict[Tuple[str, int], List[str]] = defaultdict(list)
+        for term in terms:
+            for gram in trigrams(term):
+                grams[(gram, len(term))].append(term)
+        self.grams: Dict[Tuple[str, int], Tuple[str, ...]] = {k: tuple(v) for k, v in grams.items()}
+
+    def apply(self, added: List[str], removed: List[str]) -> "TrigramIndex":
+        new = TrigramIndex()
+        new.grams = dict(self.grams)
+        changes: Dict[Tuple[str, int], Tuple[set, set]] = defaultdict(lambda: (set(), set()))
+        for term in added:
+            for gram in trigrams(term):
+                changes[(gram, len(term))][0].add(term)
+        for term in removed:
+            for gram in trigrams(term):
+                changes[(gram, len(term))][1].add(term)
+        for key, (plus, minus) in changes.items():
+            terms = tuple(t for t in new.grams.get(key, ()) if t not in minus) + tuple(plus)
+            if terms:
+                new.grams[key] = terms
+            else:
+                new.grams.pop(key, None)
+        return new
+
+    def lookup(self, word: str, limit: int = MAX_CORRECTIONS) -> List[str]:
+        max_dist = 1 if len(word) <= 5 else 2
+        grams = trigrams(word)
+
+        # 1. Count shared trigrams, only for terms within max_dist of the word's length
+        shared: Dict[str, int] = defaultdict(int)
+        for length in range(len(word) - max_dist, len(word) + max_dist + 1):
+            for gram in grams:
+                for term in self.grams.get((gram, length), ()):
+                    shared[term] += 1
+
+        # 2. Verify the promising ones with a bounded edit distance
+        matches = []
+        for term, count in shared.items():
+            dice = 2 * count / (len(grams) + len(term))  # a padded term of length n has (at most) n trigrams
+            if dice < FUZZY_MIN_DICE:
+                continue
+            dist = edit_distance(word, term, max_dist)
+            if dist <= max_dist:
+                matches.append((dist, -dice, term))
+
+        matches.sort()
+        best = matches[0][0] if matches else 0
+        return [term for dist, _, term in matches[:limit] if dist == best]
+
+
+class InvertedIndex:
+    """
+    Term -> postings index over the KB passages.
+    Each posting list is a pair of parallel arrays (sorted passage_ids, term_frequencies),
+    so a query only touches the passages that actually contain its terms.
+
+    An index is never modified once published: apply() returns a new index that
+    shares every posting list the change didn't touch (copy-on-write).
+    """
+
+    def __init__(self, texts: List[str] = ()):
+        self.postings: Dict[str, Tuple[array, array]] = {}
+        self.doc_lengths: List[int] = []  # passage_id -> token count (0 once removed)
+        self.vocab: List[str] = []        # sorted, for prefix expansion
+        self.num_docs = 0
+        self.total_length = 0
+        self._trigrams: Optional[TrigramIndex] = None  # built on the first misspelled query
+        if texts:
+            self._ingest({}, dict(enumerate(texts)))
+
+    @property
+    def avg_doc_length(self) -> float:
+        return (self.total_length / self.num_docs) if self.num_docs else 0.0
+
+    def apply(self, removed: Dict[int, str], added: Dict[int, str]) -> "InvertedIndex":
+        """
+        New index with `removed` passages dropped and `added` ones indexed.
+        Both map passage_id -> passage text. Only the postings lists of the terms
+        those passages contain are rebuilt; the others are shared with this index.
+        The term -> postings dict, doc_lengths and vocab are still shallow-copied
+        on every apply, so each call is also O(vocabulary + passages), just cheap
+        per item.
+        """
+        new = InvertedIndex()
+        new.postings = dict(self.postings)   # shallow: untouched lists are shared
+        new.doc_lengths = list(self.doc_lengths)
+        new.vocab = list(self.vocab)
+        new.num_docs = self.num_docs
+        new.total_length = self.total_length
+        new_terms, gone_terms = new._ingest(removed, added)
+        if self._trigrams is not None:
+            new._trigrams = self._trigrams.apply(new_terms, gone_terms)
+        return new
+
+    def _ingest(self, removed: Dict[int, str], added: Dict[int, str]) -> Tuple[List[str], List[str]]:
+        """Applies the change in place (only on an unpublished index); returns the terms that entered/left the vocab."""
+        # 1. Which postings to drop, per term
+        dead: Dict[str, List[int]] = defaultdict(list)
+        for pid, text in removed.items():
+            counts, _ = term_counts(text)
+            for term in counts:
+                dead[term].append(pid)
+            self.total_length -= self.doc_lengths[pid]
+            self.doc_lengths[pid] = 0
+            self.num_docs -= 1
+
+        # 2. Which postings to add, per term (new ids are always the largest, so lists stay sorted)
+        fresh: Dict[str, Tuple[array, array]] = {}
+        for pid in sorted(added):
+            counts, length = term_counts(added[pid])
+            if pid >= len(self.doc_lengths):
+                self.doc_lengths.extend([0] * (pid + 1 - len(self.doc_lengths)))
+            self.doc_lengths[pid] = length
+            self.total_length += length
+            self.num_docs += 1
+            for term, tf in counts.items():
+                if term not in fresh:
+                    fresh[term] = (array("I"), array("I"))
+                fresh[term][0].append(pid)
+                fresh[term][1].append(tf)
+
+        # 3. Rebuild only the touched posting lists (never mutate a shared array)
+        new_terms, gone_terms = [], []
+        empty = (array("I"), array("I"))
+        for term in dead.keys() | fresh.keys():
+            pids, tfs = self.postings.get(term, empty)
+            new_pids, new_tfs = array("I"), array("I")
+
+            # Splice around the dead ids with slices (memcpy) instead of a per-posting loop
+            lo = 0
+            for pid in sorted(dead.get(term, ())):
+                i = bisect.bisect_left(pids, pid, lo)
+                if i < len(pids) and pids[i] == pid:
+                    new_pids += pids[lo:i]
+                    new_tfs += tfs[lo:i]
+                    lo = i + 1
+            new_pids += pids[lo:]
+            new_tfs += tfs[lo:]
+
+            if term in fresh:
+                new_pids += fresh[term][0]
+                new_tfs += fresh[term][1]
+
+            if new_pids:
+                if term not in self.postings:
+                    bisect.insort(self.vocab, term)
+                    new_terms.append(term)
+                self.postings[term] = (new_pids, new_tfs)
+            elif term in self.postings:
+                del self.postings[term]
+                self.vocab.pop(bisect.bisect_left(self.vocab, term))
+                gone_terms.append(term)
+        return new_terms, gone_terms
+
+    @property
+    def trigrams(self) -> TrigramIndex:
+        if self._trigrams is None:
+            self._trigrams = TrigramIndex(self.vocab)
+        return self._trigrams
+
+    def expand(self, word: str) -> List[str]:
+        """
+        Exact term plus indexed terms that start with it (keeps the old substring recall).
+        A word that matches nothing (e.g. "cardiolgy") maps to its nearest indexed terms instead.
+        """
+        terms = [word] if word in self.postings else []
+        if len(word) >= PREFIX_MIN_LEN:
+            i = bisect.bisect_right(self.vocab, word)
+            while i < len(self.vocab) and len(terms) < MAX_EXPANSIONS and self.vocab[i].startswith(word):
+                terms.append(self.vocab[i])
+                i += 1
+
+        if not terms and len(word) >= FUZZY_MIN_LEN:
+            terms = self.trigrams.lookup(word)
+        return terms
+
+    def word_postings(self, word: str) -> Dict[int, int]:
+        """Merged doc_id -> tf map for a query word and its expansions."""
+        merged: Dict[int, int] = {}
+        for term in self.expand(word):
+            pids, tfs = self.postings[term]
+            for doc_id, tf in zip(pids, tfs):
+                merged[doc_id] = merged.get(doc_id, 0) + tf
+        return merged
+
+    def score(self, words: List[str], limit: int, postings: Optional[Dict[str, Dict[int, int]]] = None) -> Dict[int, float]:
+        """
+        BM25 over the posting lists of the query words.
+        Documents matching ALL words (posting-list intersection) are preferred;
+        if there aren't enough of them we fall back to the union.
+        `postings` is a word -> word_postings() map already fetched by score_many().
+        """
+        if not self.num_docs:
+            return {}
+
+        lists = [postings[w] if postings is not None else self.word_postings(w) for w in words]
+        lists = [p for p in lists if p]
+        if not lists:
+            return {}
+
+        # 1. Intersect, smallest posting list first
+        lists.sort(key=len)
+        candidates = set(lists[0])
+        for p in lists[1:]:
+            candidates.intersection_update(p)
+            if not candidates:
+                break
+
+        # 2. Not enough docs contain every word -> score anything that matched
+        if len(candidates) < limit:
+            candidates = set()
+            for p in lists:
+                candidates.update(p)
+
+        scores: Dict[int, float] = {}
+        for p in lists:
+            df = len(p)
+            idf = math.log(1 + (self.num_docs - df + 0.5) / (df + 0.5))
+            for doc_id, tf in p.items():
+                if doc_id not in candidates:
+                    continue
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * self.doc_lengths[doc_id] / self.avg_doc_length)
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * (tf * (BM25_K1 + 1)) / (tf + norm)
+        return scores
+
+    def score_many(self, word_lists: List[List[str]], limit: int) -> List[Dict[int, float]]:
+        """score() for several queries, fetching each distinct word's postings only once."""
+        postings = {}
+        for words in word_lists:
+            for w in words:
+                if w not in postings:
+                    postings[w] = self.word_postings(w)
+        return [self.score(words, limit, postings) for words in word_lists]
+
+
+class KBFile(NamedTuple):
+    mtime_ns: int
+    size: int
+    digest: str
+    doc_id: int
+    passage_ids: Tuple[int, ...]
+
+
+class KBState:
+    """
+    One consistent, read-only view of the KB (documents + passages + index).
+    Reloads build a new KBState and swap it in with a single assignment,
+    so a search that grabbed the old one never sees a half-built index.
+    """
+
+    _versions = itertools.count()
+
+    def __init__(self, documents=None, passages=None, index=None, files=None):
+        self.version = next(KBState._versions)  # part of every cache key, so old results can't leak across a reload
+        self.documents: List[Optional[dict]] = documents or []                   # doc_id -> doc (None once removed)
+        self.passages: List[Optional[Tuple[int, int, int]]] = passages or []     # passage_id -> (doc_id, start, end)
+        self.index: InvertedIndex = index or InvertedIndex()
+        self.files: Dict[str, KBFile] = files or {}                             # filename -> what we loaded from it
+        self.dense = None                                                       # kb_dense.DenseIndex, when dense retrieval is on
+        self._faq: Optional[Dict[str, int]] = None
+
+    def passage_text(self, passage_id: int) -> str:
+        doc_id, start, end = self.passages[passage_id]
+        return self.documents[doc_id].get("content", "")[start:end]
+
+    def passage_ids(self) -> Iterable[int]:
+        """Ids of the live passages (skips tombstones)."""
+        for entry in self.files.values():
+            yield from entry.passage_ids
+
+    def faq_documents(self) -> Iterable[Tuple[int, dict]]:
+        """(doc_id, doc) of the live curated FAQ documents."""
+        for entry in self.files.values():
+            doc = self.documents[entry.doc_id]
+            if doc.get("type") == FAQ_TYPE:
+                yield entry.doc_id, doc
+
+    @property
+    def faq(self) -> Dict[str, int]:
+        """normalize_query() signature of every FAQ question and alias -> doc_id of its answer."""
+        if self._faq is None:
+            self._faq = self._faq_table()
+        return self._faq
+
+    def _faq_table(self) -> Dict[str, int]:
+        table: Dict[str, int] = {}
+        for doc_id, doc in self.faq_documents():
+            for question in faq_questions(doc):
+                signature = normalize_query(question)
+                if signature:
+                    table.setdefault(signature, doc_id)
+        return table
+
+    def warm_up(self, typos: bool = False) -> "KBState":
+        """
+        Builds what searches would otherwise build on first use: the FAQ table and, with
+        `typos`, the trigram index behind spelling correction. Call it before the state is swapped in.
+        """
+        if self._faq is None:
+            self._faq = self._faq_table()
+        if typos and self.index._trigrams is None:
+            self.index._trigrams = TrigramIndex(self.index.vocab)
+        return self
+
+    @property
+    def num_documents(self) -> int:
+        return len(self.files)
+
+    @property
+    def num_passages(self) -> int:
+        return self.index.num_docs
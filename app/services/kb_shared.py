@@ -0,0 +1,213 @@
+"""
+Shared-memory KB for multi-worker deployments.
+
+One loader process publishes the KB (in the kb_snapshot format) into a POSIX
+shared memory segment; every uvicorn worker started with KB_SHARED_MEMORY=<name>
+attaches to it read-only instead of parsing the KB itself. KB memory stays flat
+as workers are added and a new worker is ready as soon as it has mapped the segment.
+
+A small control segment (<name>) points at the current data segment
+(<name>_<generation>). Republishing writes a new data segment, flips the
+control segment and unlinks the old one; workers that still map it keep
+their pages until they move to the new generation on their next reload.
+
+Run the loader next to the API:
+    python -m app.services.kb_shared            # publish once
+    python -m app.services.kb_shared --watch 30 # republish when the KB changes
+    python -m app.services.kb_shared --unlink   # tear down
+"""
+import os
+import sys
+import time
+import struct
+import logging
+import argparse
+from multiprocessing import resource_tracker, shared_memory
+from typing import Optional, Tuple
+
+from app.services.kb_snapshot import KB_SNAPSHOT, SnapshotState, encode_snapshot, load_documents, snapshot_signature
+
+logger = logging.getLogger(__name__)
+
+KB_SHARED_MEMORY = os.getenv("KB_SHARED_MEMORY", "")  # segment name; empty = every worker loads its own KB
+
+CONTROL = struct.Struct("<8sQQ64s")  # magic, seq (odd while being written), generation, data segment name
+CONTROL_MAGIC = b"KBSHM001"
+
+
+class _Segment(shared_memory.SharedMemory):
+    """A SharedMemory handle that a KBState keeps open for as long as it reads from it."""
+
+    def __del__(self):
+        try:
+            self.close()
+        except BufferError:
+            pass  # a search still holds a view into it; the mapping goes with the last view
+
+
+def _untrack(shm: shared_memory.SharedMemory):
+    # The resource tracker unlinks segments when the process that opened them exits;
+    # the loader and the workers both need the segment to outlive them.
+    # (It only tracks POSIX segments, registered under their "/"-prefixed name.)
+    if os.name != "posix":
+        return
+    try:
+        resource_tracker.unregister(f"/{shm.name}", "shared_memory")
+    except Exception:
+        pass
+
+
+def _read_control(control: shared_memory.SharedMemory) -> Tuple[int, str]:
+    # Seqlock read: retry while the loader is in the middle of flipping it
+    for _ in range(1000):
+        magic, seq, generation, name = CONTROL.unpack_from(control.buf, 0)
+        if magic != CONTROL_MAGIC:
+            raise ValueError(f"{control.name} is not a KB control segment")
+        if seq % 2 == 0 and CONTROL.unpack_from(control.buf, 0)[1] == seq:
+            return generation, name.rstrip(b"\0").decode()
+        time.sleep(0.001)
+    raise TimeoutError(f"KB control segment {control.name} is stuck mid-update")
+
+
+# ==========================================
+# WORKER SIDE
+# ==========================================
+
+class SharedSnapshotState(SnapshotState):
+    def __init__(self, buf, name: str, generation: int, segment: Optional[shared_memory.SharedMemory] = None):
+        super().__init__(buf)
+        self.name = name
+        self.generation = generation
+        self.segment = segment  # set last, so the views above are released before the handle is closed
+
+    def refresh(self) -> Optional["SharedSnapshotState"]:
+        """Attaches to the newer generation if the loader republished, else None."""
+        control = shared_memory.SharedMemory(self.name)
+        _untrack(control)
+        try:
+            generation, _ = _read_control(control)
+        finally:
+            control.close()
+        return attach(self.name) if generation != self.generation else None
+
+
+def attach(name: str = KB_SHARED_MEMORY) -> SharedSnapshotState:
+    """Maps the currently published KB read-only. Raises FileNotFoundError if nothing is published."""
+    for _ in range(3):
+        control = shared_memory.SharedMemory(name)
+        _untrack(control)
+        try:
+            generation, data_name = _read_control(control)
+        finally:
+            control.close()
+
+        try:
+            shm = _Segment(data_name)
+        except FileNotFoundError:
+            continue  # republished between reading the control segment and attaching; try again
+        _untrack(shm)
+        return SharedSnapshotState(shm.buf.toreadonly(), name, generation, shm)
+    raise FileNotFoundError(f"KB shared memory {name} keeps changing under us")
+
+
+# ==========================================
+# LOADER SIDE
+# ==========================================
+
+def publish(data: bytes, name: str = KB_SHARED_MEMORY) -> int:
+    """Copies a snapshot into a fresh data segment and points the control segment at it."""
+    try:
+        control = shared_memory.SharedMemory(name)
+        generation, old_name = _read_control(control)
+    except FileNotFoundError:
+        control = shared_memory.SharedMemory(name, create=True, size=CONTROL.size)
+        generation, old_name = 0, None
+    _untrack(control)
+
+    generation += 1
+    data_name = f"{name}_{generation}"
+    _unlink(data_name)  # left over by a loader that died mid-publish; workers still mapping it keep their pages
+    shm = shared_memory.SharedMemory(data_name, create=True, size=len(data))
+    _untrack(shm)
+    shm.buf[:len(data)] = data
+    shm.close()
+
+    seq = CONTROL.unpack_from(control.buf, 0)[1] if old_name else 0
+    CONTROL.pack_into(control.buf, 0, CONTROL_MAGIC, seq + 1, generation, data_name.encode())
+    CONTROL.pack_into(control.buf, 0, CONTROL_MAGIC, seq + 2, generation, data_name.encode())
+    control.close()
+
+    if old_name:
+        _unlink(old_name)
+    logger.info(f"Published KB generation {generation} to shared memory {data_name} ({len(data)} bytes)")
+    return generation
+
+
+def unpublish(name: str = KB_SHARED_MEMORY):
+    try:
+        control = shared_memory.SharedMemory(name)
+    except FileNotFoundError:
+        return
+    _untrack(control)
+    try:
+        _, data_name = _read_control(control)
+        _unlink(data_name)
+    finally:
+        control.close()
+        _unlink(name)
+
+
+def _unlink(name: str):
+    try:
+        shm = shared_memory.SharedMemory(name)
+    except FileNotFoundError:
+        return
+    shm.close()
+    shm.unlink()  # also unregisters it from the resource tracker
+
+
+def _load_snapshot_bytes(kb_dir: str) -> bytes:
+    # A prebuilt snapshot is already in the right format; otherwise build one from the JSON pages
+    if os.path.exists(KB_SNAPSHOT):
+        with open(KB_SNAPSHOT, "rb") as f:
+            return f.read()
+    data, _ = encode_snapshot(load_documents(kb_dir))
+    return data
+
+
+def _source_signature(kb_dir: str):
+    snapshot = snapshot_signature(KB_SNAPSHOT)
+    if snapshot:
+        return snapshot
+    entries = []
+    for entry in os.scandir(kb_dir):
+        if entry.name.endswith(".json"):
+            st = entry.stat()
+            entries.append((entry.name, st.st_mtime_ns, st.st_size))
+    return hash(tuple(sorted(entries)))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Publish the KB into shared memory for the API workers.")
+    parser.add_argument("--name", default=KB_SHARED_MEMORY or "medcare_kb")
+    parser.add_argument("--kb-dir", default="app/data/kb")
+    parser.add_argument("--watch", type=float, default=0, help="republish when the KB changes, polling every N seconds")
+    parser.add_argument("--unlink", action="store_true", help="remove the published segments and exit")
+    args = parser.parse_args()
+
+    if args.unlink:
+        unpublish(args.name)
+        sys.exit(0)
+
+    signature = _source_signature(args.kb_dir)
+    publish(_load_snapshot_bytes(args.kb_dir), args.name)
+    try:
+        while args.watch > 0:
+            time.sleep(args.watch)
+            current = _source_signature(args.kb_dir)
+            if current != signature:
+                signature = current
+                publish(_load_snapshot_bytes(args.kb_dir), args.name)
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,332 @@
+"""
+Single-file KB snapshot: documents, passages and the prebuilt inverted index
+in one binary file that KnowledgeBase memory-maps instead of parsing JSON.
+
+Opening a snapshot is a constant-time mmap; pages are only read when a search
+touches them, and the OS page cache is shared by every worker on the host.
+
+Layout (little-endian, every section 8-byte aligned):
+    header    magic, counts, CRC32 of everything after the header, section offsets
+    docs      n_docs     x (title, url, type, content, aliases) as (offset, length) into strings
+    passages  n_passages x (doc_id, byte_start, byte_end) into the doc content
+    plens     n_passages x token count (BM25 length normalization)
+    terms     n_terms    x (term offset, term length, postings offset, df), sorted by term
+    strings   utf-8 blob
+    postings  per term: df passage ids, then df term frequencies (u32)
+
+Build it with `python -m app.services.kb_snapshot` (scraper.py does this after a crawl).
+"""
+import os
+import sys
+import json
+import mmap
+import struct
+import zlib
+import bisect
+import logging
+from array import array
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from app.services.kb_index import FAQ_TYPE, InvertedIndex, KBState, split_passages
+
+logger = logging.getLogger(__name__)
+
+KB_SNAPSHOT = os.getenv("KB_SNAPSHOT", "app/data/kb.snapshot")
+
+MAGIC = b"KBSNAP02"
+HEADER = struct.Struct("<8sIIIIQQQQQQQ")  # magic, n_docs, n_passages, n_terms, checksum, total_length, 6 section offsets
+DOC = struct.Struct("<QIQIQIQIQI")        # title, url, type, content, aliases -> (offset, length)
+TERM = struct.Struct("<QIQI")             # term offset, term length, postings offset (in u32), df
+DOC_FIELDS = ("title", "url", "type", "content", "aliases")  # aliases (curated FAQ phrasings) are stored newline-joined
+
+
+def _align(buf: bytearray):
+    buf.extend(b"\0" * (-len(buf) % 8))
+
+
+# ==========================================
+# WRITER
+# ==========================================
+
+def load_documents(kb_dir: str) -> List[dict]:
+    """Reads every JSON page in kb_dir (the format scraper.py writes)."""
+    documents = []
+    for filename in sorted(os.listdir(kb_dir)):
+        if filename.endswith(".json"):
+            try:
+                with open(os.path.join(kb_dir, filename), "r", encoding="utf-8") as f:
+                    documents.append(json.load(f))
+            except Exception as e:
+                logger.error(f"Error loading {filename}: {e}")
+    return documents
+
+
+def encode_snapshot(documents: List[dict]) -> Tuple[bytearray, Dict[str, int]]:
+    """Splits + indexes the documents and lays them out in the snapshot format."""
+    strings = bytearray()
+
+    def add_string(value) -> Tuple[int, int]:
+        data = str(value or "").encode("utf-8")
+        offset = len(strings)
+        strings.extend(data)
+        return offset, len(data)
+
+    # 1. Documents + passages (offsets converted from chars to utf-8 bytes)
+    docs = bytearray()
+    passages = array("I")
+    texts = []
+    for doc_id, doc in enumerate(documents):
+        fields = []
+        for field in DOC_FIELDS:
+            value = doc.get(field)
+            fields.extend(add_string("\n".join(value) if field == "aliases" and value else value))
+        docs.extend(DOC.pack(*fields))
+
+        content = doc.get("content", "")
+        char_pos, byte_pos = 0, 0
+        for start, end in split_passages(content):
+            byte_start = byte_pos + len(content[char_pos:start].encode("utf-8"))
+            byte_end = byte_start + len(content[start:end].encode("utf-8"))
+            char_pos, byte_pos = end, byte_end
+            passages.extend((doc_id, byte_start, byte_end))
+            texts.append(content[start:end])
+
+    # 2. Index
+    index = InvertedIndex(texts)
+    terms = bytearray()
+    postings = array("I")
+    for term in index.vocab:
+        pids, tfs = index.postings[term]
+        term_offset, term_length = add_string(term)
+        terms.extend(TERM.pack(term_offset, term_length, len(postings), len(pids)))
+        postings.extend(pids)
+        postings.extend(tfs)
+
+    plens = array("I", index.doc_lengths)
+    if sys.byteorder != "little":
+        passages.byteswap(); plens.byteswap(); postings.byteswap()
+
+    # 3. Lay the sections out after the header
+    body = bytearray()
+    offsets = []
+    for section in (docs, passages.tobytes(), plens.tobytes(), terms, strings, postings.tobytes()):
+        _align(body)
+        offsets.append(HEADER.size + len(body))
+        body.extend(section)
+
+    # The checksum identifies the contents (the saved dense index is keyed on it) without rehashing at load
+    data = bytearray(HEADER.pack(MAGIC, len(documents), len(texts), len(index.vocab), zlib.crc32(body), index.total_length, *offsets))
+    data.extend(body)
+    return data, {"documents": len(documents), "passages": len(texts), "terms": len(index.vocab), "bytes": len(data)}
+
+
+def write_snapshot(path: str, documents: List[dict]) -> Dict[str, int]:
+    """Writes the documents as one snapshot file (atomically replaced)."""
+    data, stats = encode_snapshot(documents)
+
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)  # readers that already mapped the old file keep their inode
+
+    logger.info(f"Wrote KB snapshot {path}: {stats}")
+    return stats
+
+
+def build_snapshot(kb_dir: str, path: str = KB_SNAPSHOT) -> Dict[str, int]:
+    return write_snapshot(path, load_documents(kb_dir))
+
+
+# ==========================================
+# READER (lazy views over the mmap)
+# ==========================================
+
+class _Strings:
+    def __init__(self, view: memoryview):
+        self.view = view
+
+    def get(self, offset: int, length: int) -> str:
+        return str(self.view[offset:offset + length], "utf-8")
+
+
+class _DocTable:
+    """doc_id -> document dict, decoded on access."""
+
+    def __init__(self, view: memoryview, count: int, strings: _Strings):
+        self.view = view
+        self.count = count
+        self.strings = strings
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, doc_id: int) -> dict:
+        if not 0 <= doc_id < self.count:
+            raise IndexError(doc_id)
+        fields = DOC.unpack_from(self.view, doc_id * DOC.size)
+        doc = {name: self.strings.get(fields[2 * i], fields[2 * i + 1]) for i, name in enumerate(DOC_FIELDS)}
+        doc["aliases"] = doc["aliases"].split("\n") if doc["aliases"] else []
+        return doc
+
+    def field(self, doc_id: int, name: str) -> str:
+        """One field without decoding the rest of the document."""
+        i = DOC_FIELDS.index(name)
+        fields = DOC.unpack_from(self.view, doc_id * DOC.size)
+        return self.strings.get(fields[2 * i], fields[2 * i + 1])
+
+    def content_bytes(self, doc_id: int) -> memoryview:
+        fields = DOC.unpack_from(self.view, doc_id * DOC.size)
+        return self.strings.view[fields[6]:fields[6] + fields[7]]
+
+
+class _PassageTable:
+    """passage_id -> (doc_id, byte_start, byte_end)."""
+
+    def __init__(self, view: memoryview):
+        self.view = view
+
+    def __len__(self):
+        return len(self.view) // 3
+
+    def __getitem__(self, pid: int) -> Tuple[int, int, int]:
+        if not 0 <= pid < len(self):
+            raise IndexError(pid)
+        return self.view[3 * pid], self.view[3 * pid + 1], self.view[3 * pid + 2]
+
+
+class _Vocab:
+    """Sorted term list; bisect works on it directly."""
+
+    def __init__(self, view: memoryview, count: int, strings: _Strings):
+        self.view = view
+        self.count = count
+        self.strings = strings
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, i: int) -> str:
+        if not 0 <= i < self.count:
+            raise IndexError(i)
+        term_offset, term_length, _, _ = TERM.unpack_from(self.view, i * TERM.size)
+        return self.strings.get(term_offset, term_length)
+
+    def find(self, term: str) -> int:
+        i = bisect.bisect_left(self, term)
+        return i if i < self.count and self[i] == term else -1
+
+
+class _Postings:
+    """term -> (passage_ids, term_frequencies) as zero-copy u32 views."""
+
+    def __init__(self, vocab: _Vocab, view: memoryview):
+        self.vocab = vocab
+        self.view = view
+
+    def __len__(self):
+        return len(self.vocab)
+
+    def __contains__(self, term: str) -> bool:
+        return self.vocab.find(term) >= 0
+
+    def __getitem__(self, term: str) -> Tuple[memoryview, memoryview]:
+        i = self.vocab.find(term)
+        if i < 0:
+            raise KeyError(term)
+        _, _, offset, df = TERM.unpack_from(self.vocab.view, i * TERM.size)
+        return self.view[offset:offset + df], self.view[offset + df:offset + 2 * df]
+
+    def get(self, term: str, default=None):
+        return self[term] if term in self else default
+
+
+class SnapshotIndex(InvertedIndex):
+    """InvertedIndex whose postings/vocab/lengths are read straight out of the mmap."""
+
+    def __init__(self, postings: _Postings, vocab: _Vocab, doc_lengths: memoryview, total_length: int):
+        super().__init__()
+        self.postings = postings
+        self.vocab = vocab
+        self.doc_lengths = doc_lengths
+        self.num_docs = len(doc_lengths)
+        self.total_length = total_length
+
+    def apply(self, removed, added):
+        raise TypeError("Snapshot indexes are read-only; rebuild the snapshot instead.")
+
+
+class SnapshotState(KBState):
+    """KBState over a snapshot buffer (a mapped file, or a shared memory segment)."""
+
+    def __init__(self, buf, path: str = None, signature=None):
+        self.buf = buf
+        self.path = path
+        self.signature = signature
+
+        if sys.byteorder != "little":
+            raise ValueError("KB snapshots are little-endian only")
+        if len(buf) < HEADER.size:
+            raise ValueError("truncated KB snapshot")
+        magic, n_docs, n_passages, n_terms, checksum, total_length, *offsets = HEADER.unpack_from(buf, 0)
+        if magic != MAGIC:
+            raise ValueError(f"not a KB snapshot (magic={magic!r})")
+        self.checksum = checksum  # 0 in snapshots written before it was recorded
+
+        offsets.append(len(buf))
+        view = memoryview(buf)
+        docs_v, passages_v, plens_v, terms_v, strings_v, postings_v = (
+            view[offsets[i]:offsets[i + 1]] for i in range(6)
+        )
+        strings = _Strings(strings_v)
+        vocab = _Vocab(terms_v, n_terms, strings)
+
+        passages = _PassageTable(passages_v[:12 * n_passages].cast("I"))
+        plens = plens_v[:4 * n_passages].cast("I")
+        postings = _Postings(vocab, postings_v[:len(postings_v) // 4 * 4].cast("I"))
+
+        super().__init__(_DocTable(docs_v, n_docs, strings), passages, SnapshotIndex(postings, vocab, plens, total_length))
+
+    def passage_text(self, passage_id: int) -> str:
+        doc_id, start, end = self.passages[passage_id]
+        return str(self.documents.content_bytes(doc_id)[start:end], "utf-8")
+
+    def passage_ids(self) -> Iterable[int]:
+        return range(len(self.passages))
+
+    def faq_documents(self) -> Iterable[Tuple[int, dict]]:
+        for doc_id in range(len(self.documents)):
+            if self.documents.field(doc_id, "type") == FAQ_TYPE:
+                yield doc_id, self.documents[doc_id]
+
+    @property
+    def num_documents(self) -> int:
+        return len(self.documents)
+
+    def refresh(self) -> Optional["SnapshotState"]:
+        """A newer state if the snapshot on disk was rebuilt, else None."""
+        signature = snapshot_signature(self.path)
+        if signature is None or signature == self.signature:
+            return None
+        return open_snapshot(self.path)
+
+
+def open_snapshot(path: str = KB_SNAPSHOT) -> SnapshotState:
+    with open(path, "rb") as f:
+        st = os.fstat(f.fileno())
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    return SnapshotState(mm, path, (st.st_ino, st.st_mtime_ns, st.st_size))
+
+
+def snapshot_signature(path: str = KB_SNAPSHOT):
+    """(inode, mtime, size) of the snapshot on disk, or None if it doesn't exist."""
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    kb_dir = sys.argv[1] if len(sys.argv) > 1 else "app/data/kb"
+    build_snapshot(kb_dir, sys.argv[2] if len(sys.argv) > 2 else KB_SNAPSHOT)
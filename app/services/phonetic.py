@@ -0,0 +1,185 @@
+"""
+Phonetic keys for spoken doctor names.
+
+Speech-to-text spells names the way they sound ("Shurma" for Sharma, "Mohamad"
+for Muhammad, "Fatma" for Fathima), which edit-distance ratios punish. Names are
+reduced to Double Metaphone-style keys instead: vowels after the first letter
+drop out, consonants that sound alike share a code (PH/F/V, C/K/Q/CK, S/Z, SH/CH),
+and silent letters (GH, initial KN/WR, an H that isn't voiced) vanish. Ambiguous
+spellings get a second, alternate key (TH -> "0" or T, CH -> X or K, J -> J or H,
+initial W -> F or A), as Double Metaphone does.
+
+The PhoneticIndex maps every key of every name token, and of every pair of
+adjacent tokens written together ("Abdul Rahman" / "Abdulrahman"), to the names
+that have it. A query is looked up key by key (a dict hit each), so finding
+candidates doesn't depend on how many names there are, and token order doesn't
+matter ("Khan Ahmed" finds Ahmed Khan).
+
+This is not a complete Double Metaphone: the rules cover English spellings of
+the Arabic, South Asian and Western names a UAE hospital sees, not Germanic,
+Slavic or Romance special cases.
+"""
+import re
+import unicodedata
+from typing import Dict, Hashable, Iterable, List, Set, Tuple
+
+MAX_KEY_LENGTH = 6   # Double Metaphone stops at 4; names need a little more to stay apart
+MIN_TOKEN_LENGTH = 2
+
+VOWELS = set("aeiouy")
+LETTERS_RE = re.compile(r"[a-z]+")
+SILENT_STARTS = ("kn", "gn", "pn", "wr", "ps")
+SAME_SOUND = {"b": "P", "p": "P", "f": "F", "v": "F", "k": "K", "q": "K", "l": "L", "m": "M", "n": "N", "r": "R", "z": "S"}
+
+
+def _ascii(word: str) -> str:
+    return unicodedata.normalize("NFKD", word).encode("ascii", "ignore").decode().lower()
+
+
+def double_metaphone(word: str) -> Tuple[str, str]:
+    """(primary, alternate) phonetic keys of one word; alternate == primary when the spelling is unambiguous."""
+    word = "".join(LETTERS_RE.findall(_ascii(word)))
+    if not word:
+        return "", ""
+    if word.startswith(SILENT_STARTS):
+        word = word[1:]
+
+    primary, alternate = [], []
+
+    def add(main: str, alt: str = None):
+        primary.append(main)
+        alternate.append(main if alt is None else alt)
+
+    i, n = 0, len(word)
+    at = lambda k: word[k] if 0 <= k < n else ""
+    while i < n:
+        c, nxt = word[i], at(i + 1)
+        if c in VOWELS:
+            if i == 0:
+                add("A")  # initial vowels all sound alike to a transcriber
+            i += 1
+            continue
+
+        if c == nxt and c != "c":  # doubled letters sound once
+            i += 1
+            continue
+
+        if c == "c":
+            if nxt == "h":
+                add("X", "K"); i += 2; continue          # Chaudhry / Khaudri
+            if nxt in ("i", "e", "y"):
+                add("S"); i += 1; continue
+            add("K"); i += 2 if nxt in ("k", "q", "c") else 1; continue
+        if c == "d":
+            if nxt == "g" and at(i + 2) in ("e", "i", "y"):
+                add("J"); i += 2; continue
+            add("T"); i += 2 if nxt in ("t", "h") else 1; continue  # Dh as in Dhawan, Madhavi
+        if c == "g":
+            if nxt == "h":
+                # Ghada / Ghosh keep the G, an inner GH is silent (Singh is the common exception)
+                if i == 0 or at(i + 2) == "":
+                    add("K")
+                i += 2; continue
+            if nxt in ("e", "i", "y"):
+                add("J", "K"); i += 1; continue
+            add("K"); i += 1; continue
+        if c == "h":
+            # Voiced only at the start or between vowels (Mohammed), silent after a consonant (Khan)
+            if (i == 0 or at(i - 1) in VOWELS) and nxt in VOWELS:
+                add("H")
+            i += 1; continue
+        if c == "j":
+            add("J", "H"); i += 1; continue                # Jose / Hose, Jabbar
+        if c == "k":
+            add("K"); i += 2 if nxt in ("h", "k") else 1; continue  # Kh as in Khalid
+        if c == "p":
+            if nxt == "h":
+                add("F"); i += 2; continue
+            add("P"); i += 1; continue
+        if c == "s":
+            if nxt == "h":
+                add("X"); i += 2; continue
+            if nxt == "c" and at(i + 2) == "h":
+                add("SK", "X"); i += 3; continue
+            add("S"); i += 1; continue
+        if c == "t":
+            if nxt == "h":
+                add("0", "T"); i += 2; continue            # Thomas / Fathima
+            if nxt == "i" and at(i + 2) in ("a", "o"):
+                add("X"); i += 1; continue
+            add("T"); i += 1; continue
+        if c == "w":
+            if i == 0 and nxt in VOWELS:
+                add("A", "F"); i += 1; continue            # Waleed / Valeed
+            if i > 0 and at(i - 1) in VOWELS and nxt not in VOWELS:
+                i += 1; continue                            # silent, as in Shaw
+            add("F"); i += 1; continue
+        if c == "x":
+            add("KS"); i += 1; continue
+        add(SAME_SOUND.get(c, c.upper()))
+        i += 1
+
+    def squash(codes: List[str]) -> str:
+        key = []
+        for code in "".join(codes):
+            if not key or key[-1] != code:
+                key.append(code)
+        return "".join(key)[:MAX_KEY_LENGTH]
+
+    return squash(primary), squash(alternate)
+
+
+def phonetic_keys(word: str) -> Set[str]:
+    return {key for key in double_metaphone(word) if key}
+
+
+def name_words(name: str) -> List[str]:
+    return [w for w in LETTERS_RE.findall(_ascii(name)) if len(w) >= MIN_TOKEN_LENGTH]
+
+
+class PhoneticIndex:
+    """
+    Phonetic key -> items whose name has a token (or two adjacent tokens written together) with that key.
+    Built once per directory load; read-only afterwards, so it needs no locking.
+    """
+
+    def __init__(self, stop_words: Iterable[str] = ()):
+        self.stop_words = set(stop_words)
+        self.keys: Dict[str, Set[Hashable]] = {}
+
+    def _word_groups(self, name: str) -> List[Set[str]]:
+        """Per token (and per adjacent pair joined), the phonetic keys it can be heard as."""
+        words = [w for w in name_words(name) if w not in self.stop_words]
+        groups = [phonetic_keys(w) for w in words]
+        groups += [phonetic_keys(a + b) for a, b in zip(words, words[1:])]
+        return [g for g in groups if g]
+
+    def add(self, item: Hashable, name: str):
+        for keys in self._word_groups(name):
+            for key in keys:
+                self.keys.setdefault(key, set()).add(item)
+
+    def candidates(self, name: str) -> List[Tuple[Hashable, float]]:
+        """
+        Items sharing phonetic keys with `name`, as (item, share of the query's words matched), best first.
+        Order of the words doesn't matter; "abdul rahman" also matches "Abdulrahman" and vice versa.
+        """
+        words = [w for w in name_words(name) if w not in self.stop_words]
+        if not words:
+            return []
+        singles = [phonetic_keys(w) for w in words]
+        pairs = [phonetic_keys(a + b) for a, b in zip(words, words[1:])]
+
+        matched: Dict[Hashable, Set[int]] = {}
+        for position, keys in enumerate(singles):
+            for key in keys:
+                for item in self.keys.get(key, ()):
+                    matched.setdefault(item, set()).add(position)
+        for position, keys in enumerate(pairs):  # a joined pair covers both of its words
+            for key in keys:
+                for item in self.keys.get(key, ()):
+                    matched.setdefault(item, set()).update((position, position + 1))
+
+        ranked = [(item, len(positions) / len(words)) for item, positions in matched.items()]
+        ranked.sort(key=lambda x: x[1], reverse=True)
+        return ranked
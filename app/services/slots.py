@@ -0,0 +1,72 @@
+"""
+Appointment slot grid as bitmaps.
+
+A clinic day is SLOTS_PER_DAY half-hour slots from 09:00 to 17:00; slot i of a
+day is bit i of an int. A doctor's bookings for a day become one bitmap, the
+slots still open today (Sundays closed, past times gone) another, and free
+slots are `open & ~booked`. Searching a week for the next free slot is then a
+handful of integer operations per day instead of building and diffing
+"HH:MM" string lists.
+"""
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterable, Iterator, List, Optional
+
+DAY_START_MINUTES = 9 * 60   # 09:00
+DAY_END_MINUTES = 17 * 60    # 17:00 (last slot starts 16:30)
+SLOT_MINUTES = 30
+SLOTS_PER_DAY = (DAY_END_MINUTES - DAY_START_MINUTES) // SLOT_MINUTES
+FULL_DAY = (1 << SLOTS_PER_DAY) - 1
+CLOSED_WEEKDAYS = {6}        # Sunday
+ACTIVE_STATUSES = ["SCHEDULED", "RESCHEDULED"]  # Appointment statuses that hold a slot
+
+SLOT_LABELS = [
+    f"{(DAY_START_MINUTES + i * SLOT_MINUTES) // 60:02d}:{(DAY_START_MINUTES + i * SLOT_MINUTES) % 60:02d}"
+    for i in range(SLOTS_PER_DAY)
+]
+
+
+def slot_index(moment: datetime) -> Optional[int]:
+    """Slot number of an appointment time, or None if it isn't on the grid."""
+    minutes = moment.hour * 60 + moment.minute - DAY_START_MINUTES
+    if minutes < 0 or minutes % SLOT_MINUTES or moment.second:
+        return None
+    index = minutes // SLOT_MINUTES
+    return index if index < SLOTS_PER_DAY else None
+
+
+def slot_datetime(day: date, index: int) -> datetime:
+    return datetime(day.year, day.month, day.day) + timedelta(minutes=DAY_START_MINUTES + index * SLOT_MINUTES)
+
+
+def booked_bitmaps(moments: Iterable[datetime]) -> Dict[date, int]:
+    """day -> bitmap of its booked slots."""
+    bitmaps: Dict[date, int] = {}
+    for moment in moments:
+        index = slot_index(moment)
+        if index is not None:
+            day = moment.date()
+            bitmaps[day] = bitmaps.get(day, 0) | (1 << index)
+    return bitmaps
+
+
+def open_mask(day: date, now: datetime) -> int:
+    """Slots of `day` that can still be booked at `now`: none on closed days or past days, only later slots today."""
+    if day.weekday() in CLOSED_WEEKDAYS or day < now.date():
+        return 0
+    if day > now.date():
+        return FULL_DAY
+    minutes = now.hour * 60 + now.minute - DAY_START_MINUTES
+    passed = min(SLOTS_PER_DAY, max(0, -(-(minutes + 1) // SLOT_MINUTES)))  # slots starting at or before now are gone
+    return FULL_DAY & ~((1 << passed) - 1)
+
+
+def iter_slots(bitmap: int) -> Iterator[int]:
+    """Indices of the set bits, earliest slot first."""
+    while bitmap:
+        low = bitmap & -bitmap
+        yield low.bit_length() - 1
+        bitmap ^= low
+
+
+def slot_labels(bitmap: int) -> List[str]:
+    return [SLOT_LABELS[i] for i in iter_slots(bitmap)]
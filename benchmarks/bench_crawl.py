@@ -0,0 +1,222 @@
+"""
+Crawler throughput benchmark: pages/s, bytes/s, CPU per page and peak memory of scraper.py.
+
+Serves the generated site from benchmarks/crawl_fixture.py on localhost (one
+fixture per --pages size) and runs scrape_medcare() against it twice: a cold
+crawl from empty state, then a warm re-crawl where every page answers 304. The
+site has robots.txt, plain and gzip sitemaps, slow pages, redirects, PDFs/images,
+404s and near-duplicate listings, so every code path of the crawler is exercised.
+
+Everything runs offline. Each crawl runs in a fresh subprocess with its own KB
+directory, crawl state and frontier, so memory high-water marks and CPU time
+belong to that crawl alone (CPU includes the extraction processes). Politeness
+is turned off (--rate) because the fixture is local; the slow pages still cost
+their --slow-ms. Results are written as JSON; pass --baseline with an earlier
+results file to fail (exit 1) on regressions.
+
+    python -m benchmarks.bench_crawl
+    python -m benchmarks.bench_crawl --pages 2000 --concurrency 16 --output before.json
+    python -m benchmarks.bench_crawl --pages 2000 --concurrency 16 --baseline before.json
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import argparse
+import platform
+import resource
+import tempfile
+import subprocess
+from typing import List, Optional
+
+from benchmarks.bench_retrieval import _rss_mb
+from benchmarks.crawl_fixture import DEFAULT_SLOW_MS, start_fixture
+
+logger = logging.getLogger(__name__)
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+DEFAULT_PAGES = "200,1000"
+DEFAULT_RATE = 10000.0     # Requests per second per host; effectively unlimited against localhost
+PHASES = ("cold", "warm")
+
+
+def _cpu_seconds(who: int) -> float:
+    usage = resource.getrusage(who)
+    return usage.ru_utime + usage.ru_stime
+
+
+def measure(workdir: str) -> dict:
+    """Runs one crawl in this (child) process; the fixture URL and limits come from the CRAWL_* environment."""
+    import scraper
+
+    state_path = os.path.join(workdir, "crawl_state.json")
+    rss_before = _rss_mb()
+    cpu_before = _cpu_seconds(resource.RUSAGE_SELF)  # interpreter start-up and imports aren't the crawl's
+    started = time.perf_counter()
+    changes = scraper.scrape_medcare(state_path, os.path.join(workdir, "crawl_frontier.db"))
+    seconds = time.perf_counter() - started
+
+    with open(state_path, encoding="utf-8") as f:
+        entries = json.load(f)
+    # RUSAGE_CHILDREN covers the extraction processes (the pool has been shut down and reaped by now)
+    children_rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return {
+        "seconds": round(seconds, 3),
+        "cpu_s": {
+            "crawler": round(_cpu_seconds(resource.RUSAGE_SELF) - cpu_before, 3),
+            "extractors": round(_cpu_seconds(resource.RUSAGE_CHILDREN), 3),
+        },
+        "memory_mb": {
+            "rss_before": round(rss_before, 1),
+            "rss_high_water": round(_rss_mb(), 1),
+            "extractor_high_water": round(children_rss / (1024 * 1024) if sys.platform == "darwin" else children_rss / 1024, 1),
+        },
+        "kb_files": len([name for name in os.listdir(os.environ["KB_DIR"]) if name.endswith(".json")]),
+        "duplicates": sum(1 for entry in entries.values() if entry.get("duplicate_of")),
+        "changes": {kind: len(files) for kind, files in changes.items()},
+    }
+
+
+def run_child(workdir: str, base_url: str, pages: int, args) -> dict:
+    """Crawls the fixture in a fresh interpreter so CPU and memory numbers belong to this crawl alone."""
+    env = dict(os.environ)
+    env.update({
+        "CRAWL_START_URL": base_url + "/en",
+        "CRAWL_MAX_PAGES": str(pages * 2),  # the whole site: content pages plus listings
+        "CRAWL_RATE_PER_HOST": str(args.rate),
+        "CRAWL_BURST": str(max(1, args.concurrency)),
+        "CRAWL_CONCURRENCY": str(args.concurrency),
+        # every crawl output goes to the workdir; none may fall back to the checkout's app/data
+        "KB_DIR": os.path.join(workdir, "kb"),
+        "CRAWL_CHANGES": os.path.join(workdir, "kb.changes.json"),
+        "CRAWL_STATE": os.path.join(workdir, "crawl_state.json"),
+        "CRAWL_FRONTIER": os.path.join(workdir, "crawl_frontier.db"),
+        "KB_SNAPSHOT": os.path.join(workdir, "kb.snapshot"),
+        "PYTHONPATH": REPO_ROOT + os.pathsep + env.get("PYTHONPATH", ""),
+    })
+    if args.extract_workers is not None:
+        env["CRAWL_EXTRACT_WORKERS"] = str(args.extract_workers)
+    os.makedirs(env["KB_DIR"], exist_ok=True)
+    proc = subprocess.run(
+        [sys.executable, "-m", "benchmarks.bench_crawl", "--child", workdir],
+        cwd=REPO_ROOT, env=env, capture_output=True, text=True,
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(f"benchmark child failed for {pages} pages:\n{proc.stderr[-2000:]}")
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def summarize(result: dict, served: dict) -> dict:
+    """Adds the throughput figures (from what the fixture served) to a child's measurements."""
+    seconds = max(result["seconds"], 1e-9)
+    pages = served["html_pages"] + served["revalidated"]  # a 304 is a page crawled too, just a cheap one
+    cpu = result["cpu_s"]["crawler"] + result["cpu_s"]["extractors"]
+    result.update({
+        "served": served,
+        "pages_per_s": round(pages / seconds, 1),
+        "requests_per_s": round(served["requests"] / seconds, 1),
+        "mb_per_s": round(served["bytes"] / seconds / (1024 * 1024), 2),
+        "cpu_ms_per_page": round(cpu * 1000 / max(pages, 1), 2),
+    })
+    return result
+
+
+# ==========================================
+# REGRESSION CHECK
+# ==========================================
+
+def compare(results: dict, baseline: dict, tolerance: float) -> List[str]:
+    """Human-readable regressions of `results` against `baseline` (throughput down or CPU/memory up by more than tolerance)."""
+    old_runs = {run["name"]: run for run in baseline.get("runs", [])}
+    regressions = []
+    for run in results["runs"]:
+        old = old_runs.get(run["name"])
+        if old is None:
+            continue
+        before, after = old["pages_per_s"], run["pages_per_s"]
+        if after < before / (1 + tolerance):
+            regressions.append(f"{run['name']}: {before} -> {after} pages/s")
+        before, after = old["cpu_ms_per_page"], run["cpu_ms_per_page"]
+        if after > before * (1 + tolerance) and after - before > 0.5:  # ignore sub-0.5ms noise
+            regressions.append(f"{run['name']}: CPU {before} -> {after} ms/page")
+        before, after = old["memory_mb"]["rss_high_water"], run["memory_mb"]["rss_high_water"]
+        if after > before * (1 + tolerance):
+            regressions.append(f"{run['name']}: peak RSS {before} -> {after} MB")
+    return regressions
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark scraper.py against a local fixture site.")
+    parser.add_argument("--pages", default=DEFAULT_PAGES, help="comma-separated fixture site sizes (content pages)")
+    parser.add_argument("--concurrency", type=int, default=8, help="CRAWL_CONCURRENCY for the crawls")
+    parser.add_argument("--extract-workers", type=int, help="CRAWL_EXTRACT_WORKERS (default: the crawler's own default)")
+    parser.add_argument("--rate", type=float, default=DEFAULT_RATE, help="CRAWL_RATE_PER_HOST (requests/s)")
+    parser.add_argument("--slow-ms", type=int, default=DEFAULT_SLOW_MS, help="response delay of the fixture's slow pages")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="-", help="results JSON path ('-' = stdout)")
+    parser.add_argument("--baseline", help="earlier results JSON; exit 1 if this run regressed against it")
+    parser.add_argument("--tolerance", type=float, default=0.5, help="allowed relative slowdown before it counts as a regression (timings are noisy)")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        logging.disable(logging.INFO)  # the crawler logs every page
+        print(json.dumps(measure(args.child)))
+        return 0
+
+    logging.basicConfig(level=logging.INFO, stream=sys.stderr, format="%(message)s")
+    runs = []
+    for pages in (int(p) for p in args.pages.split(",") if p.strip()):
+        server, stats = start_fixture(pages, args.seed, args.slow_ms)
+        base_url = "http://%s:%s" % server.server_address[:2]
+        workdir = tempfile.mkdtemp(prefix=f"bench-crawl-{pages}-")
+        try:
+            for phase in PHASES:  # warm re-uses the cold crawl's state and KB files
+                stats.reset()
+                result = run_child(workdir, base_url, pages, args)
+                result = summarize(result, stats.snapshot())
+                result.update(name=f"fixture-{pages}-{phase}", pages=pages, phase=phase)
+                runs.append(result)
+                logger.info(
+                    f"{result['name']:<22} {result['seconds']:7.2f}s  {result['pages_per_s']:8.1f} pages/s  "
+                    f"{result['mb_per_s']:6.2f} MB/s  cpu {result['cpu_ms_per_page']:6.2f}ms/page  "
+                    f"rss {result['memory_mb']['rss_high_water']:6.1f}MB  "
+                    f"kb files {result['kb_files']} (+{result['duplicates']} duplicates)"
+                )
+        finally:
+            server.shutdown()
+            server.server_close()
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    results = {
+        "benchmark": "crawl",
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "concurrency": args.concurrency,
+        "extract_workers": args.extract_workers,
+        "seed": args.seed,
+        "runs": runs,
+    }
+    if args.output == "-":
+        print(json.dumps(results, indent=2))
+    else:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        logger.info(f"Wrote {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for line in regressions:
+            logger.error(f"REGRESSION {line}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,388 @@
+"""
+Retrieval benchmark for KnowledgeBase: load time, search latency, memory and relevance.
+
+Generates synthetic hospital-like KBs (100 / 10k / 100k documents by default, cached
+under --workdir), loads each one from the JSON directory and from a snapshot, and times
+load_data() and search() at p50/p99. Relevance (MRR@10, recall@1/3/5) is scored on the
+synthetic corpora (every document has a known target query) and on the real KB with
+the hand-labeled queries in benchmarks/labeled_queries.json.
+
+Everything runs offline. Each corpus is measured in a fresh subprocess so the memory
+high-water marks belong to that corpus alone. Results are written as JSON; pass
+--baseline with an earlier results file to fail (exit 1) on regressions.
+
+    python -m benchmarks.bench_retrieval
+    python -m benchmarks.bench_retrieval --sizes 100,10000 --output before.json
+    python -m benchmarks.bench_retrieval --sizes 100,10000 --baseline before.json
+"""
+import os
+import sys
+import json
+import time
+import random
+import itertools
+import logging
+import argparse
+import platform
+import resource
+import subprocess
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LABELED_QUERIES = os.path.join(REPO_ROOT, "benchmarks", "labeled_queries.json")
+REAL_KB_DIR = os.path.join(REPO_ROOT, "app", "data", "kb")
+
+DEFAULT_SIZES = "100,10000,100000"
+DEFAULT_WORKDIR = os.path.join(REPO_ROOT, "benchmarks", ".corpora")
+SEARCH_QUERIES = 500       # Timed searches per corpus (after WARMUP_QUERIES untimed ones)
+WARMUP_QUERIES = 20
+RELEVANCE_QUERIES = 200    # Synthetic target queries scored per corpus
+LOAD_TIME_BUDGET = 10.0    # Seconds spent repeating load_data() (at least once, at most 5 times)
+RECALL_AT = (1, 3, 5)
+RELEVANCE_TOLERANCE = 0.02  # Absolute MRR/recall drop that counts as a regression
+MRR_AT = 10
+
+# --- SYNTHETIC CORPUS VOCABULARY ---
+SPECIALTIES = [
+    "cardiology", "dermatology", "orthopaedics", "paediatrics", "neurology", "urology",
+    "gastroenterology", "ophthalmology", "dentistry", "gynaecology", "oncology", "radiology",
+    "physiotherapy", "endocrinology", "nephrology", "psychiatry", "pulmonology", "rheumatology",
+]
+AREAS = [
+    "Al Safa", "Jumeirah", "Marina", "Mirdif", "Al Barsha", "Motor City", "Sharjah", "Al Qusais",
+    "Damac Hills", "Arabian Ranches", "Discovery Gardens", "Palm Jumeirah", "Al Furjan", "JBR",
+    "Town Square", "Tilal Al Ghaf", "Al Khawaneej", "The Valley", "Al Zahia", "Meadows",
+]
+SYLLABLES = ["ka", "lo", "ri", "ven", "tar", "mi", "so", "pel", "dra", "nu", "gor", "es", "ti", "bal", "qu", "zen"]
+SENTENCES = [
+    "Our {specialty} team at the {area} branch offers {procedure} for adults and children.",
+    "Patients can book {procedure} with a consultant in {specialty} by calling the front desk.",
+    "The {area} centre is open from 8:00 AM to 10:00 PM and has free parking for visitors.",
+    "{procedure} usually takes {minutes} minutes and most patients go home the same day.",
+    "Most insurance plans cover {procedure}; please bring your card and Emirates ID.",
+    "Symptoms that may need {specialty} care include {word}, {word2} and persistent {word3}.",
+    "Our doctors explain every step of {procedure} and answer questions about recovery.",
+]
+
+
+def _make_words(rng: random.Random, count: int) -> List[str]:
+    words = set()
+    while len(words) < count:
+        words.add("".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))))
+    return sorted(words)
+
+
+def _procedure_name(doc_id: int) -> str:
+    # A unique made-up procedure per document (bijective base-16 over SYLLABLES) so every document has a known target query
+    parts, n = [], doc_id + 16 * 16
+    while n:
+        n, r = divmod(n, len(SYLLABLES))
+        parts.append(SYLLABLES[r])
+    return "".join(parts) + "ectomy"
+
+
+def generate_corpus(kb_dir: str, size: int, seed: int = 0) -> List[dict]:
+    """Writes `size` synthetic documents in the scraper.py format; returns the target query for each one."""
+    os.makedirs(kb_dir, exist_ok=True)
+    rng = random.Random(seed)
+    filler = _make_words(rng, 5000)
+    cum_weights = list(itertools.accumulate(1.0 / (rank + 1) for rank in range(len(filler))))  # Zipf-like word frequencies
+    targets = []
+
+    for doc_id in range(size):
+        specialty, area, procedure = rng.choice(SPECIALTIES), rng.choice(AREAS), _procedure_name(doc_id)
+        sentences = []
+        for _ in range(rng.randint(4, 9)):
+            w1, w2, w3 = rng.choices(filler, cum_weights=cum_weights, k=3)
+            sentences.append(rng.choice(SENTENCES).format(
+                specialty=specialty, area=area, procedure=procedure,
+                minutes=rng.choice((20, 30, 45, 60, 90)), word=w1, word2=w2, word3=w3,
+            ))
+            sentences.append(" ".join(rng.choices(filler, cum_weights=cum_weights, k=rng.randint(8, 20))).capitalize() + ".")
+        url = f"https://bench.invalid/{doc_id}"
+        doc = {
+            "title": f"{procedure.capitalize()} | {specialty.capitalize()} at Medcare {area}",
+            "url": url,
+            "content": " ".join(sentences),
+            "type": "web_page",
+        }
+        with open(os.path.join(kb_dir, f"doc_{doc_id}.json"), "w", encoding="utf-8") as f:
+            json.dump(doc, f)
+        targets.append({"query": rng.choice((
+            f"{procedure} at {area}",
+            f"how long does {procedure} take",
+            f"does insurance cover {procedure}",
+            f"{specialty} {procedure}",
+        )), "relevant": [url]})
+    return targets
+
+
+def ensure_corpus(workdir: str, size: int, seed: int) -> Dict[str, str]:
+    """Paths of the cached corpus for this size/seed, generating it (and its snapshot) if needed."""
+    from app.services.kb_snapshot import build_snapshot
+
+    name = f"kb_{size}_seed{seed}"
+    paths = {
+        "kb_dir": os.path.join(workdir, name),
+        "targets": os.path.join(workdir, f"{name}.targets.json"),
+        "snapshot": os.path.join(workdir, f"{name}.snapshot"),
+    }
+    if not os.path.exists(paths["targets"]):
+        started = time.perf_counter()
+        targets = generate_corpus(paths["kb_dir"], size, seed)
+        random.Random(seed).shuffle(targets)
+        with open(paths["targets"], "w", encoding="utf-8") as f:
+            json.dump(targets, f)
+        logger.info(f"Generated {size} synthetic documents in {time.perf_counter() - started:.1f}s")
+    if not os.path.exists(paths["snapshot"]):
+        started = time.perf_counter()
+        build_snapshot(paths["kb_dir"], paths["snapshot"])
+        logger.info(f"Built snapshot for {size} documents in {time.perf_counter() - started:.1f}s")
+    return paths
+
+
+# ==========================================
+# MEASUREMENT (runs inside the child process)
+# ==========================================
+
+def percentile(samples: List[float], pct: float) -> float:
+    ordered = sorted(samples)
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def _rss_mb() -> float:
+    """Peak resident set size of this process so far."""
+    # Linux keeps ru_maxrss across fork+exec (it would report the parent's peak), VmHWM belongs to this process alone
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    # ru_maxrss is KiB on Linux and bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+
+def ranked_documents(kb, query: str, k: int) -> List[dict]:
+    """The top k distinct documents search() would show for the query, best first."""
+    from app.services.kb_index import normalize_query
+
+    state = kb.state
+    docs, seen = [], set()
+    faq_doc_id = state.faq.get(normalize_query(query))
+    if faq_doc_id is not None:
+        docs.append(state.documents[faq_doc_id])
+        seen.add(faq_doc_id)
+    for pid, _ in kb.rank(query, k * 4):  # several passages can come from one document
+        doc_id = state.passages[pid][0]
+        if doc_id not in seen:
+            seen.add(doc_id)
+            docs.append(state.documents[doc_id])
+    return docs[:k]
+
+
+def relevance(kb, labeled: List[dict]) -> Dict[str, float]:
+    reciprocal_ranks = []
+    recalls = {k: [] for k in RECALL_AT}
+    for item in labeled:
+        relevant = set(item["relevant"])
+        hits = [doc.get("url") in relevant or doc.get("title") in relevant
+                for doc in ranked_documents(kb, item["query"], max(MRR_AT, *RECALL_AT))]
+        first = next((rank for rank, hit in enumerate(hits[:MRR_AT], 1) if hit), None)
+        reciprocal_ranks.append(1.0 / first if first else 0.0)
+        for k in RECALL_AT:
+            recalls[k].append(sum(hits[:k]) / len(relevant))
+
+    result = {f"mrr@{MRR_AT}": round(sum(reciprocal_ranks) / len(labeled), 4), "queries": len(labeled)}
+    for k in RECALL_AT:
+        result[f"recall@{k}"] = round(sum(recalls[k]) / len(labeled), 4)
+    return result
+
+
+def measure(kb_dir: str, snapshot: Optional[str], labeled: List[dict], seed: int) -> dict:
+    """Loads one KB the way the API would and measures it. Expects the env set up by run_child()."""
+    from app.services import rag_service
+    from app.services.kb_index import query_words
+
+    rag_service.KB_DIR = kb_dir
+    rag_service.KB_SNAPSHOT = snapshot or os.path.join(kb_dir, "no-snapshot")
+    rss_before = _rss_mb()
+
+    # 1. Load (repeated while it is cheap, to get a stable number)
+    load_times = []
+    while not load_times or (len(load_times) < 5 and sum(load_times) < LOAD_TIME_BUDGET):
+        kb = None  # drop the previous KB before building the next one
+        started = time.perf_counter()
+        kb = rag_service.KnowledgeBase()
+        load_times.append(time.perf_counter() - started)
+    rss_loaded = _rss_mb()
+
+    # 2. Search latency (the query cache is disabled by the parent, so every call does the full search)
+    rng = random.Random(seed)
+    vocab = kb.state.index.vocab
+    vocab = [w for w in (vocab[rng.randrange(len(vocab))] for _ in range(2000)) if query_words(w)] or ["hospital"]
+    queries = [item["query"] for item in rng.sample(labeled, min(len(labeled), SEARCH_QUERIES // 2))]
+    while len(queries) < SEARCH_QUERIES:
+        queries.append(" ".join(rng.sample(vocab, rng.randint(1, 3))))
+
+    for query in queries[:WARMUP_QUERIES]:
+        kb.search(query)
+    latencies = []
+    for query in queries:
+        started = time.perf_counter()
+        kb.search(query)
+        latencies.append((time.perf_counter() - started) * 1000)
+
+    return {
+        "documents": kb.state.num_documents,
+        "passages": kb.state.num_passages,
+        "terms": len(kb.state.index.vocab),
+        "load_s": {"p50": round(percentile(load_times, 50), 4), "min": round(min(load_times), 4), "runs": len(load_times)},
+        "search_ms": {
+            "p50": round(percentile(latencies, 50), 3),
+            "p99": round(percentile(latencies, 99), 3),
+            "mean": round(sum(latencies) / len(latencies), 3),
+            "queries": len(latencies),
+        },
+        "memory_mb": {
+            "rss_before_load": round(rss_before, 1),
+            "rss_high_water": round(_rss_mb(), 1),
+            "load_delta": round(rss_loaded - rss_before, 1),
+        },
+        "relevance": relevance(kb, labeled),
+    }
+
+
+def run_child(job: dict, retrieval_mode: str) -> dict:
+    """Measures one job in a fresh interpreter so memory high-water marks don't leak between corpora."""
+    env = dict(os.environ)
+    env.update({
+        "KB_RELOAD_INTERVAL": "0",
+        "KB_CACHE_SIZE": "0",
+        "KB_SHARED_MEMORY": "",
+        "KB_RETRIEVAL_MODE": retrieval_mode,
+        # The module-level kb_engine loads at import; point it at nothing so it costs nothing
+        "KB_DIR": os.path.join(job["kb_dir"], "no-such-dir"),
+        "KB_SNAPSHOT": os.path.join(job["kb_dir"], "no-such-snapshot"),
+        "PYTHONPATH": REPO_ROOT + os.pathsep + env.get("PYTHONPATH", ""),
+    })
+    proc = subprocess.run(
+        [sys.executable, "-m", "benchmarks.bench_retrieval", "--child", json.dumps(job)],
+        cwd=REPO_ROOT, env=env, capture_output=True, text=True,
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(f"benchmark child failed for {job['name']}:\n{proc.stderr[-2000:]}")
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+# ==========================================
+# REGRESSION CHECK
+# ==========================================
+
+def compare(results: dict, baseline: dict, tolerance: float) -> List[str]:
+    """Human-readable regressions of `results` against `baseline` (latency up or relevance down by more than tolerance)."""
+    old_runs = {(r["name"], r["retrieval_mode"]): r for r in baseline.get("runs", [])}
+    regressions = []
+    for run in results["runs"]:
+        old = old_runs.get((run["name"], run["retrieval_mode"]))
+        if old is None:
+            continue
+        label = f"{run['name']} ({run['retrieval_mode']})"
+        for metric in ("p50", "p99"):
+            before, after = old["search_ms"][metric], run["search_ms"][metric]
+            if after > before * (1 + tolerance) and after - before > 0.1:  # ignore sub-0.1ms noise
+                regressions.append(f"{label}: search {metric} {before}ms -> {after}ms")
+        before, after = old["load_s"]["p50"], run["load_s"]["p50"]
+        if after > before * (1 + tolerance) and after - before > 0.01:
+            regressions.append(f"{label}: load p50 {before}s -> {after}s")
+        for metric, before in old["relevance"].items():
+            after = run["relevance"].get(metric)
+            if metric != "queries" and after is not None and after < before - RELEVANCE_TOLERANCE:
+                regressions.append(f"{label}: {metric} {before} -> {after}")
+    return regressions
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark KnowledgeBase load/search latency, memory and relevance.")
+    parser.add_argument("--sizes", default=DEFAULT_SIZES, help="comma-separated synthetic corpus sizes (documents)")
+    parser.add_argument("--sources", default="json,snapshot", help="how to load each corpus: json, snapshot or both")
+    parser.add_argument("--retrieval-modes", default="keyword", help="comma-separated KB_RETRIEVAL_MODE values to run")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workdir", default=DEFAULT_WORKDIR, help="where generated corpora are cached")
+    parser.add_argument("--skip-real", action="store_true", help="don't benchmark the real KB in app/data/kb")
+    parser.add_argument("--output", default="-", help="results JSON path ('-' = stdout)")
+    parser.add_argument("--baseline", help="earlier results JSON; exit 1 if this run regressed against it")
+    parser.add_argument("--tolerance", type=float, default=0.5, help="allowed relative latency/load slowdown before it counts as a regression (timings are noisy)")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        job = json.loads(args.child)
+        with open(job["labeled"], encoding="utf-8") as f:
+            labeled = json.load(f)[:RELEVANCE_QUERIES]
+        print(json.dumps(measure(job["kb_dir"], job.get("snapshot"), labeled, job["seed"])))
+        return 0
+
+    logging.basicConfig(level=logging.INFO, stream=sys.stderr, format="%(message)s")
+    sys.path.insert(0, REPO_ROOT)
+    sources = [s.strip() for s in args.sources.split(",") if s.strip()]
+
+    jobs = []
+    if not args.skip_real:
+        jobs.append({"name": "real", "kb_dir": REAL_KB_DIR, "snapshot": None, "labeled": LABELED_QUERIES})
+    for size in (int(s) for s in args.sizes.split(",") if s.strip()):
+        paths = ensure_corpus(args.workdir, size, args.seed)
+        for source in sources:
+            jobs.append({
+                "name": f"synthetic-{size}-{source}",
+                "kb_dir": paths["kb_dir"],
+                "snapshot": paths["snapshot"] if source == "snapshot" else None,
+                "labeled": paths["targets"],
+            })
+
+    runs = []
+    for mode in (m.strip() for m in args.retrieval_modes.split(",") if m.strip()):
+        for job in jobs:
+            job = dict(job, seed=args.seed)
+            result = run_child(job, mode)
+            result.update(name=job["name"], retrieval_mode=mode)
+            runs.append(result)
+            logger.info(
+                f"{job['name']:<28} {mode:<8} load {result['load_s']['p50'] * 1000:9.1f}ms  "
+                f"search p50 {result['search_ms']['p50']:7.3f}ms p99 {result['search_ms']['p99']:7.3f}ms  "
+                f"rss {result['memory_mb']['rss_high_water']:7.1f}MB  "
+                f"mrr@{MRR_AT} {result['relevance'][f'mrr@{MRR_AT}']:.3f} recall@3 {result['relevance']['recall@3']:.3f}"
+            )
+
+    results = {
+        "benchmark": "retrieval",
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "seed": args.seed,
+        "runs": runs,
+    }
+    if args.output == "-":
+        print(json.dumps(results, indent=2))
+    else:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        logger.info(f"Wrote {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for line in regressions:
+            logger.error(f"REGRESSION {line}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
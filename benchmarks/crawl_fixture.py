@@ -0,0 +1,293 @@
+"""
+Offline stand-in for the Medcare website, for crawler tests and benchmarks.
+
+Serves a generated, Medcare-like site of --pages content pages from a local
+HTTP server (keep-alive, threaded), with the things that matter to the crawler:
+
+    /robots.txt                   Disallow: /en/private/, Sitemap: /sitemap_index.xml
+    /sitemap_index.xml            -> /sitemap-1.xml (plain) and /sitemap-2.xml.gz (gzip), with lastmod
+    /en, /en/<section>/<slug>     content pages: shared header/nav/footer chrome around a <main> region
+    /en/doctors?specialty=...     filtered listings that are near-copies of /en/doctors
+    /en/go/<n>                    301 redirects to content pages
+    /en/slow/<n>                  pages that take --slow-ms to answer
+    /en/files/..., /en/images/... PDF and JPEG bodies (non-HTML)
+    /en/missing/<n>               404s, /en/private/<n> is disallowed by robots.txt
+
+Pages are generated on the fly from their number (nothing is held in memory),
+carry an ETag/Last-Modified and answer conditional requests with 304, so a
+second crawl exercises the incremental path. Everything is deterministic for
+a given --seed.
+
+    python -m benchmarks.crawl_fixture --pages 500 --port 8765
+    CRAWL_START_URL=http://127.0.0.1:8765/en CRAWL_RATE_PER_HOST=1000 python scraper.py
+"""
+import sys
+import gzip
+import time
+import random
+import hashlib
+import logging
+import argparse
+import threading
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+from benchmarks.bench_retrieval import AREAS, SPECIALTIES, _make_words
+
+logger = logging.getLogger(__name__)
+
+SECTIONS = ["doctors", "specialties", "branches", "services", "blog"]
+DEFAULT_PAGES = 500
+DEFAULT_SLOW_MS = 250
+SLOW_EVERY = 25            # Every 25th content page links to a slow variant of itself
+REDIRECT_EVERY = 10        # ... a redirect to the next page
+FILE_EVERY = 20            # ... a PDF brochure and an image
+MISSING_EVERY = 30         # ... a broken link
+PRIVATE_EVERY = 40         # ... a page robots.txt disallows
+SITEMAP_COVERAGE = 0.8     # Share of content pages listed in the sitemaps; the rest are only reachable by links
+LINKS_PER_PAGE = 8
+WORDS_PER_PAGE = 300
+PDF_BYTES = 64 * 1024
+IMAGE_BYTES = 32 * 1024
+LAST_MODIFIED = formatdate(1714550400, usegmt=True)  # fixed, so conditional requests can match
+
+
+class FixtureSite:
+    """Renders every URL of the generated site: (status, headers, body)."""
+
+    def __init__(self, pages: int = DEFAULT_PAGES, seed: int = 0, slow_ms: int = DEFAULT_SLOW_MS):
+        self.pages = pages
+        self.seed = seed
+        self.slow_ms = slow_ms
+        self.vocabulary = _make_words(random.Random(seed), 2000)
+        self.doctors = [f"Dr. {w.title()} {v.title()}" for w, v in zip(self.vocabulary[:40], self.vocabulary[40:80])]
+
+    # --- URLs ---
+
+    def page_path(self, n: int) -> str:
+        return f"/en/{SECTIONS[n % len(SECTIONS)]}/{self.vocabulary[n % len(self.vocabulary)]}-{n}"
+
+    def page_number(self, path: str) -> Optional[int]:
+        try:
+            n = int(path.rsplit("-", 1)[1])
+        except (IndexError, ValueError):
+            return None
+        return n if 0 <= n < self.pages and path == self.page_path(n) else None
+
+    def sitemap_pages(self, part: int):
+        listed = [n for n in range(self.pages) if (n * 7919 + self.seed) % 100 < SITEMAP_COVERAGE * 100]
+        half = len(listed) // 2
+        return listed[:half] if part == 1 else listed[half:]
+
+    # --- Bodies ---
+
+    def _chrome(self, title: str, main: str) -> str:
+        # The same header/nav/footer on every page, like the real site's template
+        nav = "".join(f'<li><a href="/en/{s}">{s.title()}</a></li>' for s in SECTIONS)
+        nav += "".join(f'<li><a href="/en/doctors?specialty={s}">{s.title()}</a></li>' for s in SPECIALTIES[:10])
+        branches = "".join(f"<li>Medcare {area} - open daily 8:00 AM to 10:00 PM</li>" for area in AREAS[:8])
+        return (
+            f"<!DOCTYPE html><html lang=\"en\"><head><meta charset=\"utf-8\"><title>{title} | Medcare</title>"
+            f"<style>body{{font-family:sans-serif}} .nav li{{display:inline}}</style>"
+            f"<script>window.dataLayer=window.dataLayer||[];function gtag(){{dataLayer.push(arguments)}}</script></head>"
+            f"<body><header><a href=\"/en\">Medcare Hospitals &amp; Medical Centres</a>"
+            f"<nav><ul class=\"nav\">{nav}</ul></nav></header>"
+            f"{main}"
+            f"<footer><p>Medcare is part of the Aster DM Healthcare group of hospitals and clinics across the UAE.</p>"
+            f"<ul>{branches}</ul><p>Call 800 MEDCARE (6332273) for appointments and emergencies.</p></footer>"
+            f"</body></html>"
+        )
+
+    def content_page(self, n: int) -> str:
+        rng = random.Random(self.seed * 1_000_003 + n)
+        specialty = SPECIALTIES[n % len(SPECIALTIES)]
+        area = AREAS[n % len(AREAS)]
+        paragraphs = []
+        for _ in range(6):
+            words = rng.choices(self.vocabulary, k=WORDS_PER_PAGE // 6)
+            paragraphs.append(f"<p>Our {specialty} team in {area} {' '.join(words)}.</p>")
+
+        links = [self.page_path((n + 1) % self.pages), self.page_path((2 * n + 1) % self.pages)]
+        links += [self.page_path(rng.randrange(self.pages)) for _ in range(LINKS_PER_PAGE - 2)]
+        if n % REDIRECT_EVERY == 0:
+            links.append(f"/en/go/{(n + 3) % self.pages}")
+        if n % SLOW_EVERY == 0:
+            links.append(f"/en/slow/{n}")
+        if n % FILE_EVERY == 0:
+            links += [f"/en/files/brochure-{n}.pdf", f"/en/images/photo-{n}.jpg"]
+        if n % MISSING_EVERY == 0:
+            links.append(f"/en/missing/{n}")
+        if n % PRIVATE_EVERY == 0:
+            links.append(f"/en/private/{n}")
+        related = "".join(f'<li><a href="{link}">Related {i + 1}</a></li>' for i, link in enumerate(links))
+
+        title = f"{specialty.title()} in {area} ({n})"
+        main = f"<main><h1>{title}</h1>{''.join(paragraphs)}<h2>Related</h2><ul>{related}</ul></main>"
+        return self._chrome(title, main)
+
+    def listing_page(self, specialty: Optional[str]) -> str:
+        # Every filter shows (almost) the same directory: near-duplicates of /en/doctors
+        rows = "".join(
+            f"<li><a href=\"{self.page_path(i * len(SECTIONS) % self.pages)}\">{name}</a> - consultant, "
+            f"{SPECIALTIES[i % len(SPECIALTIES)]}, Medcare {AREAS[i % len(AREAS)]}, speaks English and Arabic</li>"
+            for i, name in enumerate(self.doctors)
+        )
+        heading = f"Find a doctor: {specialty}" if specialty else "Find a doctor"
+        main = f"<main><h1>{heading}</h1><p>Browse our consultants and book an appointment online or by phone today.</p><ul>{rows}</ul></main>"
+        return self._chrome(heading, main)
+
+    def home_page(self) -> str:
+        links = "".join(f'<li><a href="{self.page_path(n)}">Featured {n}</a></li>' for n in range(min(self.pages, 20)))
+        main = (f"<main><h1>Medcare Hospitals</h1><p>World-class healthcare for the whole family across Dubai and Sharjah, "
+                f"with {len(AREAS)} branches and more than {len(self.doctors)} consultants.</p><ul>{links}</ul></main>")
+        return self._chrome("Home", main)
+
+    def robots(self, base: str) -> str:
+        return f"User-agent: *\nDisallow: /en/private/\n\nSitemap: {base}/sitemap_index.xml\n"
+
+    def sitemap_index(self, base: str) -> str:
+        entries = "".join(f"<sitemap><loc>{base}/{name}</loc></sitemap>" for name in ("sitemap-1.xml", "sitemap-2.xml.gz"))
+        return f'<?xml version="1.0" encoding="UTF-8"?><sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">{entries}</sitemapindex>'
+
+    def sitemap(self, base: str, part: int) -> str:
+        entries = "".join(
+            f"<url><loc>{base}{self.page_path(n)}</loc><lastmod>2024-{1 + n % 12:02d}-{1 + n % 28:02d}</lastmod></url>"
+            for n in self.sitemap_pages(part)
+        )
+        return f'<?xml version="1.0" encoding="UTF-8"?><urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">{entries}</urlset>'
+
+    def binary(self, size: int, n: int, magic: bytes) -> bytes:
+        return magic + random.Random(n).randbytes(size - len(magic))
+
+    # --- Routing ---
+
+    def render(self, path: str, query: Dict[str, list], base: str) -> Tuple[int, Dict[str, str], bytes]:
+        html = {"Content-Type": "text/html; charset=utf-8"}
+        xml = {"Content-Type": "application/xml"}
+
+        if path == "/robots.txt":
+            return 200, {"Content-Type": "text/plain"}, self.robots(base).encode()
+        if path == "/sitemap_index.xml":
+            return 200, xml, self.sitemap_index(base).encode()
+        if path == "/sitemap-1.xml":
+            return 200, xml, self.sitemap(base, 1).encode()
+        if path == "/sitemap-2.xml.gz":
+            return 200, {"Content-Type": "application/x-gzip"}, gzip.compress(self.sitemap(base, 2).encode(), mtime=0)
+        if path in ("/en", "/en/"):
+            return 200, html, self.home_page().encode()
+        if path == "/en/doctors":
+            return 200, html, self.listing_page(query.get("specialty", [None])[0]).encode()
+        if path.startswith("/en/go/"):
+            n = int(path.rsplit("/", 1)[1]) % self.pages
+            return 301, {"Location": base + self.page_path(n)}, b""
+        if path.startswith("/en/slow/"):
+            time.sleep(self.slow_ms / 1000)
+            n = int(path.rsplit("/", 1)[1]) % self.pages
+            return 200, html, self.content_page(n).replace("<h1>", "<h1>Slow: ", 1).encode()
+        if path.startswith("/en/files/"):
+            return 200, {"Content-Type": "application/pdf"}, self.binary(PDF_BYTES, len(path), b"%PDF-1.4\n")
+        if path.startswith("/en/images/"):
+            return 200, {"Content-Type": "image/jpeg"}, self.binary(IMAGE_BYTES, len(path), b"\xff\xd8\xff\xe0")
+        if path.count("/") == 2 and path.split("/")[2] in SECTIONS:
+            return 200, html, self.listing_page(path.split("/")[2]).encode()
+        n = self.page_number(path)
+        if n is not None:
+            return 200, html, self.content_page(n).encode()
+        return 404, html, b"<html><body><h1>Page not found</h1></body></html>"
+
+
+class FixtureStats:
+    """Requests and bytes served, by status. Thread-safe; reset() between benchmark runs."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.requests = 0
+            self.bytes = 0
+            self.html_pages = 0   # HTML pages sent in full
+            self.revalidated = 0  # conditional requests answered with 304
+            self.by_status: Dict[int, int] = {}
+
+    def count(self, status: int, size: int, is_html: bool):
+        with self.lock:
+            self.requests += 1
+            self.bytes += size
+            self.html_pages += status == 200 and is_html
+            self.revalidated += status == 304
+            self.by_status[status] = self.by_status.get(status, 0) + 1
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            return {"requests": self.requests, "bytes": self.bytes, "html_pages": self.html_pages,
+                    "revalidated": self.revalidated,
+                    "by_status": {str(k): v for k, v in sorted(self.by_status.items())}}
+
+
+class FixtureHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, like the real site
+    site: FixtureSite = None
+    stats: FixtureStats = None
+
+    def do_GET(self):
+        parts = urlsplit(self.path)
+        base = f"http://{self.headers.get('Host') or '%s:%s' % self.server.server_address[:2]}"
+        status, headers, body = self.site.render(parts.path, parse_qs(parts.query), base)
+
+        if status == 200:
+            etag = '"%s"' % hashlib.md5(body).hexdigest()
+            headers = dict(headers, ETag=etag, **{"Last-Modified": LAST_MODIFIED})
+            if self.headers.get("If-None-Match") == etag:
+                status, body = 304, b""
+
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        self.stats.count(status, len(body), headers.get("Content-Type", "").startswith("text/html"))
+
+    def log_message(self, format, *args):
+        pass  # thousands of requests per run
+
+
+def start_fixture(pages: int = DEFAULT_PAGES, seed: int = 0, slow_ms: int = DEFAULT_SLOW_MS,
+                  host: str = "127.0.0.1", port: int = 0) -> Tuple[ThreadingHTTPServer, FixtureStats]:
+    """Starts the fixture site on a background thread (port 0 = any free port). Stop it with server.shutdown()."""
+    stats = FixtureStats()
+    handler = type("Handler", (FixtureHandler,), {"site": FixtureSite(pages, seed, slow_ms), "stats": stats})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="crawl-fixture", daemon=True).start()
+    return server, stats
+
+
+def main(argv: Optional[list] = None) -> int:
+    parser = argparse.ArgumentParser(description="Serve a generated Medcare-like site for offline crawls.")
+    parser.add_argument("--pages", type=int, default=DEFAULT_PAGES, help="content pages on the site")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--slow-ms", type=int, default=DEFAULT_SLOW_MS, help="response delay of the /en/slow/ pages")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, stream=sys.stderr, format="%(message)s")
+    server, stats = start_fixture(args.pages, args.seed, args.slow_ms, args.host, args.port)
+    host, port = server.server_address[:2]
+    logger.info(f"Fixture site with {args.pages} pages at http://{host}:{port}/en (Ctrl+C to stop)")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+        logger.info(f"Served {stats.snapshot()}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
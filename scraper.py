@@ -1,35 +1,60 @@
 import os
 import json
 import requests
-from bs4 import BeautifulSoup
-from urllib.parse import urljoin, urlparse
+from urllib.parse import urlparse
 import urllib.robotparser
 import time
-from collections import deque
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, FIRST_COMPLETED, wait
 import logging
 import io
+from typing import Dict, List, NamedTuple, Optional
+from app.services.kb_snapshot import KB_SNAPSHOT, build_snapshot
+from app.services.crawl_state import CRAWL_STATE, CrawlState, content_hash, doc_hash
+from app.services.crawl_frontier import CRAWL_FRONTIER, Frontier
+from app.services.crawl_sitemaps import iter_sitemap_urls, lastmod_priority, sitemap_locations
+from app.services.crawl_extract import HAVE_LXML, extract_page
+from app.services.crawl_dedup import DuplicateIndex, minhash, signature_to_hex
 
 # --- CONFIGURATION ---
-KB_OUTPUT_DIR = "app/data/kb"  # We will save data inside your app folder
+KB_OUTPUT_DIR = os.getenv("KB_DIR", "app/data/kb")  # We will save data inside your app folder (same KB_DIR the API loads)
 os.makedirs(KB_OUTPUT_DIR, exist_ok=True)
 
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+CRAWL_CONCURRENCY = int(os.getenv("CRAWL_CONCURRENCY", "8"))              # Pages fetched at once
+CRAWL_RATE_PER_HOST = float(os.getenv("CRAWL_RATE_PER_HOST", "2"))        # Requests per second per host (be polite)
+CRAWL_BURST = float(os.getenv("CRAWL_BURST", "2"))                        # Requests a host may get back-to-back
+CRAWL_TIMEOUT = 10                                                        # Seconds per request
+CRAWL_SITEMAPS = os.getenv("CRAWL_SITEMAPS", "1") != "0"                  # Seed the frontier from robots.txt sitemaps
+CRAWL_EXTRACT_WORKERS = int(os.getenv("CRAWL_EXTRACT_WORKERS", str(os.cpu_count() or 1)))  # Extraction processes, 0 = on the fetcher threads
+CRAWL_EXTRACT_QUEUE = int(os.getenv("CRAWL_EXTRACT_QUEUE", "32"))         # Pages waiting for extraction before fetching pauses
+CRAWL_START_URL = os.getenv("CRAWL_START_URL", "https://www.medcare.ae/en")  # Another root (e.g. benchmarks/crawl_fixture.py) for offline runs
+CRAWL_MAX_PAGES = int(os.getenv("CRAWL_MAX_PAGES", "50"))                 # Limit to 50 pages for demo speed
+CRAWL_DOMAIN = urlparse(CRAWL_START_URL).netloc.removeprefix("www.")      # Stay on medcare.ae
+LINK_SCOPE = CRAWL_DOMAIN + urlparse(CRAWL_START_URL).path.rstrip("/")    # Only links containing this are followed ("medcare.ae/en")
+
 # Setup simple logger
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 # --- 1. Hardcoded Q&A (Immediate Answers) ---
 # You can add specific answers here that you want the AI to know perfectly.
+# "aliases" are other phrasings of the question; callers asking any of them get the answer directly.
 QA_LIST = [
     {
         "question": "What are the visiting hours?",
+        "aliases": ["When can I visit a patient?", "Visiting time", "What time can visitors come?"],
         "answer": "Visiting hours are typically from 10:00 AM to 8:00 PM daily. However, specific units like ICU may have restricted timings."
     },
     {
         "question": "Do you accept insurance?",
+        "aliases": ["Which insurance do you take?", "Is my insurance accepted?", "Insurance providers"],
         "answer": "Yes, Medcare accepts most major insurance providers including Daman, AXA, MetLife, and others. Please contact our front desk for specific policy verification."
     },
     {
         "question": "Where is the hospital located?",
+        "aliases": ["Where are you located?", "Hospital address", "Hospital location"],
         "answer": "We have multiple branches including Medcare Hospital Al Safa and Medcare Women & Children Hospital. Please specify which branch you are interested in."
     }
 ]
@@ -42,7 +67,8 @@ def ingest_qa():
             "title": "FAQ: " + item['question'],
             "url": "internal-faq",
             "content": f"Question: {item['question']}\nAnswer: {item['answer']}",
-            "type": "qa"
+            "type": "qa",
+            "aliases": item.get("aliases", [])
         }
         filename = os.path.join(KB_OUTPUT_DIR, f"faq_{i+1}.json")
         with open(filename, "w", encoding="utf-8") as f:
@@ -60,75 +86,320 @@ def get_robot_parser(start_url):
         rp.allow_all = True
     return rp
 
-def scrape_medcare():
-    """Scrapes the Medcare website."""
-    START_URL = "https://www.medcare.ae/en"
-    MAX_PAGES = 50  # Limit to 50 pages for demo speed
-    
-    logger.info(f"Starting scrape for: {START_URL}")
-    
+class TokenBucket:
+    """Allows `rate` requests per second on average, with bursts of up to `burst`. Thread-safe."""
+
+    def __init__(self, rate: float, burst: float = 1):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class HostLimiter:
+    """One token bucket per host; honours a robots.txt Crawl-delay if it is stricter than ours."""
+
+    def __init__(self, rate: float = CRAWL_RATE_PER_HOST, burst: float = CRAWL_BURST):
+        self.rate = rate
+        self.burst = burst
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def wait(self, url: str, rp=None):
+        host = urlparse(url).netloc
+        with self.lock:
+            bucket = self.buckets.get(host)
+            if bucket is None:
+                rate = self.rate
+                delay = rp.crawl_delay(USER_AGENT) if rp else None
+                if delay:
+                    rate = min(rate, 1.0 / float(delay))
+                bucket = self.buckets[host] = TokenBucket(rate, self.burst)
+        bucket.acquire()
+
+
+_thread_local = threading.local()
+
+def get_session() -> requests.Session:
+    """One keep-alive session per fetcher thread (requests.Session isn't thread-safe)."""
+    session = getattr(_thread_local, "session", None)
+    if session is None:
+        session = requests.Session()
+        session.headers.update({'User-Agent': USER_AGENT})
+        adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=4)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        _thread_local.session = session
+    return session
+
+
+def save_page(doc: dict) -> str:
+    safe_name = doc["url"].replace("https://", "").replace("/", "_").replace(".", "_")[-50:] + ".json"
+    with open(os.path.join(KB_OUTPUT_DIR, safe_name), "w", encoding="utf-8") as f:
+        json.dump(doc, f, indent=4)
+    return safe_name
+
+
+class PageBudget:
+    """Caps saved pages across fetcher threads (MAX_PAGES)."""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.used = 0
+        self.lock = threading.Lock()
+
+    def claim(self) -> bool:
+        with self.lock:
+            if self.used >= self.limit:
+                return False
+            self.used += 1
+            return True
+
+    @property
+    def exhausted(self) -> bool:
+        return self.used >= self.limit
+
+
+def remove_page(filename: str):
+    try:
+        os.remove(os.path.join(KB_OUTPUT_DIR, filename))
+    except FileNotFoundError:
+        pass
+
+
+class Fetched(NamedTuple):
+    """A downloaded page waiting for extraction."""
+    url: str
+    body: bytes
+    encoding: Optional[str]
+    headers: dict
+    body_hash: str
+    previous: Optional[dict]
+
+
+def fetch_page(url: str, rp, limiter: HostLimiter, budget: PageBudget, state: CrawlState):
+    """
+    Fetcher thread: waits for the host's politeness budget and downloads one page.
+    Returns a Fetched page to extract, or the page's links if there is nothing to extract.
+    """
+    if not rp.can_fetch(USER_AGENT, url):
+        logger.info(f"Skipping (robots.txt): {url}")
+        return []
+
+    limiter.wait(url, rp)
+    previous = state.get(url)
+    response = get_session().get(url, headers=state.conditional_headers(url), timeout=CRAWL_TIMEOUT)
+
+    # 1. Unchanged since last run: no parsing, no rewrite, reuse the links we stored
+    if response.status_code == 304:
+        if previous and previous.get("file"):
+            budget.claim()  # its KB file stays, so an unchanged page still counts against the page budget
+        return state.unchanged(url)
+    if response.status_code in (404, 410):
+        gone = state.forget(url)
+        if gone:
+            remove_page(gone)
+            logger.info(f"Removed (HTTP {response.status_code}): {url}")
+        return []
+    response.raise_for_status()
+
+    if "text/html" not in response.headers.get('Content-Type', ''):
+        state.record(url, response.headers, None, None, None, [])
+        return []
+
+    body_hash = content_hash(response.content)
+    if previous and previous.get("hash") == body_hash and state.reusable(url):
+        if previous.get("file"):
+            budget.claim()
+        return state.unchanged(url)
+
+    headers = {"ETag": response.headers.get("ETag"), "Last-Modified": response.headers.get("Last-Modified")}
+    return Fetched(url, response.content, response.encoding, headers, body_hash, previous)
+
+
+def finish_page(page: Fetched, doc: Optional[dict], links: List[str], budget: PageBudget, state: CrawlState,
+                duplicates: DuplicateIndex):
+    """
+    Saves an extracted page (unless its document didn't change) and records it in the crawl state.
+    A near-duplicate of a page already kept is recorded against that page instead of being saved.
+    """
+    previous = page.previous
+    if doc is None:
+        duplicates.remove(page.url)
+        state.record(page.url, page.headers, page.body_hash, None, None, links)
+        if previous and previous.get("file"):
+            remove_page(previous["file"])
+        return
+
+    signature = minhash(doc["content"])
+    match = duplicates.find(signature, exclude=page.url)
+    while match and not (state.get(match[0]) or {}).get("file"):
+        duplicates.remove(match[0])  # gone (404) or no longer a document since it was indexed
+        match = duplicates.find(signature, exclude=page.url)
+    if match:
+        canonical, score = match
+        duplicates.remove(page.url)
+        state.record(page.url, page.headers, page.body_hash, None, None, links, duplicate_of=canonical)
+        if previous and previous.get("file") and previous["file"] != state.get(canonical)["file"]:
+            remove_page(previous["file"])
+        logger.info(f"Near-duplicate ({score:.2f}) of {canonical}: {page.url}")
+    elif budget.claim():
+        document_hash = doc_hash(doc)
+        if previous and previous.get("file") and previous.get("doc_hash") == document_hash:
+            filename = previous["file"]  # only page chrome changed, the KB file is already right
+        else:
+            filename = save_page(doc)
+            logger.info(f"Scraped [{budget.used}/{budget.limit}]: {page.url}")
+        duplicates.add(page.url, signature)
+        state.record(page.url, page.headers, page.body_hash, filename, document_hash, links,
+                     signature=signature_to_hex(signature))
+    else:
+        state.unchanged(page.url)  # over the page budget: keep what the last run stored, so it isn't taken for gone
+
+
+def queue_sitemap_urls(frontier: Frontier, rp, start_url: str, limiter: HostLimiter) -> int:
+    """Streams the site's sitemaps into the frontier, most recently modified pages first. Returns how many were new."""
+    def fetch(url):
+        limiter.wait(url, rp)
+        return get_session().get(url, stream=True, timeout=CRAWL_TIMEOUT)
+
+    queued = 0
+    for url, lastmod in iter_sitemap_urls(sitemap_locations(rp, start_url), fetch):
+        if LINK_SCOPE in url and rp.can_fetch(USER_AGENT, url):
+            queued += frontier.push(url, lastmod_priority(lastmod))
+    return queued
+
+
+def scrape_medcare(state_path: str = CRAWL_STATE, frontier_path: str = CRAWL_FRONTIER) -> Dict[str, List[str]]:
+    """
+    Scrapes the Medcare website with CRAWL_CONCURRENCY fetcher threads, rate limited per host.
+    Pages that didn't change since the last run (per the crawl state) are not re-parsed or rewritten.
+    An interrupted crawl resumes from the frontier checkpoint on the next run.
+    Returns the changelist: KB files added / updated / removed by this run.
+    """
+    START_URL = CRAWL_START_URL
+    MAX_PAGES = CRAWL_MAX_PAGES
+
+    logger.info(f"Starting scrape for: {START_URL} ({CRAWL_CONCURRENCY} threads, {CRAWL_RATE_PER_HOST} req/s per host)")
+    started = time.monotonic()
+
     rp = get_robot_parser(START_URL)
-    queue = deque([START_URL])
-    visited = set()
-    scraped_count = 0
-    
-    while queue and scraped_count < MAX_PAGES:
-        current_url = queue.popleft()
-        
-        if current_url in visited: continue
-        visited.add(current_url)
-        
-        # Domain Restriction (Stay on medcare.ae)
-        if "medcare.ae" not in current_url: continue
-
-        try:
-            logger.info(f"Scraping [{scraped_count+1}/{MAX_PAGES}]: {current_url}")
-            headers = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'}
-            response = requests.get(current_url, headers=headers, timeout=10)
-            
-            if "text/html" not in response.headers.get('Content-Type', ''):
-                continue
-
-            soup = BeautifulSoup(response.text, 'html.parser')
-            
-            # CLEANUP: Remove nav, footer, scripts to get only real text
-            for element in soup(["script", "style", "nav", "footer", "header", "noscript", "aside"]):
-                element.extract()
-            
-            # Extract Text
-            text = soup.get_text(separator="\n")
-            lines = [line.strip() for line in text.splitlines() if len(line.strip()) > 20] # Only keep substantial lines
-            cleaned_text = "\n".join(lines)
-            
-            if len(cleaned_text) > 200:
-                page_title = soup.title.string.strip() if soup.title else current_url
-                
-                data = {
-                    "title": page_title,
-                    "url": current_url,
-                    "content": cleaned_text,
-                    "type": "web_page"
-                }
-                
-                # Save as JSON
-                safe_name = current_url.replace("https://", "").replace("/", "_").replace(".", "_")[-50:] + ".json"
-                with open(os.path.join(KB_OUTPUT_DIR, safe_name), "w", encoding="utf-8") as f:
-                    json.dump(data, f, indent=4)
-                
-                scraped_count += 1
-
-            # Find Links
-            for link in soup.find_all('a', href=True):
-                href = link['href']
-                full_url = urljoin(current_url, href).split("#")[0]
-                if full_url not in visited and "medcare.ae/en" in full_url:
-                    queue.append(full_url)
-                    
-            time.sleep(1) # Be polite
-
-        except Exception as e:
-            logger.error(f"Error scraping {current_url}: {e}")
+    limiter = HostLimiter()
+    budget = PageBudget(MAX_PAGES)
+    state = CrawlState(state_path)
+    frontier = Frontier(frontier_path)
+    # Pages kept by earlier runs (unchanged ones are never re-parsed, their signatures come from the state)
+    duplicates = DuplicateIndex.from_state(state.entries)
+
+    if frontier.resumed:
+        state.changes = json.loads(frontier.get_meta("changes", json.dumps(state.changes)))
+        state.seen.update(frontier.done_urls())
+        budget.used = sum(1 for url in state.seen if (state.get(url) or {}).get("file"))
+    else:
+        # Sitemaps list the content pages directly; link following from START_URL fills the gaps
+        if CRAWL_SITEMAPS:
+            logger.info(f"Queued {queue_sitemap_urls(frontier, rp, START_URL, limiter)} URLs from sitemaps")
+        frontier.push(START_URL)
+
+    def _checkpoint():
+        # Crawl state first: it must know about every page the frontier calls done
+        state.save()
+        frontier.set_meta("changes", json.dumps(state.changes))
+    frontier.on_checkpoint = _checkpoint
+
+    # Fetcher threads hand raw pages to the extraction processes; CPU-bound parsing never holds up network I/O
+    extract_pool = None
+    if CRAWL_EXTRACT_WORKERS > 0:
+        extract_pool = ProcessPoolExecutor(CRAWL_EXTRACT_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    logger.info(f"Extracting with {'lxml' if HAVE_LXML else 'html.parser'} on {CRAWL_EXTRACT_WORKERS or 'the fetcher'} {'processes' if extract_pool else 'threads'}")
+
+    fetching = {}    # future -> url
+    extracting = {}  # future -> Fetched page
+    finished = False
+    try:
+        with ThreadPoolExecutor(max_workers=CRAWL_CONCURRENCY, thread_name_prefix="crawler") as pool:
+            while True:
+                # Keep at most CRAWL_CONCURRENCY pages in flight, and stop fetching while extraction is behind.
+                # Once the budget is spent nothing new starts, but pages already in flight are still recorded.
+                while not budget.exhausted and len(fetching) < CRAWL_CONCURRENCY and len(extracting) < CRAWL_EXTRACT_QUEUE:
+                    current_url = frontier.pop()
+                    if current_url is None:
+                        break
+                    # Domain Restriction (Stay on medcare.ae)
+                    if CRAWL_DOMAIN not in current_url:
+                        frontier.done(current_url)
+                        continue
+                    fetching[pool.submit(fetch_page, current_url, rp, limiter, budget, state)] = current_url
+                if not fetching and not extracting:
+                    break
+
+                done, _ = wait(list(fetching) + list(extracting), return_when=FIRST_COMPLETED)
+                for future in done:
+                    if future in fetching:
+                        current_url = fetching.pop(future)
+                        try:
+                            result = future.result()
+                        except Exception as e:
+                            logger.error(f"Error scraping {current_url}: {e}")
+                            result = state.unchanged(current_url)  # keep what we had, try again next run
+                        if isinstance(result, Fetched):
+                            args = (extract_page, result.url, result.body, result.encoding, LINK_SCOPE)
+                            extracting[(extract_pool or pool).submit(*args)] = result
+                            continue
+                        links = result
+                    else:
+                        page = extracting.pop(future)
+                        current_url = page.url
+                        try:
+                            doc, links = future.result()
+                        except Exception as e:
+                            logger.error(f"Error extracting {current_url}: {e}")
+                            links = state.unchanged(current_url)
+                        else:
+                            finish_page(page, doc, links, budget, state, duplicates)
+                    frontier.done(current_url)
+                    frontier.push_many(links)
+
+            complete = frontier.queued == 0
+        finished = True
+    finally:
+        if extract_pool:
+            extract_pool.shutdown(cancel_futures=True)
+        if not finished:
+            logger.warning(f"Crawl interrupted; it will resume from {frontier_path} on the next run")
+            frontier.close()
+
+    # Only a crawl that ran out of links proves that pages we didn't reach are gone
+    if complete:
+        for filename in state.forget_unseen():
+            remove_page(filename)
+
+    state.save()
+    frontier.close(finished=True)
+    changes = state.save_changes()
+    elapsed = time.monotonic() - started
+    logger.info(f"Scraped {budget.used} pages in {elapsed:.1f}s ({budget.used / max(elapsed, 1e-9):.2f} pages/s)")
+    collapsed = sum(1 for url in state.seen if (state.get(url) or {}).get("duplicate_of"))
+    logger.info(f"Collapsed {collapsed} near-duplicate pages into {len(duplicates)} kept pages")
+    logger.info(f"Changes: +{len(changes['added'])} ~{len(changes['updated'])} -{len(changes['removed'])} files")
+    return changes
 
 if __name__ == "__main__":
     ingest_qa()
-    scrape_medcare()
\ No newline at end of file
+    changes = scrape_medcare()
+    # Pack the crawl into the single-file snapshot the API memory-maps (if anything changed)
+    if any(changes.values()) or not os.path.exists(KB_SNAPSHOT):
+        build_snapshot(KB_OUTPUT_DIR)
\ No newline at end of file
@@ -0,0 +1,155 @@
+"""
+The async router (app/api/routes_async.py) on sqlite+aiosqlite: booking, a
+double booking, rescheduling (onto a taken slot, then a free one) and cancelling,
+plus the same conversation through the sync router, which must answer alike.
+"""
+import asyncio
+from datetime import date, timedelta
+
+import httpx
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, select
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from sqlalchemy.orm import sessionmaker
+
+from app.api import routes, routes_async
+from app.core.database import Base, create_async_db_engine, get_async_db, get_db
+from app.models.models import Appointment, Branch, Doctor, Patient
+from app.services.doctor_directory import doctor_directory
+
+ROWS = {
+    Branch: [{"Branch_Id": 1, "Branch_Name": "Al Safa", "Location": "Dubai"}],
+    Doctor: [
+        {"Doctor_Id": 1, "Doctor_Name": "Sara Khan", "Specialization": "Cardiology", "Branch_Id": 1},
+        {"Doctor_Id": 2, "Doctor_Name": "Omar Haddad", "Specialization": "Neurology", "Branch_Id": 1},
+    ],
+    Patient: [
+        {"Patient_Id": 1, "Patient_Name": "Alice", "Phone_Number": "0500000001"},
+        {"Patient_Id": 2, "Patient_Name": "Bob", "Phone_Number": "0500000002"},
+    ],
+}
+
+
+def next_monday() -> str:
+    today = date.today()
+    return (today + timedelta(days=7 - today.weekday())).isoformat()
+
+
+def conversation(day: str):
+    """(path, body) of each call, in order."""
+    return [
+        ("/book", {"patient_id": 1, "doctor_name": "Dr. Sara Khan", "date": day, "time": "10:00"}),
+        ("/book", {"patient_id": 2, "doctor_name": "Sara Khan", "date": day, "time": "10:00"}),       # conflict
+        ("/book", {"patient_id": 2, "doctor_name": "Sara Khan", "date": day, "time": "11:00 AM"}),
+        ("/book", {"patient_id": 1, "doctor_name": "Sarah Kan", "date": day, "time": "09:00"}),       # fuzzy name
+        ("/book", {"patient_id": 1, "doctor_name": "Nobody Atall", "date": day, "time": "09:00"}),
+        ("/appointment/reschedule", {"patient_id": 1, "new_date": day, "new_time": "11:00"}),         # taken by Bob
+        ("/appointment/reschedule", {"patient_id": 1, "new_date": day, "new_time": "12:30"}),         # moves the 09:00
+        ("/availability", {"doctor_name": "Sara Khan", "date": day}),
+        ("/appointment/cancel", {"patient_id": 1}),
+        ("/appointment/cancel", {"patient_id": 1}),
+        ("/appointment/cancel", {"patient_id": 1}),                                                   # nothing left
+    ]
+
+
+def check_answers(answers, day: str):
+    statuses = [answer["status"] if "status" in answer else "ok" for answer in answers]
+    assert statuses == [
+        "confirmed", "error", "confirmed", "confirmed", "error",
+        "error", "rescheduled", "ok", "cancelled", "cancelled", "error",
+    ]
+    assert answers[1]["message"] == "That time slot is already taken. Please pick another time."
+    assert answers[2]["message"].endswith(f"on {day} at 11:00.")
+    assert "Sara Khan" in answers[3]["message"]
+    assert answers[5]["message"] == "That new time slot is already taken. Please pick another time."
+    assert answers[6]["new_time"] == f"{day} 12:30"
+    free = answers[7]["available_slots"]
+    assert "09:00" in free and "10:00" not in free and "11:00" not in free and "12:30" not in free
+    # cancel takes the latest active appointment first
+    assert answers[8]["message"] == f"Appointment on {day} 12:30 has been cancelled."
+    assert answers[9]["message"] == f"Appointment on {day} 10:00 has been cancelled."
+    assert answers[10]["message"] == "I couldn't find any active appointments for that ID."
+
+
+def final_appointments(rows):
+    return sorted((a.Patient_Id, a.Appointment_Date.strftime("%H:%M"), a.Appointment_Status) for a in rows)
+
+
+EXPECTED_APPOINTMENTS = [(1, "10:00", "CANCELLED"), (1, "12:30", "CANCELLED"), (2, "11:00", "SCHEDULED")]
+
+
+def test_async_booking_flow(tmp_path):
+    day = next_monday()
+
+    async def run():
+        engine = create_async_db_engine(f"sqlite+aiosqlite:///{tmp_path / 'async.db'}")
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+            for model, rows in ROWS.items():
+                await conn.execute(model.__table__.insert(), rows)
+        sessions = async_sessionmaker(engine, autoflush=False, expire_on_commit=False)
+
+        async def override():
+            async with sessions() as db:
+                yield db
+
+        app = FastAPI()
+        app.include_router(routes_async.router, prefix="/api")
+        app.dependency_overrides[get_async_db] = override
+        doctor_directory.invalidate()
+
+        answers = []
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+            for path, body in conversation(day):
+                response = await client.post("/api" + path, json=body)
+                assert response.status_code == 200, response.text
+                answers.append(response.json())
+
+        async with sessions() as db:
+            appointments = final_appointments((await db.scalars(select(Appointment))).all())
+        await engine.dispose()
+        return answers, appointments
+
+    answers, appointments = asyncio.run(run())
+    check_answers(answers, day)
+    assert appointments == EXPECTED_APPOINTMENTS
+
+
+def test_sync_router_answers_the_same(tmp_path):
+    day = next_monday()
+    engine = create_engine(f"sqlite:///{tmp_path / 'sync.db'}", connect_args={"check_same_thread": False})
+    Base.metadata.create_all(engine)
+    with engine.begin() as conn:
+        for model, rows in ROWS.items():
+            conn.execute(model.__table__.insert(), rows)
+    sessions = sessionmaker(bind=engine, autoflush=False)
+
+    def override():
+        db = sessions()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    app = FastAPI()
+    app.include_router(routes.router, prefix="/api")
+    app.dependency_overrides[get_db] = override
+    doctor_directory.invalidate()
+
+    with TestClient(app) as client:
+        answers = [client.post("/api" + path, json=body).json() for path, body in conversation(day)]
+    check_answers(answers, day)
+    with sessions() as db:
+        assert final_appointments(db.scalars(select(Appointment)).all()) == EXPECTED_APPOINTMENTS
+    engine.dispose()
+
+
+def test_both_routers_serve_the_same_paths():
+    def paths(router):
+        app = FastAPI()
+        app.include_router(router, prefix="/api")
+        return sorted(app.openapi()["paths"])
+
+    assert paths(routes_async.router) == paths(routes.router)
+    assert "/api/hospital_info" in paths(routes_async.router)
@@ -0,0 +1,106 @@
+"""
+Near-duplicate detection at ingest: MinHash signatures estimate how much two
+pages share, the LSH index finds the kept page a near-copy collapses into, and
+signatures survive the trip through the crawl state.
+"""
+import numpy as np
+import pytest
+
+import scraper
+from app.services.crawl_state import CrawlState
+from app.services.crawl_dedup import (
+    MINHASH_PERMUTATIONS, DuplicateIndex, minhash, signature_from_hex, signature_to_hex, similarity,
+)
+
+WORDS = ("cardiology clinic heart rhythm screening echo stress test consultant parking branch "
+         "appointment insurance daman thiqa visiting hours pharmacy laboratory radiology scan").split()
+
+
+def page(seed: int, length: int = 300) -> str:
+    return " ".join(np.random.RandomState(seed).choice(WORDS, length))
+
+
+def near_copy(text: str, changes: int = 3) -> str:
+    words = text.split()
+    for i in range(changes):
+        words[len(words) * (i + 1) // (changes + 1)] = "filter"
+    return " ".join(words)
+
+
+def test_signature_is_stable():
+    assert minhash(page(1)).shape == (MINHASH_PERMUTATIONS,)
+    assert np.array_equal(minhash(page(1)), minhash(page(1)))
+    assert similarity(minhash(page(1)), minhash(page(1))) == 1.0
+
+
+def test_estimates_similarity():
+    assert similarity(minhash(page(1)), minhash(near_copy(page(1)))) > 0.85
+    assert similarity(minhash(page(1)), minhash(page(2))) < 0.2
+
+
+def test_short_pages():
+    assert similarity(minhash("parking"), minhash("parking")) == 1.0
+    assert similarity(minhash("parking"), minhash("visiting hours")) < 0.2
+
+
+def test_hex_round_trip():
+    signature = minhash(page(1))
+    assert np.array_equal(signature_from_hex(signature_to_hex(signature)), signature)
+
+
+@pytest.mark.parametrize("value", [None, "not hex", "abcd"])
+def test_bad_hex(value):
+    assert signature_from_hex(value) is None
+
+
+def test_finds_the_kept_page():
+    index = DuplicateIndex(threshold=0.85)
+    index.add("https://example.com/doctors", minhash(page(1)))
+    index.add("https://example.com/parking", minhash(page(2)))
+
+    url, score = index.find(minhash(near_copy(page(1))))
+    assert url == "https://example.com/doctors" and score >= 0.85
+    assert index.find(minhash(page(3))) is None
+    assert index.find(minhash(page(1)), exclude="https://example.com/doctors") is None
+
+
+def test_remove_and_readd():
+    index = DuplicateIndex(threshold=0.85)
+    index.add("https://example.com/doctors", minhash(page(1)))
+    index.add("https://example.com/doctors", minhash(page(2)))  # the page changed
+    assert len(index) == 1
+    assert index.find(minhash(page(1))) is None
+
+    index.remove("https://example.com/doctors")
+    assert index.find(minhash(page(2))) is None
+    assert all(not band for band in index.bands)
+
+
+def test_threshold_above_one_disables():
+    index = DuplicateIndex(threshold=1.1)
+    index.add("https://example.com/doctors", minhash(page(1)))
+    assert index.find(minhash(page(1))) is None
+
+
+def test_from_state():
+    signature = signature_to_hex(minhash(page(1)))
+    index = DuplicateIndex.from_state({
+        "https://example.com/doctors": {"file": "doctors.json", "signature": signature},
+        "https://example.com/doctors?page=2": {"file": None, "signature": None, "duplicate_of": "https://example.com/doctors"},
+        "https://example.com/broken": {"file": "broken.json", "signature": "zz"},
+    }, threshold=0.85)
+    assert list(index.signatures) == ["https://example.com/doctors"]
+
+
+def test_crawler_collapses_near_copies(monkeypatch):
+    saved = []
+    monkeypatch.setattr(scraper, "save_page", lambda doc: saved.append(doc["url"]) or f"page{len(saved)}.json")
+    state, duplicates, budget = CrawlState(None), DuplicateIndex(threshold=0.85), scraper.PageBudget(10)
+
+    for url, text in [("https://example.com/doctors", page(1)), ("https://example.com/doctors?print=1", near_copy(page(1)))]:
+        fetched = scraper.Fetched(url, b"", "utf-8", {}, f"hash of {url}", None)
+        scraper.finish_page(fetched, {"url": url, "content": text}, [], budget, state, duplicates)
+
+    assert saved == ["https://example.com/doctors"]
+    assert state.get("https://example.com/doctors?print=1")["duplicate_of"] == "https://example.com/doctors"
+    assert budget.used == 1
@@ -0,0 +1,164 @@
+"""
+Incremental re-crawls: the crawl state sends back the validators a page was
+served with, a 304 (or a byte-identical body) reuses the stored links without
+re-extracting, and every run's changelist says which KB files were added,
+updated or removed.
+"""
+from urllib.robotparser import RobotFileParser
+
+import pytest
+
+import scraper
+from app.services.crawl_dedup import DuplicateIndex
+from app.services.crawl_state import CrawlState
+
+URL = "https://example.com/parking"
+VALIDATORS = {"ETag": '"v1"', "Last-Modified": "Mon, 05 Oct 2026 08:00:00 GMT"}
+
+
+class FakeResponse:
+    def __init__(self, status_code, content=b"", headers=None):
+        self.status_code = status_code
+        self.content = content
+        self.headers = {"Content-Type": "text/html", **(headers or {})}
+        self.encoding = "utf-8"
+
+    def raise_for_status(self):
+        pass
+
+
+class FakeSession:
+    def __init__(self, response):
+        self.response = response
+        self.sent = []
+
+    def get(self, url, headers=None, timeout=None):
+        self.sent.append(headers)
+        return self.response
+
+
+def fetched(state, filename="example_com_parking.json", links=("https://example.com/",), signature="ab" * 8):
+    """URL as the last run left it."""
+    state.record(URL, VALIDATORS, "body-hash", filename, "doc-hash", list(links), signature=signature)
+    state.changes = {"added": [], "updated": [], "removed": []}
+    state.seen = set()
+
+
+def fetch(monkeypatch, state, response):
+    session = FakeSession(response)
+    monkeypatch.setattr(scraper, "get_session", lambda: session)
+    rp = RobotFileParser()
+    rp.parse([])
+    budget = scraper.PageBudget(10)
+    result = scraper.fetch_page(URL, rp, scraper.HostLimiter(rate=1000, burst=1000), budget, state)
+    return result, session.sent[0], budget
+
+
+def test_conditional_headers():
+    state = CrawlState(None)
+    assert state.conditional_headers(URL) == {}
+
+    fetched(state)
+    assert state.conditional_headers(URL) == {"If-None-Match": '"v1"', "If-Modified-Since": VALIDATORS["Last-Modified"]}
+
+
+def test_no_validators_without_what_a_304_needs():
+    state = CrawlState(None)
+    fetched(state, signature=None)  # no near-duplicate signature stored
+    assert state.conditional_headers(URL) == {}
+
+    state.record("https://example.com/parking?ref=nav", VALIDATORS, "h", None, None, [], duplicate_of="https://example.com/gone")
+    assert state.conditional_headers("https://example.com/parking?ref=nav") == {}
+
+
+def test_not_modified_reuses_the_stored_links(monkeypatch):
+    state = CrawlState(None)
+    fetched(state)
+
+    links, sent, budget = fetch(monkeypatch, state, FakeResponse(304))
+    assert sent["If-None-Match"] == '"v1"'
+    assert links == ["https://example.com/"]
+    assert budget.used == 1  # the page's KB file stays
+    assert URL in state.seen and not state.changed
+
+
+def test_identical_body_skips_extraction(monkeypatch):
+    state = CrawlState(None)
+    fetched(state)
+    state.entries[URL]["hash"] = scraper.content_hash(b"<html>same</html>")
+
+    links, _, budget = fetch(monkeypatch, state, FakeResponse(200, b"<html>same</html>", {"ETag": '"v2"'}))
+    assert links == ["https://example.com/"]
+    assert budget.used == 1
+
+
+def test_changed_body_is_extracted(monkeypatch):
+    state = CrawlState(None)
+    fetched(state)
+
+    page, _, budget = fetch(monkeypatch, state, FakeResponse(200, b"<html>new</html>", {"ETag": '"v2"'}))
+    assert isinstance(page, scraper.Fetched)
+    assert page.headers["ETag"] == '"v2"' and page.previous["file"] == "example_com_parking.json"
+    assert budget.used == 0  # claimed once the page is saved
+
+
+def test_gone_page_is_removed(monkeypatch):
+    state = CrawlState(None)
+    fetched(state)
+    removed = []
+    monkeypatch.setattr(scraper, "remove_page", removed.append)
+
+    assert fetch(monkeypatch, state, FakeResponse(404))[0] == []
+    assert removed == ["example_com_parking.json"]
+    assert state.get(URL) is None
+    assert state.save_changes(None)["removed"] == ["example_com_parking.json"]
+
+
+@pytest.mark.parametrize("filename, document_hash, kind", [
+    ("example_com_parking.json", "doc-hash", None),
+    ("example_com_parking.json", "new-hash", "updated"),
+    (None, None, "removed"),
+])
+def test_changelist(filename, document_hash, kind):
+    state = CrawlState(None)
+    fetched(state)
+
+    state.record(URL, VALIDATORS, "body-hash", filename, document_hash, [])
+    assert state.changed == (kind is not None)
+    if kind:
+        assert state.save_changes(None)[kind] == ["example_com_parking.json"]
+
+
+def test_unreached_pages_are_forgotten():
+    state = CrawlState(None)
+    fetched(state)
+    state.record("https://example.com/copy", VALIDATORS, "h", "example_com_parking.json", "doc-hash", [])
+    state.record("https://example.com/old", VALIDATORS, "h", "example_com_old.json", "doc-hash", [])
+    state.seen = {URL}
+
+    assert state.forget_unseen() == ["example_com_old.json"]  # the copy's file is still URL's
+    assert set(state.entries) == {URL}
+
+
+def test_page_over_the_budget_is_kept(monkeypatch):
+    # The budget runs out while a changed page is being extracted, and the frontier then drains
+    state = CrawlState(None)
+    fetched(state)
+    page = scraper.Fetched(URL, b"<html>new</html>", "utf-8", {"ETag": '"v2"'}, "new-hash", state.get(URL))
+    monkeypatch.setattr(scraper, "save_page", lambda doc: pytest.fail("saved over the budget"))
+    budget = scraper.PageBudget(0)
+
+    scraper.finish_page(page, {"url": URL, "content": "New parking rates."}, [], budget, state, DuplicateIndex())
+    assert state.forget_unseen() == []
+    assert state.get(URL)["file"] == "example_com_parking.json"
+    assert state.get(URL)["hash"] == "body-hash"  # still stale, so the next run fetches it again
+    assert not state.changed
+
+
+def test_save_and_load(tmp_path):
+    path = str(tmp_path / "crawl_state.json")
+    state = CrawlState(path)
+    fetched(state)
+    state.save()
+
+    assert CrawlState(path).conditional_headers(URL)["If-None-Match"] == '"v1"'
@@ -0,0 +1,91 @@
+"""
+The doctor directory's specialty filter matches whole words (and word stems for
+each word of the request), the way /doctors and /availability/specialty need it, and
+spoken names resolve by whole word, substring, sound, then spelling. Branches
+resolve from an id or a spoken name, never from a boolean.
+"""
+import pytest
+
+from app.services.doctor_directory import BranchPartition, DirectoryState, DoctorEntry, name_tokens, normalize_name, specialty_matches
+
+
+def partition(*names):
+    return BranchPartition([
+        DoctorEntry(doctor_id, name, "General Medicine", 1, "Al Safa", normalize_name(name), name_tokens(name))
+        for doctor_id, name in enumerate(names, start=1)
+    ])
+
+
+@pytest.mark.parametrize("needle, specialization", [
+    ("cardiologist", "Cardiology"),
+    ("cardio", "Cardiologist"),
+    ("Cardiology", "cardiology"),
+    ("ENT", "ENT"),
+    ("surgery", "General Surgery"),
+    ("general surgery", "General Surgery"),
+    ("pediatrics specialist", "Pediatrics"),
+    ("internal med", "Internal Medicine"),
+    ("general surg", "General Surgery"),
+    ("obstetrics gyn", "Obstetrics & Gynaecology"),
+])
+def test_matches(needle, specialization):
+    assert specialty_matches(needle, specialization)
+
+
+@pytest.mark.parametrize("needle, specialization", [
+    ("ENT", "Dentistry"),
+    ("ENT", "Dentist"),
+    ("General Surgery", "Surgery"),
+    ("general cardiology", "General Surgery"),
+    ("internal med", "Emergency Medicine"),
+    ("cardiology", "Dermatology"),
+    ("", "Cardiology"),
+    ("cardiology", None),
+])
+def test_does_not_match(needle, specialization):
+    assert not specialty_matches(needle, specialization)
+
+
+def test_whole_words_come_before_substrings():
+    doctors = partition("Anna Smithson", "John Smith")
+    assert doctors.resolve("smith").name == "John Smith"
+    assert doctors.resolve("smiths").name == "Anna Smithson"
+
+
+def test_sound_comes_before_spelling():
+    # WRatio alone prefers "Shuma Rao"; "shurma" sounds like Sharma
+    doctors = partition("Shuma Rao", "Priya Sharma")
+    assert doctors.resolve("shurma").name == "Priya Sharma"
+
+
+@pytest.mark.parametrize("spoken, name", [
+    ("khan ahmad", "Ahmed Khan"),
+    ("liz taylor", "Elizabeth Taylor"),
+    ("joanis papa", "Ioannis Papadopoulos"),  # no word sounds right: spelling fallback
+])
+def test_resolves(spoken, name):
+    doctors = partition("Ahmed Khan", "Elizabeth Taylor", "Ioannis Papadopoulos")
+    assert doctors.resolve(spoken).name == name
+
+
+@pytest.mark.parametrize("spoken", ["tina", "nair", ""])
+def test_colliding_keys_need_a_close_spelling(spoken):
+    # "tina" and "Dan", "nair" and "Nour" share every phonetic key but little else
+    assert partition("Dan Brown", "Nour Haddad").resolve(spoken) is None
+
+
+@pytest.mark.parametrize("branch, branch_id", [
+    (2, 2),
+    ("2", 2),
+    ("safa branch", 1),
+    ("Jumeira", 2),
+    (True, None),
+    (False, None),
+    ("", None),
+])
+def test_branch_id_for(branch, branch_id):
+    state = DirectoryState([
+        DoctorEntry(1, "Sara Khan", "Cardiology", 1, "Al Safa", "sara khan", name_tokens("Sara Khan")),
+        DoctorEntry(2, "Omar Haddad", "Neurology", 2, "Jumeirah", "omar haddad", name_tokens("Omar Haddad")),
+    ])
+    assert state.branch_id_for(branch) == branch_id
@@ -0,0 +1,140 @@
+"""
+The BM25 inverted index behind KnowledgeBase.search: prefix expansion of query
+words, ranking that prefers passages containing every word, and apply(), which
+must give the same index as a rebuild without touching the one it started from.
+Misspelled words (speech-to-text errors) map to their nearest indexed terms.
+"""
+import pytest
+
+from app.services.kb_index import MAX_EXPANSIONS, InvertedIndex, TrigramIndex, edit_distance
+
+TEXTS = [
+    "Cardiology clinic opening hours are 8am to 8pm.",
+    "Free parking is available at the Al Safa branch.",
+    "Our cardiologists treat heart rhythm disorders.",
+    "Visiting hours for inpatients end at 9pm.",
+    "The cardiology team offers heart screening and parking validation.",
+]
+
+
+def test_builds_sorted_postings():
+    index = InvertedIndex(TEXTS)
+    assert index.vocab == sorted(index.postings)
+    assert index.num_docs == len(TEXTS)
+    assert index.total_length == sum(index.doc_lengths)
+    pids, tfs = index.postings["parking"]
+    assert (list(pids), list(tfs)) == ([1, 4], [1, 1])
+
+
+def test_expand_adds_prefix_matches():
+    index = InvertedIndex(TEXTS)
+    assert index.expand("cardio") == ["cardiologists", "cardiology"]
+    assert index.expand("cardiology") == ["cardiology"]
+    assert index.expand("car") == []  # too short to expand
+
+
+def test_expand_is_capped():
+    index = InvertedIndex([f"cardio{i:02d}" for i in range(2 * MAX_EXPANSIONS)])
+    assert len(index.expand("cardio")) == MAX_EXPANSIONS
+
+
+def test_passages_with_every_word_win():
+    scores = InvertedIndex(TEXTS).score(["cardiology", "parking"], limit=1)
+    assert list(scores) == [4]
+
+
+def test_falls_back_to_any_word():
+    scores = InvertedIndex(TEXTS).score(["cardiology", "parking"], limit=3)
+    assert set(scores) == {0, 1, 4}
+    assert max(scores, key=scores.get) == 4
+
+
+def test_score_many_matches_score():
+    index = InvertedIndex(TEXTS)
+    queries = [["heart"], ["visiting", "hours"], ["parking", "cardio"]]
+    assert index.score_many(queries, limit=3) == [index.score(words, limit=3) for words in queries]
+
+
+def snapshot(index):
+    return (
+        {term: (list(pids), list(tfs)) for term, (pids, tfs) in index.postings.items()},
+        list(index.vocab), list(index.doc_lengths), index.num_docs, index.total_length,
+    )
+
+
+def rebuilt(texts):
+    """A from-scratch index over {passage_id: text}, with removed ids left as tombstones."""
+    index = InvertedIndex()
+    index._ingest({}, texts)
+    return index
+
+
+def test_apply_matches_a_rebuild():
+    old = InvertedIndex(TEXTS)
+    before = snapshot(old)
+    added = {5: "Parking for visitors is free on weekends.", 6: "Dermatology clinic hours."}
+    new = old.apply({1: TEXTS[1], 3: TEXTS[3]}, added)
+
+    live = {pid: text for pid, text in enumerate(TEXTS) if pid not in (1, 3)}
+    assert snapshot(new) == snapshot(rebuilt({**live, **added}))
+    assert snapshot(old) == before  # copy-on-write: the published index is unchanged
+
+
+def test_apply_shares_untouched_postings():
+    old = InvertedIndex(TEXTS)
+    new = old.apply({3: TEXTS[3]}, {})
+    assert new.postings["heart"] is old.postings["heart"]
+    assert "inpatients" not in new.postings and "inpatients" not in new.vocab
+    assert new.postings["hours"][0].tolist() == [0]
+
+
+VOCAB = ["cardiology", "cardiologist", "dermatology", "neurology", "parking", "park", "pediatrics", "visiting"]
+
+
+@pytest.mark.parametrize("a, b, distance", [
+    ("cardiology", "cardiology", 0),
+    ("cardiolgy", "cardiology", 1),
+    ("cadriology", "cardiology", 1),  # adjacent swap
+    ("kardiolgy", "cardiology", 2),
+    ("park", "parking", 3),
+])
+def test_edit_distance(a, b, distance):
+    assert edit_distance(a, b, 3) == distance
+
+
+@pytest.mark.parametrize("word, terms", [
+    ("cardiolgy", ["cardiology"]),
+    ("cadriology", ["cardiology"]),
+    ("pediatrix", ["pediatrics"]),
+    ("visitng", ["visiting"]),
+    ("parkin", ["parking"]),
+    ("prak", []),       # short words only get one edit
+    ("oncology", []),
+])
+def test_lookup(word, terms):
+    assert TrigramIndex(VOCAB).lookup(word) == terms
+
+
+def test_trigram_apply_matches_a_rebuild():
+    old = TrigramIndex(VOCAB)
+    before = dict(old.grams)
+    new = old.apply(["oncology", "urology"], ["neurology", "park"])
+
+    rebuilt = TrigramIndex([t for t in VOCAB if t not in ("neurology", "park")] + ["oncology", "urology"])
+    assert {k: sorted(v) for k, v in new.grams.items()} == {k: sorted(v) for k, v in rebuilt.grams.items()}
+    assert old.grams == before
+
+
+def test_expand_corrects_unknown_words_only():
+    index = InvertedIndex(TEXTS)
+    assert index.expand("cardiolgy") == ["cardiology"]
+    assert index.expand("hrt") == []  # too short to correct
+    assert index.expand("parking") == ["parking"]
+
+
+def test_apply_updates_a_built_typo_index():
+    old = InvertedIndex(TEXTS)
+    assert old.expand("cardiolgy") == ["cardiology"]
+    new = old.apply({0: TEXTS[0], 4: TEXTS[4]}, {5: "Dermatology clinic hours."})
+    assert new.expand("dermatolgy") == ["dermatology"]
+    assert new.expand("cardiolgy") == []
@@ -0,0 +1,46 @@
+"""
+The shared-memory KB: a worker attaches to what the loader published, moves to a
+republished generation on refresh, and a data segment left over by a loader that
+died mid-publish doesn't stop the next publish.
+"""
+import os
+from multiprocessing import shared_memory
+
+import pytest
+
+from app.services import kb_shared
+from app.services.kb_snapshot import encode_snapshot
+
+
+def snapshot(*titles):
+    data, _ = encode_snapshot([{"title": t, "url": f"https://example.com/{i}", "content": f"{t} opening hours."} for i, t in enumerate(titles)])
+    return bytes(data)
+
+
+@pytest.fixture
+def name():
+    name = f"test_kb_{os.getpid()}"
+    yield name
+    kb_shared.unpublish(name)
+
+
+def test_attach_and_refresh(name):
+    assert kb_shared.publish(snapshot("Parking"), name) == 1
+    state = kb_shared.attach(name)
+    assert (state.generation, state.num_documents, state.documents[0]["title"]) == (1, 1, "Parking")
+    assert state.refresh() is None
+
+    kb_shared.publish(snapshot("Parking", "Visiting hours"), name)
+    new = state.refresh()
+    assert (new.generation, new.num_documents) == (2, 2)
+    assert state.documents[0]["title"] == "Parking"  # the old generation stays readable after its unlink
+
+
+def test_publish_replaces_a_leftover_segment(name):
+    kb_shared.publish(snapshot("Parking"), name)
+    leftover = shared_memory.SharedMemory(f"{name}_2", create=True, size=16)
+    kb_shared._untrack(leftover)
+    leftover.close()
+
+    assert kb_shared.publish(snapshot("Visiting hours"), name) == 2
+    assert kb_shared.attach(name).documents[0]["title"] == "Visiting hours"
@@ -0,0 +1,70 @@
+"""
+A KB snapshot maps back to the documents, passages and index it was built from
+(non-ASCII content included), and refresh() only picks up a rebuilt file.
+"""
+import pytest
+
+from app.services.kb_index import FAQ_TYPE, InvertedIndex, split_passages
+from app.services.kb_snapshot import open_snapshot, write_snapshot
+
+DOCUMENTS = [
+    {"title": "Parking", "url": "https://example.com/parking", "type": "page", "aliases": [],
+     "content": "Free parking is available at every branch. " * 20},
+    {"title": "FAQ: Do you accept Daman?", "url": "", "type": FAQ_TYPE, "aliases": ["daman insurance", "is daman accepted"],
+     "content": "Yes, we accept Daman – including Enhanced and Thiqa plans. Café hours: 7am–10pm."},
+    {"title": "Cardiology", "url": "https://example.com/cardiology", "type": "page", "aliases": [],
+     "content": "Our cardiologists treat heart rhythm disorders. Dr. Müller leads the team."},
+]
+
+
+@pytest.fixture
+def path(tmp_path):
+    path = str(tmp_path / "kb.snapshot")
+    write_snapshot(path, DOCUMENTS)
+    return path
+
+
+def test_round_trip(path):
+    state = open_snapshot(path)
+    assert [state.documents[i] for i in range(state.num_documents)] == DOCUMENTS
+    assert state.checksum != 0
+
+    texts = [doc["content"][start:end] for doc in DOCUMENTS for start, end in split_passages(doc["content"])]
+    assert [state.passage_text(pid) for pid in state.passage_ids()] == texts
+
+    index = InvertedIndex(texts)
+    assert list(state.index.vocab) == index.vocab
+    assert list(state.index.doc_lengths) == index.doc_lengths
+    assert state.index.total_length == index.total_length
+    for term in index.vocab:
+        assert [list(p) for p in state.index.postings[term]] == [list(p) for p in index.postings[term]]
+    assert state.index.score(["cardiologists"], limit=3) == index.score(["cardiologists"], limit=3)
+
+
+def test_faq_table(path):
+    state = open_snapshot(path)
+    assert [doc_id for doc_id, _ in state.faq_documents()] == [1]
+    assert state.faq == {"accept daman": 1, "daman insurance": 1, "accepted daman": 1}
+
+
+def test_is_read_only(path):
+    with pytest.raises(TypeError):
+        open_snapshot(path).index.apply({}, {0: "new text"})
+
+
+def test_refresh_picks_up_a_rebuild(path):
+    state = open_snapshot(path)
+    assert state.refresh() is None
+
+    write_snapshot(path, DOCUMENTS[:1])
+    new = state.refresh()
+    assert new.num_documents == 1
+    assert new.checksum != state.checksum
+    assert state.documents[2]["title"] == "Cardiology"  # the old mapping survives the replace
+
+
+def test_rejects_other_files(tmp_path):
+    path = tmp_path / "kb.snapshot"
+    path.write_bytes(b"not a snapshot" * 10)
+    with pytest.raises(ValueError):
+        open_snapshot(str(path))
@@ -0,0 +1,49 @@
+"""
+Phonetic keys hear spoken spellings of a name as the same name, and the
+PhoneticIndex finds names by any of their words, in any order.
+"""
+import pytest
+
+from app.services.phonetic import PhoneticIndex, double_metaphone, phonetic_keys
+
+
+@pytest.mark.parametrize("spoken, written", [
+    ("shurma", "Sharma"),
+    ("mohamad", "Muhammad"),
+    ("fatma", "Fathima"),
+    ("chaudri", "Chaudhry"),
+    ("valeed", "Waleed"),
+    ("jabar", "Jabbar"),
+    ("khaled", "Khalid"),
+])
+def test_spellings_share_a_key(spoken, written):
+    assert phonetic_keys(spoken) & phonetic_keys(written)
+
+
+@pytest.mark.parametrize("a, b", [("Sharma", "Shuma"), ("Khan", "Kapoor"), ("Smith", "Singh")])
+def test_different_names_keep_apart(a, b):
+    assert not phonetic_keys(a) & phonetic_keys(b)
+
+
+def test_ambiguous_spellings_get_an_alternate_key():
+    assert double_metaphone("Thomas") == ("0MS", "TMS")
+    assert double_metaphone("Sharma") == ("XRM", "XRM")
+    assert double_metaphone("") == ("", "")
+
+
+def test_index_matches_words_in_any_order():
+    index = PhoneticIndex(stop_words={"dr"})
+    index.add(1, "Dr. Ahmed Khan")
+    index.add(2, "Priya Sharma")
+    assert index.candidates("khan ahmad") == [(1, 1.0)]
+    assert index.candidates("dr shurma") == [(2, 1.0)]
+    assert index.candidates("ahmed smith") == [(1, 0.5)]
+    assert index.candidates("dr") == []
+
+
+def test_index_joins_adjacent_words():
+    index = PhoneticIndex()
+    index.add(1, "Abdul Rahman")
+    index.add(2, "Abdulrahman Saeed")
+    assert dict(index.candidates("abdulrahman")) == {1: 1.0, 2: 1.0}
+    assert dict(index.candidates("abdul rahman")) == {1: 1.0, 2: 1.0}
@@ -0,0 +1,57 @@
+"""
+QueryCache counts every lookup exactly once, even from many threads,
+KnowledgeBase.status() (what /health returns) carries the counters, and
+queries that only share their terms don't share a cached answer.
+"""
+import threading
+
+from app.services.kb_index import InvertedIndex, KBFile, KBState
+from app.services.rag_service import KnowledgeBase, QueryCache
+
+THREADS = 8
+LOOKUPS = 5000
+
+
+def test_counts_survive_concurrent_lookups():
+    cache = QueryCache(maxsize=10, ttl=60)
+    cache.put(("hit",), "answer")
+
+    def lookups():
+        for i in range(LOOKUPS):
+            cache.get(("hit",) if i % 2 else ("miss",))
+
+    threads = [threading.Thread(target=lookups) for _ in range(THREADS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert cache.stats() == {"hits": THREADS * LOOKUPS // 2, "misses": THREADS * LOOKUPS // 2, "size": 1, "hit_rate": 0.5}
+
+
+def test_status_reports_the_cache():
+    kb = KnowledgeBase(load=False)
+    kb.cache.get(("anything",))
+    assert kb.status()["cache"] == {"hits": 0, "misses": 1, "size": 0, "hit_rate": 0.0}
+
+
+def knowledge_base(*contents):
+    kb = KnowledgeBase(load=False)
+    documents = [{"title": f"Page {i}", "url": f"https://example.com/{i}", "content": c} for i, c in enumerate(contents)]
+    passages = [(i, 0, len(c)) for i, c in enumerate(contents)]
+    files = {f"{i}.json": KBFile(0, 0, "", i, (i,)) for i in range(len(contents))}
+    kb.state = KBState(documents, passages, InvertedIndex(list(contents)), files)
+    return kb
+
+
+def test_word_order_variants_are_cached_apart():
+    # Same terms, but each order is a phrase of a different page
+    kb = knowledge_base("Book heart surgery consultations online.", "Post surgery heart care at home.")
+    first = kb.search("heart surgery", limit=1)
+    second = kb.search("surgery heart", limit=1)
+    assert "Page 0" in first and "Page 1" in second
+    assert kb.cache.stats()["size"] == 2
+
+    assert kb.search_many(["surgery heart", "heart surgery"], limit=1) == [second, first]
+    assert kb.cache.stats()["hits"] == 2
+
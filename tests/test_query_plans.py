@@ -0,0 +1,39 @@
+"""
+The Appointment hot-path queries keep using their composite indexes: the checks
+of benchmarks/check_query_plans.py on a generated SQLite database.
+"""
+import pytest
+from sqlalchemy import text
+
+from benchmarks.check_query_plans import CASES, build_sqlite, case_plan, check, pick_sample, plan_problems
+
+ROWS = 20000  # enough for ANALYZE to make the planner prefer the indexes the way it does on big tables
+
+
+@pytest.fixture(scope="module")
+def db():
+    session = build_sqlite(ROWS, seed=0)
+    yield session
+    session.close()
+
+
+@pytest.fixture(scope="module")
+def sample(db):
+    return pick_sample(db)
+
+
+@pytest.mark.parametrize("case", CASES, ids=[case.name for case in CASES])
+def test_hot_path_uses_its_index(db, sample, case):
+    statement, plan = case_plan(db, case, sample)
+    assert plan_problems("sqlite", plan, case.index_only) == [], statement
+
+
+def test_check_fails_without_the_indexes():
+    session = build_sqlite(2000, seed=1)
+    try:
+        for name in ("ix_appointment_doctor_date_status", "ix_appointment_patient_date_status"):
+            session.execute(text(f"DROP INDEX {name}"))
+        failures = check(session)
+    finally:
+        session.close()
+    assert len(failures) >= len(CASES)
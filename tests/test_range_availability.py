@@ -0,0 +1,49 @@
+"""
+/availability/range: the "No free slots" message follows the free slots the range
+has (not the ones the answer lists), and out-of-range days/limit are clamped, not rejected.
+"""
+from datetime import date, datetime
+from types import SimpleNamespace
+
+import pytest
+
+from app.api.routes import MAX_RANGE_DAYS, AvailabilityRangeRequest, parse_range, range_availability_response
+from app.services import slots
+
+DOCTOR = SimpleNamespace(name="Sara Khan", branch_name="Al Safa")
+MONDAY = date(2030, 1, 7)
+NOW = datetime(2030, 1, 7, 8, 0)
+
+
+def booked_all_day(day):
+    return [(1, slots.slot_datetime(day, index)) for index in slots.iter_slots(slots.open_mask(day, NOW))]
+
+
+@pytest.mark.parametrize("limit, all_slots", [(0, False), (0, True), (3, False), (3, True)])
+def test_free_range_has_no_message(limit, all_slots):
+    answer = range_availability_response(DOCTOR, [], MONDAY, 3, NOW, limit, all_slots)
+    assert "message" not in answer
+    assert len(answer["next_available"]) == limit
+
+
+def test_later_free_day_is_found_with_limit_zero():
+    answer = range_availability_response(DOCTOR, booked_all_day(MONDAY), MONDAY, 2, NOW, 0, False)
+    assert "message" not in answer
+
+
+@pytest.mark.parametrize("limit, all_slots", [(0, False), (3, False), (3, True)])
+def test_fully_booked_range_says_so(limit, all_slots):
+    answer = range_availability_response(DOCTOR, booked_all_day(MONDAY), MONDAY, 1, NOW, limit, all_slots)
+    assert answer["message"] == "No free slots with Sara Khan in the next 1 days."
+    assert answer["next_available"] == []
+
+
+@pytest.mark.parametrize("days, clamped", [(0, 1), (-2, 1), (MAX_RANGE_DAYS + 1, MAX_RANGE_DAYS), (5, 5)])
+def test_days_are_clamped(days, clamped):
+    req = AvailabilityRangeRequest(doctor_name="Sara Khan", days=days, limit=-1)
+    assert parse_range(None, req.days, NOW) == (NOW.date(), clamped, None)
+
+
+def test_request_maps_the_aliases():
+    req = AvailabilityRangeRequest(doctor_name="Sara Khan", num_days=MAX_RANGE_DAYS, count=0)
+    assert (req.days, req.limit) == (MAX_RANGE_DAYS, 0)